@@ -4,3 +4,16 @@ from django.apps import AppConfig
 class APIConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "api"
+
+    def ready(self):
+        # Registers the tasks, and the receivers of their signals
+        from . import tasks  # noqa: F401
+
+        # Receivers that drop saved users from the cache
+        from . import auth  # noqa: F401
+
+        # Receivers that drop changed groups from the sessions
+        from . import groups  # noqa: F401
+
+        # Times the queries of every connection, before any is opened
+        from . import metrics  # noqa: F401
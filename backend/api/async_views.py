@@ -0,0 +1,144 @@
+from functools import wraps
+
+from django.contrib.auth.models import User
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpRequest, JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_safe
+from rest_framework import status
+from rest_framework.exceptions import APIException, NotAuthenticated, ValidationError
+
+from .availability import stream
+from .cache import acached_response, aget_list_key, get_detail_key
+from .conditional import (
+    aconditional,
+    aevent_detail_version,
+    aevent_list_version,
+    apurchases_version,
+    event_detail_etag,
+    event_detail_last_modified,
+    event_detail_version,
+    event_list_etag,
+    event_list_last_modified,
+    purchases_etag,
+    purchases_last_modified,
+)
+from .groups import aget_group_ids, eligibility_context
+from .models import Event
+from .pagination import apaginate_by_date, apaginate_by_id
+from .serializers import EventDetailSerializer, TicketSerializer, UserSerializer
+from .views import get_event_listing, get_purchases
+
+
+def async_endpoint(login_required=False):
+    """
+    Turns an async function into a read-only API view. The user is loaded
+    without blocking, and errors are answered in the same format as the
+    exception handler of the DRF views.
+    """
+
+    def decorator(view):
+        @require_safe
+        @wraps(view)
+        async def wrapper(request: HttpRequest, *args, **kwargs):
+            # Resolved here, so the rest of the view can read it without queries
+            request.user = await request.auser()
+            # Same for the groups, which cache keys and serializers read
+            await aget_group_ids(request)
+            try:
+                if login_required and not request.user.is_authenticated:
+                    raise NotAuthenticated()
+                return await view(request, *args, **kwargs)
+            except APIException as exc:
+                detail = exc.detail
+                if not isinstance(detail, (list, dict)):
+                    detail = {"detail": detail}
+                # Session authentication answers unauthenticated requests with 403
+                status_code = (
+                    status.HTTP_403_FORBIDDEN
+                    if isinstance(exc, NotAuthenticated)
+                    else exc.status_code
+                )
+                return JsonResponse({"errors": detail}, status=status_code)
+
+        return wrapper
+
+    return decorator
+
+
+@async_endpoint()
+@aconditional(aevent_list_version, event_list_etag, event_list_last_modified)
+async def event_list(request: HttpRequest):
+    return await acached_response(
+        await aget_list_key(request, event_list_etag(request)),
+        lambda: list_events(request),
+    )
+
+
+async def list_events(request: HttpRequest):
+    events, serializer_class, descending = get_event_listing(request)
+    page, next_cursor = await apaginate_by_date(events, request, descending)
+    serializer = serializer_class(page, many=True, context=eligibility_context(request))
+    return JsonResponse(
+        {"results": serializer.data, "next": next_cursor},
+        status=status.HTTP_200_OK,
+    )
+
+
+@async_endpoint()
+@aconditional(aevent_detail_version, event_detail_etag, event_detail_last_modified)
+async def event_detail(request: HttpRequest, pk: int):
+    return await acached_response(
+        get_detail_key(request, pk, event_detail_version(request, pk)),
+        lambda: retrieve_event(request, pk),
+    )
+
+
+async def retrieve_event(request: HttpRequest, pk: int):
+    try:
+        event = await Event.objects.with_ticket_types().aget(pk=pk)
+    except Event.DoesNotExist:
+        raise ValidationError("Evento não encontrado.")
+    serializer = EventDetailSerializer(
+        event,
+        context={
+            **eligibility_context(request),
+            "rating_summary": await event.arating_summary(),
+        },
+    )
+    return JsonResponse(serializer.data, status=status.HTTP_200_OK, safe=False)
+
+
+@async_endpoint()
+async def availability(request: HttpRequest, pk: int):
+    """
+    Streams the remaining seats of each ticket type of the event as they
+    change. Only ASGI servers can keep the stream open, under WSGI it sends
+    the current seats and clients poll by reconnecting.
+    """
+    if not await Event.objects.visible_to(request.user).filter(pk=pk).aexists():
+        raise ValidationError("Evento não encontrado.")
+    response = StreamingHttpResponse(
+        stream(pk, keep_open=isinstance(request, ASGIRequest)),
+        content_type="text/event-stream",
+    )
+    response["Cache-Control"] = "no-cache"
+    # Stops nginx from buffering the stream
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+@async_endpoint(login_required=True)
+@aconditional(apurchases_version, purchases_etag, purchases_last_modified)
+async def purchases(request: HttpRequest):
+    page, next_cursor = await apaginate_by_id(get_purchases(request), request)
+    serializer = TicketSerializer(page, many=True)
+    return JsonResponse(
+        {"results": serializer.data, "next": next_cursor},
+        status=status.HTTP_200_OK,
+    )
+
+
+@async_endpoint(login_required=True)
+async def user(request: HttpRequest):
+    user = await User.objects.prefetch_related("groups").aget(pk=request.user.pk)
+    return JsonResponse(UserSerializer(user).data, status=status.HTTP_200_OK)
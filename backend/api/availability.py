@@ -0,0 +1,194 @@
+import asyncio
+import json
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import cache
+from threading import Lock
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+from .models import TicketType
+
+
+class Subscription:
+    """
+    A watcher of the seats of an event. Only the latest change is kept, as
+    each one has every ticket type, so slow clients skip the ones they missed.
+    """
+
+    def __init__(self, event_id: int):
+        self.event_id = event_id
+        self.loop = asyncio.get_running_loop()
+        self.latest = None
+        self.changed = asyncio.Event()
+
+    def push(self, data: str):
+        self.latest = data
+        self.changed.set()
+
+    async def next(self, timeout: float) -> str | None:
+        """Waits for the next change, returns None if there was none in time"""
+        try:
+            await asyncio.wait_for(self.changed.wait(), timeout)
+        except TimeoutError:
+            return None
+        self.changed.clear()
+        return self.latest
+
+
+# Watchers of each event in this process
+subscriptions = defaultdict(set)
+subscriptions_lock = Lock()
+
+
+@contextmanager
+def subscribe(event_id: int):
+    subscription = Subscription(event_id)
+    with subscriptions_lock:
+        subscriptions[event_id].add(subscription)
+    get_backend().listen()
+    try:
+        yield subscription
+    finally:
+        with subscriptions_lock:
+            subscriptions[event_id].discard(subscription)
+            if not subscriptions[event_id]:
+                del subscriptions[event_id]
+
+
+def deliver(event_id: int, data: str):
+    """Hands a change to every watcher of the event in this process"""
+    with subscriptions_lock:
+        watchers = list(subscriptions.get(event_id, ()))
+    for subscription in watchers:
+        # Published from the thread of the request that made the change
+        try:
+            subscription.loop.call_soon_threadsafe(subscription.push, data)
+        except RuntimeError:
+            # Its event loop was closed before the stream could end
+            pass
+
+
+class LocalBackend:
+    """Delivers changes to the watchers of this process only"""
+
+    def wants(self, event_id: int) -> bool:
+        return event_id in subscriptions
+
+    def publish(self, event_id: int, data: str):
+        deliver(event_id, data)
+
+    def listen(self):
+        pass
+
+
+class RedisBackend:
+    """
+    Delivers changes to the watchers of every process through a Redis
+    channel, for servers with more than one process. Each process listens
+    to the channel once, whatever the number of its watchers.
+    """
+
+    CHANNEL = "availability"
+
+    def __init__(self):
+        import redis
+
+        self.client = redis.Redis.from_url(settings.REDIS_URL)
+        self.listeners = {}
+
+    def wants(self, event_id: int) -> bool:
+        # Watchers of other processes can't be seen from here
+        return True
+
+    def publish(self, event_id: int, data: str):
+        self.client.publish(self.CHANNEL, json.dumps([event_id, data]))
+
+    def listen(self):
+        loop = asyncio.get_running_loop()
+        if loop not in self.listeners or self.listeners[loop].done():
+            self.listeners[loop] = loop.create_task(self.receive())
+
+    async def receive(self):
+        import redis.asyncio
+
+        async with redis.asyncio.Redis.from_url(settings.REDIS_URL) as client:
+            async with client.pubsub() as pubsub:
+                await pubsub.subscribe(self.CHANNEL)
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        deliver(*json.loads(message["data"]))
+
+
+@cache
+def get_backend():
+    """The AVAILABILITY_BACKEND, shared by the whole process"""
+    return import_string(settings.AVAILABILITY_BACKEND)()
+
+
+def format_message(data: str) -> str:
+    return f"event: seats\ndata: {data}\n\n"
+
+
+async def read_message(event_id: int) -> str:
+    return format_message((await sync_to_async(read)([event_id]))[event_id])
+
+
+async def stream(event_id: int, keep_open: bool):
+    """
+    Server-sent events with the remaining seats of the event, first as they
+    are and then after every change. Without `keep_open` the stream ends
+    after the first message and clients reconnect after AVAILABILITY_RETRY
+    seconds, which turns it into polling for servers that can't stream.
+    """
+    retry = f"retry: {settings.AVAILABILITY_RETRY * 1000}\n"
+    if not keep_open:
+        yield retry + await read_message(event_id)
+        return
+    # Subscribed before reading, so no change is missed in between
+    with subscribe(event_id) as subscription:
+        yield retry + await read_message(event_id)
+        while True:
+            data = await subscription.next(settings.AVAILABILITY_HEARTBEAT)
+            # Comments keep proxies from closing idle connections
+            yield ": ping\n\n" if data is None else format_message(data)
+
+
+def read(event_ids) -> dict[int, str]:
+    """Remaining seats of each ticket type of the events, as SSE data"""
+    ticket_types = defaultdict(list)
+    for event_id, pk, quantity_available, tickets_sold in (
+        TicketType.objects.filter(event_id__in=event_ids)
+        .order_by("id")
+        .values_list("event_id", "id", "quantity_available", "tickets_sold")
+    ):
+        ticket_types[event_id].append(
+            {"id": pk, "remaining": quantity_available - tickets_sold}
+        )
+    return {
+        event_id: json.dumps(
+            {"event": event_id, "ticket_types": ticket_types[event_id]}
+        )
+        for event_id in event_ids
+    }
+
+
+def publish(event_ids):
+    """
+    Reads the seats of the events that have watchers once and publishes
+    them, so a change costs one query however many clients are watching.
+    """
+    backend = get_backend()
+    event_ids = [event_id for event_id in set(event_ids) if backend.wants(event_id)]
+    if event_ids:
+        for event_id, data in read(event_ids).items():
+            backend.publish(event_id, data)
+
+
+def seats_changed(event_ids):
+    """Publishes the seats of the events once the current transaction commits"""
+    event_ids = list(event_ids)
+    transaction.on_commit(lambda: publish(event_ids), robust=True)
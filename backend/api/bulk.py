@@ -0,0 +1,72 @@
+import json
+from typing import Iterable
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from rest_framework.exceptions import ValidationError
+
+from .cache import invalidate_listings
+from .models import Event, TicketType
+from .serializers import EventSerializer
+
+BATCH_SIZE = 500
+
+
+@transaction.atomic
+def insert_batch(rows: list) -> int:
+    """Inserts validated events and their ticket types with three bulk queries"""
+    events = Event.objects.bulk_create(
+        Event(**{attr: value for attr, value in row.items() if attr != "ticket_types"})
+        for row in rows
+    )
+
+    ticket_types, groups = [], []
+    for event, row in zip(events, rows):
+        for ticket_data in row.get("ticket_types", []):
+            ticket_data = dict(ticket_data)
+            ticket_groups = ticket_data.pop("groups", [])
+            # Ids refer to the exporting database, every ticket type is new here
+            ticket_data.pop("id", None)
+            ticket_type = TicketType(event=event, **ticket_data)
+            ticket_types.append(ticket_type)
+            groups.append((ticket_type, ticket_groups))
+
+    TicketType.objects.bulk_create(ticket_types)
+    TicketType.bulk_set_groups(groups)
+    invalidate_listings()
+    return len(events)
+
+
+def import_events(lines: Iterable[bytes], batch_size=BATCH_SIZE) -> dict:
+    """
+    Validates one event per JSON line and inserts them in batches of
+    `batch_size`, each in its own transaction, so the body is never held in
+    memory as a whole. Invalid lines are reported and skipped.
+    """
+    # A single serializer keeps the group lookups of every row in one query
+    serializer = EventSerializer()
+    created, errors, batch = 0, [], []
+
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            batch.append(serializer.run_validation(json.loads(line)))
+        except ValueError:
+            errors.append({"line": number, "errors": ["JSON inválido."]})
+        except ValidationError as e:
+            errors.append({"line": number, "errors": e.detail})
+
+        if len(batch) >= batch_size:
+            created += insert_batch(batch)
+            batch = []
+
+    if batch:
+        created += insert_batch(batch)
+    return {"created": created, "errors": errors}
+
+
+def export_events(events) -> Iterable[str]:
+    """Yields every event as a JSON line, fetching them `BATCH_SIZE` at a time"""
+    for event in events.with_ticket_types().order_by("id").iterator(BATCH_SIZE):
+        yield json.dumps(EventSerializer(event).data, cls=DjangoJSONEncoder) + "\n"
@@ -0,0 +1,130 @@
+from collections import Counter
+from hashlib import md5
+from threading import Lock
+from time import time_ns
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpRequest, HttpResponse
+from rest_framework.request import Request
+
+from .groups import get_group_ids
+
+GENERATION_KEY = "events:generation"
+
+stats = Counter()
+stats_lock = Lock()
+
+
+def get_cache():
+    return caches[settings.EVENT_CACHE_ALIAS]
+
+
+def record(result: str):
+    with stats_lock:
+        stats[result] += 1
+
+
+def get_audience(request: Request, with_groups=True) -> str:
+    """
+    Staff see hidden events, so they can never share an entry with the public.
+    Ticket types are flagged with whether the user can buy them, so users
+    only share entries with users of the same groups.
+    """
+    audience = "staff" if request.user.is_staff else "public"
+    if with_groups:
+        audience += ":" + ",".join(map(str, sorted(get_group_ids(request))))
+    return audience
+
+
+def make_list_key(request: Request, generation: int, etag: str) -> str:
+    query = md5(
+        "&".join(sorted(request.GET.urlencode().split("&"))).encode()
+    ).hexdigest()
+    # Summaries don't include ticket types, so they are shared by every group
+    audience = get_audience(request, request.GET.get("detail") == "full")
+    return f"events:{generation}:{etag}:{audience}:{query}"
+
+
+def get_list_key(request: Request, etag: str) -> str:
+    """
+    The ETag of the listing is part of the key, as events move between the
+    upcoming and past listings without any change to invalidate them.
+    """
+    # Starting from the current time means a generation evicted from the cache
+    # can never come back to a value that older entries were stored under
+    generation = get_cache().get_or_set(GENERATION_KEY, time_ns, None)
+    return make_list_key(request, generation, etag)
+
+
+async def aget_list_key(request: HttpRequest, etag: str) -> str:
+    generation = await get_cache().aget_or_set(GENERATION_KEY, time_ns, None)
+    return make_list_key(request, generation, etag)
+
+
+def get_detail_key(request: Request, pk: int, updated_at) -> str:
+    """
+    The version of the event is part of the key, as there are too many
+    audiences to delete the entries of each one when the event changes.
+    """
+    version = updated_at and updated_at.timestamp()
+    return f"event:{pk}:{version}:{get_audience(request)}"
+
+
+def hit_response(content: bytes) -> HttpResponse:
+    record("hits")
+    response = HttpResponse(content, content_type="application/json")
+    response["X-Cache"] = "HIT"
+    return response
+
+
+def cached_response(key: str, build) -> HttpResponse:
+    """
+    Returns the cached JSON body stored under `key`, or calls `build` to make
+    the response and caches it if it was successful.
+    """
+    cache = get_cache()
+    content = cache.get(key)
+    if content is not None:
+        return hit_response(content)
+
+    record("misses")
+    response = build()
+    if response.status_code == 200:
+        cache.set(key, response.content, settings.EVENT_CACHE_TIMEOUT)
+    response["X-Cache"] = "MISS"
+    return response
+
+
+async def acached_response(key: str, build) -> HttpResponse:
+    """Same as cached_response, for async views where `build` is a coroutine"""
+    cache = get_cache()
+    content = await cache.aget(key)
+    if content is not None:
+        return hit_response(content)
+
+    record("misses")
+    response = await build()
+    if response.status_code == 200:
+        await cache.aset(key, response.content, settings.EVENT_CACHE_TIMEOUT)
+    response["X-Cache"] = "MISS"
+    return response
+
+
+def invalidate_listings():
+    """
+    Drops every cached listing page once the current transaction commits.
+    Cached details are keyed by the updated_at of their event instead, so
+    changes to an event must bump it.
+    """
+
+    def invalidate():
+        cache = get_cache()
+        try:
+            cache.incr(GENERATION_KEY)
+        except ValueError:
+            cache.set(GENERATION_KEY, time_ns(), None)
+        record("invalidations")
+
+    transaction.on_commit(invalidate)
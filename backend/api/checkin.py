@@ -0,0 +1,208 @@
+from io import BytesIO
+from threading import Lock
+
+import qrcode
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import signing
+from django.db import connection
+from django.utils import timezone
+from PIL import Image, ImageDraw, ImageFont
+
+from .models import CheckIn, Ticket
+
+# Codes are "<event>.<ticket>.<seat>:<HMAC>", signed with the SECRET_KEY so
+# scanners can tell forged codes apart without asking the server
+signer = signing.Signer(salt="api.checkin")
+
+ADMITTED = "admitted"
+DUPLICATE = "duplicate"
+INVALID = "invalid"
+OTHER_EVENT = "other_event"
+REVOKED = "revoked"
+MESSAGES = {
+    ADMITTED: "Entrada válida.",
+    DUPLICATE: "Este lugar já entrou.",
+    INVALID: "Código inválido.",
+    OTHER_EVENT: "Este bilhete é de outro evento.",
+    REVOKED: "Este bilhete já não é válido.",
+}
+
+# A6 at 150 dpi
+PAGE_SIZE = (620, 874)
+PAGE_RESOLUTION = 150
+
+
+def make_code(event_id: int, ticket_id: int, seat: int) -> str:
+    return signer.sign(f"{event_id}.{ticket_id}.{seat}")
+
+
+def read_code(code) -> tuple[int, int, int] | None:
+    """Event, ticket and seat of a code, or None if it wasn't signed by us"""
+    try:
+        event_id, ticket_id, seat = map(int, signer.unsign(code).split("."))
+    except (signing.BadSignature, TypeError, ValueError):
+        return None
+    return event_id, ticket_id, seat
+
+
+def get_codes(ticket: Ticket) -> list[str]:
+    """One code per seat of the ticket"""
+    event_id = ticket.ticket_type.event_id
+    return [make_code(event_id, ticket.pk, seat) for seat in range(ticket.quantity)]
+
+
+def render_pdf(ticket: Ticket) -> bytes:
+    """
+    The tickets to print, one page per seat with its QR code. Expects the
+    ticket type, event and user of the ticket to be loaded.
+    """
+    event = ticket.ticket_type.event
+    date = timezone.localtime(event.date)
+    title = ImageFont.load_default(size=32)
+    text = ImageFont.load_default(size=22)
+    builder = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_M)
+    pages = []
+    for seat, code in enumerate(get_codes(ticket)):
+        builder.clear()
+        builder.add_data(code)
+        builder.make(fit=True)
+        image = builder.make_image().get_image().resize((460, 460), Image.NEAREST)
+        # Black and white pages keep the QR code sharp and the file small
+        page = Image.new("1", PAGE_SIZE, 1)
+        draw = ImageDraw.Draw(page)
+        draw.text((40, 40), event.name, font=title, fill=0)
+        draw.text((40, 90), f"{date:%d/%m/%Y %H:%M}", font=text, fill=0)
+        draw.text((40, 120), event.location, font=text, fill=0)
+        page.paste(image, (80, 180))
+        draw.text((40, 670), ticket.ticket_type.name, font=title, fill=0)
+        draw.text(
+            (40, 720), f"Lugar {seat + 1} de {ticket.quantity}", font=text, fill=0
+        )
+        draw.text(
+            (40, 750),
+            ticket.user.get_full_name() or ticket.user.username,
+            font=text,
+            fill=0,
+        )
+        pages.append(page)
+
+    output = BytesIO()
+    pages[0].save(
+        output,
+        "PDF",
+        resolution=PAGE_RESOLUTION,
+        save_all=True,
+        append_images=pages[1:],
+    )
+    return output.getvalue()
+
+
+# Checked in seats of the events recently scanned in this process, most
+# recent last. Repeated scans are rejected without querying. Check-ins are
+# never undone, so a seat found here is always checked in.
+redeemed = {}
+redeemed_lock = Lock()
+
+
+def seat_key(ticket_id: int, seat: int) -> int:
+    # Seats are small integers, below 2 ** 16
+    return ticket_id << 16 | seat
+
+
+def get_redeemed(event_id: int) -> set[int]:
+    """Checked in seats of the event, loaded once per process"""
+    with redeemed_lock:
+        seats = redeemed.pop(event_id, None)
+        if seats is None:
+            seats = {
+                seat_key(ticket_id, seat)
+                for ticket_id, seat in CheckIn.objects.filter(
+                    event_id=event_id
+                ).values_list("ticket_id", "seat")
+            }
+        redeemed[event_id] = seats
+        while len(redeemed) > settings.CHECKIN_EVENTS_IN_MEMORY:
+            del redeemed[next(iter(redeemed))]
+    return seats
+
+
+def forget_redeemed():
+    with redeemed_lock:
+        redeemed.clear()
+
+
+def check_in(event_id: int, codes: list, user: User) -> list[dict]:
+    """
+    Checks in the seats of the codes scanned at the door of the event, in
+    order. Codes are verified in memory, and seats already checked in are
+    rejected from the in-memory set, so only new seats reach the database:
+    one query to check that their tickets still exist and one INSERT that
+    skips the seats other processes checked in first.
+    Returns the status of each code.
+    """
+    seats = get_redeemed(event_id)
+    results = []
+    # First result of each seat not known to be checked in, by seat key
+    new = {}
+    for code in codes:
+        read = read_code(code)
+        result = {"status": INVALID, "ticket": None, "seat": None}
+        results.append(result)
+        if read is None:
+            continue
+        code_event_id, result["ticket"], result["seat"] = read
+        key = seat_key(result["ticket"], result["seat"])
+        if code_event_id != event_id:
+            result["status"] = OTHER_EVENT
+        elif key in seats or key in new:
+            result["status"] = DUPLICATE
+        else:
+            new[key] = result
+
+    if new:
+        # Tickets are deleted with their user, and can't lose seats otherwise
+        quantities = dict(
+            Ticket.objects.filter(
+                pk__in={result["ticket"] for result in new.values()},
+                ticket_type__event_id=event_id,
+            ).values_list("id", "quantity")
+        )
+        valid = {}
+        for key, result in new.items():
+            if result["seat"] < quantities.get(result["ticket"], 0):
+                valid[key] = result
+            else:
+                result["status"] = REVOKED
+        inserted = insert_checkins(event_id, valid.values(), user)
+        for key, result in valid.items():
+            result["status"] = ADMITTED if key in inserted else DUPLICATE
+            seats.add(key)
+
+    for result in results:
+        result["message"] = MESSAGES[result["status"]]
+    return results
+
+
+def insert_checkins(event_id: int, results, user: User) -> set[int]:
+    """
+    Inserts the check-ins in a single INSERT ... ON CONFLICT DO NOTHING.
+    Returns the keys of the seats that weren't checked in yet.
+    """
+    results = list(results)
+    if not results:
+        return set()
+    table = connection.ops.quote_name(CheckIn._meta.db_table)
+    now = connection.ops.adapt_datetimefield_value(timezone.now())
+    params = []
+    for result in results:
+        params += [result["ticket"], result["seat"], event_id, now, user.pk]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {table} "
+            "(ticket_id, seat, event_id, scanned_at, scanned_by_id) VALUES "
+            + ", ".join(["(%s, %s, %s, %s, %s)"] * len(results))
+            + " ON CONFLICT (ticket_id, seat) DO NOTHING RETURNING ticket_id, seat",
+            params,
+        )
+        return {seat_key(ticket_id, seat) for ticket_id, seat in cursor.fetchall()}
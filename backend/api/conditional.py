@@ -0,0 +1,208 @@
+from functools import wraps
+from hashlib import md5
+
+from django.db.models import Count, Max, Q
+from django.http import HttpRequest
+from django.utils import timezone
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
+from rest_framework.request import Request
+
+from .cache import get_audience
+from .models import Event, Ticket
+
+
+def get_version(request: Request, name: str, compute):
+    """
+    Computes a version only once per request, as the ETag and Last-Modified
+    callbacks of the same view both need it.
+    """
+    versions = request.__dict__.setdefault("_versions", {})
+    if name not in versions:
+        versions[name] = compute()
+    return versions[name]
+
+
+async def aget_version(request: HttpRequest, name: str, compute):
+    """
+    Computes a version ahead of an async view. The ETag and Last-Modified
+    callbacks are always called synchronously, so they can then find it
+    already computed instead of querying the database.
+    """
+    versions = request.__dict__.setdefault("_versions", {})
+    if name not in versions:
+        versions[name] = await compute()
+    return versions[name]
+
+
+def make_etag(*parts) -> str:
+    return md5("|".join(str(part) for part in parts).encode()).hexdigest()
+
+
+def event_detail_query(pk: int):
+    return Event.objects.filter(pk=pk).values_list("updated_at", flat=True)
+
+
+def event_detail_version(request: Request, pk: int):
+    return get_version(request, "event", lambda: event_detail_query(pk).first())
+
+
+async def aevent_detail_version(request: HttpRequest, pk: int):
+    return await aget_version(request, "event", event_detail_query(pk).afirst)
+
+
+def event_detail_etag(request: Request, pk: int):
+    updated_at = event_detail_version(request, pk)
+    return updated_at and make_etag(
+        "event", pk, updated_at.timestamp(), get_audience(request)
+    )
+
+
+def event_detail_last_modified(request: Request, pk: int):
+    return event_detail_version(request, pk)
+
+
+def event_list_aggregates(request: Request):
+    """
+    Versions the events of a listing with the same filters as the view.
+    Counting catches events that were deleted or hidden. Upcoming and past
+    events also change as time passes, so those listings are versioned
+    with the date of the last event to start too.
+    """
+    # Imported here, as the views import this module
+    from .views import filter_events, get_period
+
+    period = get_period(request)
+    events = filter_events(request)
+    now = timezone.now()
+    listed = {"upcoming": Q(date__gt=now), "past": Q(date__lte=now)}.get(period, Q())
+    aggregates = {
+        "updated_at": Max("updated_at", filter=listed),
+        "count": Count("id", filter=listed),
+    }
+    if period:
+        aggregates["started_at"] = Max("date", filter=Q(date__lte=now))
+    return events, aggregates
+
+
+def event_list_version(request: Request):
+    def compute():
+        events, aggregates = event_list_aggregates(request)
+        return events.aggregate(**aggregates)
+
+    return get_version(request, "events", compute)
+
+
+async def aevent_list_version(request: HttpRequest):
+    def compute():
+        events, aggregates = event_list_aggregates(request)
+        return events.aaggregate(**aggregates)
+
+    return await aget_version(request, "events", compute)
+
+
+def event_list_etag(request: Request):
+    version = event_list_version(request)
+    return make_etag(
+        "events",
+        get_audience(request),
+        request.GET.urlencode(),
+        version["updated_at"] and version["updated_at"].timestamp(),
+        version["count"],
+        version.get("started_at") and version["started_at"].timestamp(),
+    )
+
+
+def event_list_last_modified(request: Request):
+    version = event_list_version(request)
+    # An event that starts leaves the upcoming listing and joins the past one
+    dates = [version["updated_at"], version.get("started_at")]
+    return max((date for date in dates if date), default=None)
+
+
+# Purchases embed their ticket type and event, which bump the event on change
+PURCHASES_AGGREGATES = {
+    "updated_at": Max("updated_at"),
+    "event_updated_at": Max("ticket_type__event__updated_at"),
+    "count": Count("id"),
+}
+
+
+def purchases_version(request: Request):
+    return get_version(
+        request,
+        "purchases",
+        lambda: Ticket.objects.filter(user=request.user).aggregate(
+            **PURCHASES_AGGREGATES
+        ),
+    )
+
+
+async def apurchases_version(request: HttpRequest):
+    return await aget_version(
+        request,
+        "purchases",
+        lambda: Ticket.objects.filter(user=request.user).aaggregate(
+            **PURCHASES_AGGREGATES
+        ),
+    )
+
+
+def purchases_etag(request: Request):
+    version = purchases_version(request)
+    return make_etag(
+        "purchases",
+        request.user.id,
+        request.GET.urlencode(),
+        version["updated_at"] and version["updated_at"].timestamp(),
+        version["event_updated_at"] and version["event_updated_at"].timestamp(),
+        version["count"],
+    )
+
+
+def purchases_last_modified(request: Request):
+    version = purchases_version(request)
+    dates = [version["updated_at"], version["event_updated_at"]]
+    return max((date for date in dates if date), default=None)
+
+
+def conditional(etag_func, last_modified_func):
+    """
+    Answers If-None-Match/If-Modified-Since with a 304 before the view (and
+    its serializers) run. Responses are marked private and no-cache so
+    browsers always revalidate instead of showing stale data.
+    """
+
+    def decorator(method):
+        @wraps(method)
+        def wrapper(view, request: Request, *args, **kwargs):
+            response = condition(etag_func, last_modified_func)(
+                lambda request, *args, **kwargs: method(view, request, *args, **kwargs)
+            )(request, *args, **kwargs)
+            patch_cache_control(response, private=True, no_cache=True)
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def aconditional(version_func, etag_func, last_modified_func):
+    """
+    Same as conditional, for async function views. `version_func` is awaited
+    first so the synchronous ETag and Last-Modified callbacks don't query.
+    """
+
+    def decorator(view):
+        conditional_view = condition(etag_func, last_modified_func)(view)
+
+        @wraps(view)
+        async def wrapper(request: HttpRequest, *args, **kwargs):
+            await version_func(request, *args, **kwargs)
+            response = await conditional_view(request, *args, **kwargs)
+            patch_cache_control(response, private=True, no_cache=True)
+            return response
+
+        return wrapper
+
+    return decorator
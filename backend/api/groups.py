@@ -0,0 +1,135 @@
+from time import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import m2m_changed
+from django.dispatch import receiver
+from django.http import HttpRequest
+
+from .auth import get_user_cache
+
+SESSION_KEY = "group_ids"
+
+
+def version_key(user_id) -> str:
+    return f"groups:{user_id}"
+
+
+def make_entry(group_ids: frozenset, version) -> dict:
+    return {
+        "ids": sorted(group_ids),
+        "until": time() + settings.GROUPS_SESSION_TIMEOUT,
+        "version": version,
+    }
+
+
+def read_entry(entry, version):
+    """Group ids of a session entry, unless it is too old or the groups changed"""
+    if entry and entry["until"] > time() and entry.get("version") == version:
+        return frozenset(entry["ids"])
+    return None
+
+
+def remember_group_ids(request: HttpRequest, group_ids):
+    """
+    Stores the group ids of the logged in user in the session. Views that
+    already loaded the groups (login, signup, profile changes) call this so
+    eligibility checks don't have to query them again.
+    """
+    group_ids = frozenset(group_ids)
+    if settings.USER_CACHE_ALIAS:
+        version = get_user_cache().get(version_key(request.user.pk))
+        request.session[SESSION_KEY] = make_entry(group_ids, version)
+    request.__dict__["_group_ids"] = group_ids
+    return group_ids
+
+
+def get_group_ids(request: HttpRequest) -> frozenset:
+    """
+    Ids of the groups of the user, read from the session until they change
+    or expire. Only kept there with a USER_CACHE_ALIAS shared by every
+    worker, through which changes to the groups reach all of them.
+    """
+    if "_group_ids" in request.__dict__:
+        return request.__dict__["_group_ids"]
+    if not request.user.is_authenticated:
+        # Never creates a session for anonymous users
+        group_ids = frozenset()
+    elif not settings.USER_CACHE_ALIAS or getattr(request, "session", None) is None:
+        # Also when authenticated without a session, e.g. by request factories
+        group_ids = frozenset(request.user.groups.values_list("id", flat=True))
+    else:
+        version = get_user_cache().get(version_key(request.user.pk))
+        group_ids = read_entry(request.session.get(SESSION_KEY), version)
+        if group_ids is None:
+            group_ids = frozenset(request.user.groups.values_list("id", flat=True))
+            request.session[SESSION_KEY] = make_entry(group_ids, version)
+    request.__dict__["_group_ids"] = group_ids
+    return group_ids
+
+
+async def aget_group_ids(request: HttpRequest) -> frozenset:
+    """
+    Same as get_group_ids, for async views. Called ahead of the view, so
+    get_group_ids then finds the ids without touching the database.
+    """
+    if "_group_ids" in request.__dict__:
+        return request.__dict__["_group_ids"]
+    if not request.user.is_authenticated:
+        group_ids = frozenset()
+    elif not settings.USER_CACHE_ALIAS:
+        group_ids = frozenset(
+            [id async for id in request.user.groups.values_list("id", flat=True)]
+        )
+    else:
+        version = await get_user_cache().aget(version_key(request.user.pk))
+        # Loaded by request.auser(), so reading it doesn't query
+        group_ids = read_entry(await request.session.aget(SESSION_KEY), version)
+        if group_ids is None:
+            group_ids = frozenset(
+                [id async for id in request.user.groups.values_list("id", flat=True)]
+            )
+            await request.session.aset(SESSION_KEY, make_entry(group_ids, version))
+    request.__dict__["_group_ids"] = group_ids
+    return group_ids
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def forget_group_ids(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Changes the version of the groups of the users added to or removed from
+    a group, so the ids kept in their sessions are no longer used.
+    """
+    if not settings.USER_CACHE_ALIAS:
+        return
+    if not reverse:
+        if not action.startswith("post_"):
+            return
+        user_ids = [instance.pk]
+    elif action == "pre_clear":
+        # Only known before they are removed
+        user_ids = list(instance.user_set.values_list("id", flat=True))
+    elif action in ("post_add", "post_remove"):
+        user_ids = list(pk_set)
+    else:
+        return
+
+    def forget():
+        # Expires with the entries made before it, so they can't match again
+        get_user_cache().set_many(
+            {version_key(user_id): time() for user_id in user_ids},
+            settings.GROUPS_SESSION_TIMEOUT,
+        )
+
+    forget()
+    # Again once committed, in case a request stored the old groups in between
+    transaction.on_commit(forget)
+
+
+def eligibility_context(request: HttpRequest) -> dict:
+    """
+    Serializer context that flags the ticket types the user can buy. Only
+    staff see which groups each ticket type is restricted to.
+    """
+    return {"group_ids": get_group_ids(request), "show_groups": request.user.is_staff}
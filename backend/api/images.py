@@ -0,0 +1,155 @@
+import logging
+import os
+import re
+from concurrent.futures import Future, ThreadPoolExecutor
+from hashlib import sha256
+
+from django.conf import settings
+from django.core.files.move import file_move_safe
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, StopUpload
+from django.http import QueryDict
+from django.utils.datastructures import MultiValueDict
+from PIL import Image, UnidentifiedImageError
+from rest_framework.exceptions import ValidationError
+
+# Maximum width of each variant, they are never upscaled
+VARIANTS = {"thumb": 320, "card": 640, "full": 1600}
+EXTENSIONS = {"JPEG": ".jpg", "PNG": ".png", "GIF": ".gif", "WEBP": ".webp"}
+# Originals and their variants ("<hash>-thumb.webp"), never changed once written
+CONTENT_ADDRESSED = re.compile(r"^(?P<base>.*/[0-9a-f]{2}/[0-9a-f]{64})(?:-\w+)?\.\w+$")
+
+# Room for the multipart boundaries and headers around the uploaded file
+MULTIPART_OVERHEAD = 64 * 1024
+
+logger = logging.getLogger(__name__)
+
+executor = ThreadPoolExecutor(
+    max_workers=settings.IMAGE_WORKERS, thread_name_prefix="images"
+)
+
+
+def too_large_error() -> ValidationError:
+    return ValidationError(
+        f"A imagem não pode ter mais de {settings.MAX_IMAGE_UPLOAD_SIZE // 2**20} MB."
+    )
+
+
+class UploadLimitHandler(FileUploadHandler):
+    """
+    Stops reading uploads over MAX_IMAGE_UPLOAD_SIZE as they stream in, so
+    they are never stored in full. Requests announcing a larger body aren't
+    read at all. Views check `too_large` once the body has been parsed.
+    """
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.too_large = False
+        self.received = 0
+
+    def handle_raw_input(
+        self, input_data, META, content_length, boundary, encoding=None
+    ):
+        if content_length > settings.MAX_IMAGE_UPLOAD_SIZE + MULTIPART_OVERHEAD:
+            self.too_large = True
+            # Handled, with no fields and no files
+            return QueryDict(), MultiValueDict()
+
+    def receive_data_chunk(self, raw_data: bytes, start: int):
+        self.received += len(raw_data)
+        if self.received > settings.MAX_IMAGE_UPLOAD_SIZE:
+            self.too_large = True
+            raise StopUpload()
+        return raw_data
+
+    def file_complete(self, file_size: int):
+        return None
+
+
+def get_extension(uploaded_file: UploadedFile) -> str:
+    """Checks that the upload is an image we can process, by its content"""
+    try:
+        with Image.open(uploaded_file) as image:
+            image_format = image.format
+            image.verify()
+    except (UnidentifiedImageError, OSError, SyntaxError):
+        image_format = None
+    finally:
+        uploaded_file.seek(0)
+
+    if image_format not in EXTENSIONS:
+        raise ValidationError("O ficheiro não é uma imagem suportada.")
+    return EXTENSIONS[image_format]
+
+
+def save_upload(uploaded_file: UploadedFile) -> tuple[str, Future | None]:
+    """
+    Stores the upload under the hash of its content, so the same image is
+    only ever stored once. Uploads spooled to disk are moved, not copied.
+    Returns the URL of the original and the future of its variants, or None if
+    they all exist already.
+    """
+    if uploaded_file.size > settings.MAX_IMAGE_UPLOAD_SIZE:
+        raise too_large_error()
+    extension = get_extension(uploaded_file)
+
+    digest = sha256()
+    for chunk in uploaded_file.chunks():
+        digest.update(chunk)
+    name = digest.hexdigest()
+    relative_path = f"{name[:2]}/{name}{extension}"
+    path = os.path.join(settings.MEDIA_ROOT, relative_path)
+    url = f"{settings.MEDIA_URL}{relative_path}"
+
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Written under a temporary name so nobody is served half a file
+        temp_path = f"{path}.tmp"
+        if hasattr(uploaded_file, "temporary_file_path"):
+            file_move_safe(
+                uploaded_file.temporary_file_path(), temp_path, allow_overwrite=True
+            )
+        else:
+            with open(temp_path, "wb") as temp:
+                for chunk in uploaded_file.chunks():
+                    temp.write(chunk)
+        os.replace(temp_path, path)
+    elif all(os.path.exists(variant) for variant in get_variant_paths(path)):
+        return url, None
+
+    # Also when a previous upload failed to make them
+    future = executor.submit(create_variants, path)
+    future.add_done_callback(log_failure)
+    return url, future
+
+
+def log_failure(future: Future):
+    if future.exception():
+        logger.error("Could not create image variants", exc_info=future.exception())
+
+
+def get_variant_paths(path: str) -> list[str]:
+    base = os.path.splitext(path)[0]
+    return [f"{base}-{variant}.webp" for variant in VARIANTS]
+
+
+def create_variants(path: str):
+    """Writes a resized WebP copy of the image for every variant"""
+    base = os.path.splitext(path)[0]
+    with Image.open(path) as image:
+        image = image.convert("RGBA" if image.mode in ("RGBA", "LA", "P") else "RGB")
+        for variant, width in VARIANTS.items():
+            resized = image.copy()
+            resized.thumbnail((width, width * 10))
+            # Written under a temporary name so nobody is served half a file
+            temp_path = f"{base}-{variant}.tmp"
+            resized.save(temp_path, "WEBP", quality=80)
+            os.replace(temp_path, f"{base}-{variant}.webp")
+
+
+def get_variant_urls(image_url: str | None) -> dict | None:
+    """URLs of the variants of an uploaded image, None for older uploads"""
+    match = image_url and CONTENT_ADDRESSED.match(image_url)
+    if not match:
+        return None
+    return {variant: f"{match['base']}-{variant}.webp" for variant in VARIANTS}
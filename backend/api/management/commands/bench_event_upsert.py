@@ -0,0 +1,82 @@
+from time import perf_counter
+
+from django.contrib.auth.models import Group
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from api.models import Event
+from api.serializers import EventSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        "Mede o número de queries e a latência de criar e editar eventos com "
+        "1, 10 e 100 tipos de bilhete. Nada é guardado na base de dados."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes", type=int, nargs="+", default=[1, 10, 100], metavar="N"
+        )
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def payload(self, size: int, groups: list, ids=()):
+        return {
+            "name": "Benchmark",
+            "date": timezone.now().isoformat(),
+            "description": "Benchmark",
+            "location": "ISCTE",
+            "latitude": 38.7,
+            "longitude": -9.1,
+            "ticket_types": [
+                {
+                    **({"id": ids[i]} if i < len(ids) else {}),
+                    "name": f"Tipo {i}",
+                    "price": "5.00",
+                    "quantity_available": 100,
+                    "groups": groups,
+                }
+                for i in range(size)
+            ],
+        }
+
+    def measure(self, save):
+        with CaptureQueriesContext(connection) as ctx:
+            start = perf_counter()
+            data = save()
+            elapsed = perf_counter() - start
+        return len(ctx.captured_queries), elapsed * 1000, data
+
+    def save(self, data: dict, instance=None):
+        serializer = EventSerializer(instance, data=data, partial=True)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return serializer.data
+
+    def handle(self, *args, sizes, repeat, **options):
+        self.stdout.write(
+            f"{'tipos':>6} {'criar (queries)':>16} {'criar (ms)':>11} "
+            f"{'editar (queries)':>17} {'editar (ms)':>12}"
+        )
+        with transaction.atomic():
+            groups = [Group.objects.get_or_create(name="Benchmark")[0].id]
+            for size in sizes:
+                create_times, update_times = [], []
+                for _ in range(repeat):
+                    create_queries, elapsed, event = self.measure(
+                        lambda: self.save(self.payload(size, groups))
+                    )
+                    create_times.append(elapsed)
+                    ids = [t["id"] for t in event["ticket_types"]]
+                    instance = Event.objects.get(pk=event["id"])
+                    update_queries, elapsed, _ = self.measure(
+                        lambda: self.save(self.payload(size, groups, ids), instance)
+                    )
+                    update_times.append(elapsed)
+                self.stdout.write(
+                    f"{size:>6} {create_queries:>16} {min(create_times):>11.1f} "
+                    f"{update_queries:>17} {min(update_times):>12.1f}"
+                )
+            transaction.set_rollback(True)
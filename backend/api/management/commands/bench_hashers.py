@@ -0,0 +1,105 @@
+from concurrent.futures import ThreadPoolExecutor
+from statistics import median
+from time import perf_counter
+
+from django.contrib.auth.hashers import Argon2PasswordHasher, get_hashers
+from django.core.management.base import BaseCommand, CommandError
+
+PASSWORD = "Palavra-passe-1"
+# Attributes that set the cost of Django's hashers
+COST_ATTRIBUTES = [
+    "iterations",
+    "rounds",
+    "time_cost",
+    "memory_cost",
+    "work_factor",
+    "block_size",
+    "parallelism",
+]
+
+
+def argon2_hasher(value: str) -> Argon2PasswordHasher:
+    """Argon2 hasher with the costs given as time,memory (KiB),parallelism"""
+    try:
+        time_cost, memory_cost, parallelism = map(int, value.split(","))
+    except ValueError:
+        raise CommandError(f"Custos inválidos: {value} (esperado t,m,p).")
+    return type(
+        "Argon2PasswordHasher",
+        (Argon2PasswordHasher,),
+        {
+            "time_cost": time_cost,
+            "memory_cost": memory_cost,
+            "parallelism": parallelism,
+        },
+    )()
+
+
+class Command(BaseCommand):
+    help = (
+        "Mede o custo de cada algoritmo de PASSWORD_HASHERS, e de custos de "
+        "Argon2 a experimentar, para escolher os parâmetros do primeiro."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rounds", type=int, default=10, metavar="N")
+        parser.add_argument("--threads", type=int, nargs="+", default=[1, 4])
+        parser.add_argument(
+            "--argon2",
+            nargs="+",
+            default=[],
+            metavar="T,M,P",
+            help="Custos de Argon2 a medir além dos configurados, e.g. 2,19456,1",
+        )
+
+    def time(self, function, rounds: int) -> float:
+        """Median duration of `function`, in ms"""
+        durations = []
+        for _ in range(rounds):
+            start = perf_counter()
+            function()
+            durations.append(perf_counter() - start)
+        return median(durations) * 1000
+
+    def throughput(self, hasher, encoded: str, threads: int, rounds: int) -> float:
+        """Checks per second with `threads` logins at the same time"""
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            start = perf_counter()
+            list(
+                executor.map(
+                    lambda _: hasher.verify(PASSWORD, encoded), range(threads * rounds)
+                )
+            )
+            return threads * rounds / (perf_counter() - start)
+
+    def handle(self, *args, rounds, threads, argon2, **options):
+        hashers = get_hashers() + [argon2_hasher(value) for value in argon2]
+        self.stdout.write(
+            f"{'algoritmo':<20} {'custos':<50} {'hash (ms)':>9} "
+            f"{'verif. (ms)':>11} "
+            + " ".join(f"{f'{count} threads/s':>12}" for count in threads)
+        )
+        for hasher in hashers:
+            costs = ", ".join(
+                f"{name}={getattr(hasher, name)}"
+                for name in COST_ATTRIBUTES
+                if hasattr(hasher, name)
+            )
+            try:
+                encoded = hasher.encode(PASSWORD, hasher.salt())
+            except ValueError:
+                # The library of the hasher isn't installed
+                self.stdout.write(f"{hasher.algorithm:<20} indisponível")
+                continue
+            encode_ms = self.time(
+                lambda: hasher.encode(PASSWORD, hasher.salt()), rounds
+            )
+            verify_ms = self.time(lambda: hasher.verify(PASSWORD, encoded), rounds)
+            self.stdout.write(
+                f"{hasher.algorithm:<20} {costs:<50} {encode_ms:>9.1f} "
+                f"{verify_ms:>11.1f} "
+                + " ".join(
+                    f"{self.throughput(hasher, encoded, count, rounds):>12.0f}"
+                    for count in threads
+                )
+            )
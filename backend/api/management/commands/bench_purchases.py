@@ -0,0 +1,97 @@
+from concurrent.futures import ThreadPoolExecutor
+from statistics import quantiles
+from time import perf_counter
+
+from django.contrib.auth.models import Group, User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from api.models import Event, Ticket, TicketType
+from api.views import PurchasesView
+
+
+class Command(BaseCommand):
+    help = (
+        "Mede o débito de compras concorrentes na base de dados configurada. "
+        "Os dados criados são apagados no fim."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, nargs="+", default=[1, 4, 16])
+        parser.add_argument("--purchases", type=int, default=50, metavar="N")
+
+    def buyer(self, user: User, ticket_type: TicketType, purchases: int):
+        factory = APIRequestFactory()
+        view = PurchasesView.as_view()
+        latencies, errors = [], 0
+        try:
+            for _ in range(purchases):
+                request = factory.post(
+                    "/api/purchases/",
+                    {"ticket_type_id": ticket_type.id, "quantity": 1},
+                    format="json",
+                )
+                force_authenticate(request, user)
+                start = perf_counter()
+                try:
+                    response = view(request)
+                    if response.status_code >= 400:
+                        errors += 1
+                except Exception:
+                    # e.g. "database is locked" once the busy timeout runs out
+                    errors += 1
+                latencies.append(perf_counter() - start)
+        finally:
+            connection.close()
+        return latencies, errors
+
+    def handle(self, *args, threads, purchases, **options):
+        self.stdout.write(
+            f"{connection.vendor}: {'threads':>7} {'compras/s':>10} "
+            f"{'p50 (ms)':>9} {'p99 (ms)':>9} {'erros':>6}"
+        )
+        group, _ = Group.objects.get_or_create(name="Benchmark")
+        event = Event.objects.create(
+            name="Benchmark",
+            date=timezone.now(),
+            description="Benchmark",
+            location="ISCTE",
+            latitude=38.7,
+            longitude=-9.1,
+        )
+        ticket_type = TicketType.objects.create(
+            event=event, name="Benchmark", price=5, quantity_available=30000
+        )
+        ticket_type.groups.set([group])
+        users = [
+            User.objects.create_user(username=f"benchmark{i}")
+            for i in range(max(threads))
+        ]
+        group.user_set.add(*users)
+        try:
+            for count in threads:
+                with ThreadPoolExecutor(max_workers=count) as executor:
+                    start = perf_counter()
+                    results = list(
+                        executor.map(
+                            lambda user: self.buyer(user, ticket_type, purchases),
+                            users[:count],
+                        )
+                    )
+                    elapsed = perf_counter() - start
+                latencies = [latency for result in results for latency in result[0]]
+                errors = sum(result[1] for result in results)
+                percentiles = quantiles(latencies, n=100)
+                self.stdout.write(
+                    f"{'':>{len(connection.vendor) + 1}} {count:>7} "
+                    f"{(len(latencies) - errors) / elapsed:>10.0f} "
+                    f"{percentiles[49] * 1000:>9.1f} {percentiles[98] * 1000:>9.1f} "
+                    f"{errors:>6}"
+                )
+        finally:
+            Ticket.objects.filter(ticket_type=ticket_type).delete()
+            event.delete()
+            User.objects.filter(pk__in=[user.pk for user in users]).delete()
+            group.delete()
@@ -0,0 +1,243 @@
+import json
+import random
+import re
+from collections import defaultdict
+from http.client import HTTPConnection
+from http.cookies import SimpleCookie
+from statistics import quantiles
+from threading import Thread
+from time import perf_counter
+from urllib.parse import urlencode, urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+from .seed_benchmark import PASSWORD, USER_PREFIX, WORDS
+
+QUERIES = re.compile(r'desc="(\d+) queries"')
+SCENARIOS = ["browse", "open", "buy", "rate", "profile", "search"]
+
+
+class Session:
+    """
+    Keep-alive HTTP connection with cookies and CSRF token, like a browser.
+    Every request is recorded under its endpoint.
+    """
+
+    def __init__(self, url: str, results: dict):
+        parts = urlsplit(url)
+        self.connection = HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+        self.cookies = {}
+        self.results = results
+
+    def request(self, method: str, endpoint: str, path: str, body=None, **params):
+        if params:
+            path += "?" + urlencode(params)
+        headers = {"Content-Type": "application/json"}
+        if self.cookies:
+            headers["Cookie"] = "; ".join(f"{k}={v}" for k, v in self.cookies.items())
+        if "csrftoken" in self.cookies:
+            headers["X-CSRFToken"] = self.cookies["csrftoken"]
+
+        start = perf_counter()
+        self.connection.request(
+            method, path, body=body and json.dumps(body), headers=headers
+        )
+        response = self.connection.getresponse()
+        content = response.read()
+        latency = perf_counter() - start
+
+        for header in response.headers.get_all("Set-Cookie") or []:
+            for name, morsel in SimpleCookie(header).items():
+                self.cookies[name] = morsel.value
+        queries = QUERIES.search(response.headers.get("Server-Timing", ""))
+        self.results[f"{method} {endpoint}"].append(
+            (latency, response.status, queries and int(queries[1]))
+        )
+        if response.status >= 400 or not content:
+            return None
+        return json.loads(content)
+
+    def get(self, endpoint: str, path: str = None, **params):
+        return self.request("GET", endpoint, path or endpoint, **params)
+
+
+class Command(BaseCommand):
+    help = (
+        "Corre cenários de utilização (ver a página inicial, abrir um evento, "
+        "comprar, avaliar, ver o perfil, pesquisar) contra um servidor em "
+        "execução com os dados do seed_benchmark, e mostra o débito, a latência "
+        "(p50, p95, p99) e as queries por pedido de cada endpoint."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("url", help="p.ex. http://127.0.0.1:8000")
+        parser.add_argument(
+            "--users", type=int, default=8, help="Utilizadores em paralelo"
+        )
+        parser.add_argument("--iterations", type=int, default=20)
+        parser.add_argument(
+            "--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS
+        )
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--save", help="Guarda o relatório neste ficheiro JSON")
+        parser.add_argument(
+            "--baseline",
+            help="Compara com um relatório guardado e falha se houver regressões",
+        )
+        parser.add_argument(
+            "--tolerance",
+            type=float,
+            default=0.25,
+            help="Aumento relativo do p95 tolerado em relação à baseline",
+        )
+
+    def user(self, url: str, number: int, options: dict, results: dict):
+        rng = random.Random(options["seed"] + number)
+        session = Session(url, results)
+        session.request(
+            "POST",
+            "/api/login/",
+            "/api/login/",
+            {"username": f"{USER_PREFIX}{number}", "password": PASSWORD},
+        )
+        scenarios = options["scenarios"]
+
+        for _ in range(options["iterations"]):
+            page = session.get("/api/events/", period="upcoming") or {"results": []}
+            if "browse" in scenarios and page.get("next"):
+                session.get("/api/events/", period="upcoming", cursor=page["next"])
+            if not page["results"]:
+                continue
+            event_id = rng.choice(page["results"])["id"]
+
+            event = None
+            if {"open", "buy"} & set(scenarios):
+                event = session.get("/api/events/<id>/", f"/api/events/{event_id}/")
+            if "open" in scenarios:
+                session.get(
+                    "/api/events/<id>/reviews/", f"/api/events/{event_id}/reviews/"
+                )
+                session.get("/api/purchases/", event=event_id, limit=1)
+
+            ticket = None
+            if "buy" in scenarios and event and event["ticket_types"]:
+                ticket_type = rng.choice(event["ticket_types"])
+                ticket = session.request(
+                    "POST",
+                    "/api/purchases/",
+                    "/api/purchases/",
+                    {"ticket_type_id": ticket_type["id"], "quantity": 1},
+                )
+            if "rate" in scenarios and ticket:
+                session.request(
+                    "PATCH",
+                    "/api/purchase/<id>/",
+                    f"/api/purchase/{ticket['id']}/",
+                    {"rating": rng.randint(1, 5), "rating_comment": "Gostei"},
+                )
+            if "profile" in scenarios:
+                session.get("/api/purchases/")
+            if "search" in scenarios:
+                session.get("/api/events/search/", q=rng.choice(WORDS))
+        session.connection.close()
+
+    def summarize(self, results: dict, elapsed: float) -> dict:
+        report = {}
+        for endpoint, samples in sorted(results.items()):
+            latencies = [latency for latency, _, _ in samples]
+            queries = [count for _, _, count in samples if count is not None]
+            percentiles = (
+                quantiles(latencies, n=100)
+                if len(latencies) > 1
+                else [latencies[0]] * 99
+            )
+            report[endpoint] = {
+                "requests": len(samples),
+                "rps": len(samples) / elapsed,
+                "p50": percentiles[49] * 1000,
+                "p95": percentiles[94] * 1000,
+                "p99": percentiles[98] * 1000,
+                "queries": sum(queries) / len(queries) if queries else None,
+                "errors": sum(1 for _, status, _ in samples if status >= 400),
+            }
+        return report
+
+    def print_report(self, report: dict, baseline: dict):
+        self.stdout.write(
+            f"{'endpoint':<34} {'pedidos':>7} {'pedidos/s':>9} {'p50 (ms)':>9} "
+            f"{'p95 (ms)':>9} {'p99 (ms)':>9} {'queries':>7} {'erros':>5}"
+        )
+        for endpoint, row in report.items():
+            queries = "-" if row["queries"] is None else f"{row['queries']:.1f}"
+            line = (
+                f"{endpoint:<34} {row['requests']:>7} {row['rps']:>9.1f} "
+                f"{row['p50']:>9.1f} {row['p95']:>9.1f} {row['p99']:>9.1f} "
+                f"{queries:>7} {row['errors']:>5}"
+            )
+            if endpoint in baseline:
+                line += f"  (p95 {row['p95'] / baseline[endpoint]['p95'] - 1:+.0%})"
+            self.stdout.write(line)
+
+    def find_regressions(self, report: dict, baseline: dict, tolerance: float):
+        regressions = []
+        for endpoint, row in report.items():
+            base = baseline.get(endpoint)
+            if not base:
+                continue
+            if row["p95"] > base["p95"] * (1 + tolerance):
+                regressions.append(
+                    f"{endpoint}: p95 {base['p95']:.1f} -> {row['p95']:.1f} ms"
+                )
+            # Query counts are deterministic, any increase is a regression
+            if (
+                row["queries"] is not None
+                and base["queries"] is not None
+                and row["queries"] > base["queries"] + 0.5
+            ):
+                regressions.append(
+                    f"{endpoint}: queries {base['queries']:.1f} -> {row['queries']:.1f}"
+                )
+        return regressions
+
+    def handle(self, *args, url, users, save, baseline, tolerance, **options):
+        results = defaultdict(list)
+        threads = [
+            Thread(target=self.user, args=(url, number, options, results))
+            for number in range(users)
+        ]
+        start = perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = perf_counter() - start
+        if not results:
+            raise CommandError("Nenhum pedido foi feito.")
+
+        report = self.summarize(results, elapsed)
+        baseline_report = {}
+        if baseline:
+            with open(baseline) as file:
+                baseline_report = json.load(file)["endpoints"]
+        self.print_report(report, baseline_report)
+        total = sum(row["requests"] for row in report.values())
+        self.stdout.write(
+            f"\n{total} pedidos em {elapsed:.1f} s ({total / elapsed:.0f}/s)"
+        )
+
+        if save:
+            with open(save, "w") as file:
+                json.dump(
+                    {
+                        "users": users,
+                        "iterations": options["iterations"],
+                        "scenarios": options["scenarios"],
+                        "endpoints": report,
+                    },
+                    file,
+                    indent=2,
+                )
+
+        regressions = self.find_regressions(report, baseline_report, tolerance)
+        if regressions:
+            raise CommandError("Regressões:\n" + "\n".join(regressions))
@@ -0,0 +1,72 @@
+from http.client import HTTPConnection
+from statistics import quantiles
+from threading import Thread
+from time import perf_counter
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        "Faz pedidos concorrentes a um servidor já em execução e mostra os "
+        "pedidos por segundo e a latência (p50, p95, p99) de cada URL."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("urls", nargs="+", metavar="URL")
+        parser.add_argument("--concurrency", type=int, default=32)
+        parser.add_argument("--requests", type=int, default=2000)
+        parser.add_argument(
+            "--cookie", help="Cabeçalho Cookie a enviar, p.ex. sessionid=..."
+        )
+
+    def worker(self, url, count: int, headers: dict, latencies: list, errors: list):
+        # One keep-alive connection per worker, like a browser tab
+        parts = urlsplit(url)
+        path = parts.path + (f"?{parts.query}" if parts.query else "")
+        connection = HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+        for _ in range(count):
+            start = perf_counter()
+            try:
+                connection.request("GET", path, headers=headers)
+                response = connection.getresponse()
+                response.read()
+                if response.status >= 400:
+                    errors.append(response.status)
+            except OSError as exc:
+                errors.append(exc)
+                connection.close()
+            latencies.append(perf_counter() - start)
+        connection.close()
+
+    def run(self, url, concurrency: int, total: int, headers: dict):
+        latencies, errors = [], []
+        threads = [
+            Thread(
+                target=self.worker,
+                args=(url, total // concurrency, headers, latencies, errors),
+            )
+            for _ in range(concurrency)
+        ]
+        start = perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return latencies, errors, perf_counter() - start
+
+    def handle(self, *args, urls, concurrency, requests, cookie, **options):
+        headers = {"Cookie": cookie} if cookie else {}
+        self.stdout.write(
+            f"{'url':<56} {'pedidos/s':>10} {'p50 (ms)':>9} "
+            f"{'p95 (ms)':>9} {'p99 (ms)':>9} {'erros':>6}"
+        )
+        for url in urls:
+            latencies, errors, elapsed = self.run(url, concurrency, requests, headers)
+            percentiles = quantiles(latencies, n=100)
+            self.stdout.write(
+                f"{url:<56} {len(latencies) / elapsed:>10.0f} "
+                f"{percentiles[49] * 1000:>9.1f} {percentiles[94] * 1000:>9.1f} "
+                f"{percentiles[98] * 1000:>9.1f} {len(errors):>6}"
+            )
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from api.stats import rebuild
+
+
+class Command(BaseCommand):
+    help = (
+        "Recalcula as tabelas de estatísticas (vendas por dia e avaliações) a "
+        "partir dos bilhetes, para preencher dados antigos ou corrigir desvios."
+    )
+
+    def handle(self, *args, **options):
+        sales, ratings = rebuild()
+        self.stdout.write(
+            f"Escritas {sales} linhas de vendas e {ratings} de avaliações."
+        )
@@ -0,0 +1,27 @@
+from time import sleep
+
+from django.core.management.base import BaseCommand
+
+from api.reservations import release_expired
+
+
+class Command(BaseCommand):
+    help = (
+        "Devolve ao inventário os lugares das reservas expiradas. Com --interval "
+        "continua a correr e repete a limpeza a cada intervalo."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument(
+            "--interval", type=float, help="Segundos entre limpezas (corre sempre)"
+        )
+
+    def handle(self, *args, batch_size, interval, **options):
+        while True:
+            released = release_expired(batch_size)
+            if released or interval is None:
+                self.stdout.write(f"Libertados {released} lugares.")
+            if interval is None:
+                return
+            sleep(interval)
@@ -0,0 +1,80 @@
+import multiprocessing
+import signal
+from time import monotonic, sleep
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from api.tasks import claim, purge_finished, requeue_stale, run, run_pending
+
+# Seconds between deletions of old finished tasks
+PURGE_INTERVAL = 3600
+
+
+def work(batch_size: int, poll_interval: float):
+    """Loop of a worker process: runs due tasks, and waits when there are none"""
+    # Stops after the current batch instead of abandoning its tasks. Ctrl+C
+    # reaches every process, the parent then stops the workers with SIGTERM.
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda *args: stopping.append(True))
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    last_purge = 0
+    while not stopping:
+        batch = claim(batch_size)
+        for task in batch:
+            run(task)
+        if batch:
+            continue
+        requeue_stale()
+        if monotonic() - last_purge > PURGE_INTERVAL:
+            purge_finished()
+            last_purge = monotonic()
+        sleep(poll_interval)
+
+
+class Command(BaseCommand):
+    help = (
+        "Corre as tarefas em segundo plano (e-mails de confirmação, etc.) com "
+        "um conjunto de processos. Com --once corre as tarefas pendentes e sai."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--processes", type=int, default=2)
+        parser.add_argument("--batch-size", type=int, default=10)
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=1,
+            help="Segundos de espera quando não há tarefas",
+        )
+        parser.add_argument(
+            "--once", action="store_true", help="Corre as tarefas pendentes e sai"
+        )
+
+    def handle(self, *args, processes, batch_size, poll_interval, once, **options):
+        if once:
+            requeue_stale()
+            count = run_pending(batch_size)
+            self.stdout.write(f"Corridas {count} tarefas.")
+            return
+
+        # Forked processes can't share the parent's database connections
+        connections.close_all()
+        context = multiprocessing.get_context("fork")
+        workers = [
+            context.Process(target=work, args=(batch_size, poll_interval))
+            for _ in range(processes)
+        ]
+        for worker in workers:
+            worker.start()
+        self.stdout.write(f"{processes} processos à espera de tarefas.")
+        # Process managers stop services with SIGTERM, handled like Ctrl+C
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        try:
+            for worker in workers:
+                worker.join()
+        except KeyboardInterrupt:
+            for worker in workers:
+                worker.terminate()
+            for worker in workers:
+                worker.join()
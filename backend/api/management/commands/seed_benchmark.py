@@ -0,0 +1,156 @@
+import random
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Group, User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from api.models import Event, Ticket, TicketType
+from api.stats import rebuild
+
+EVENT_PREFIX = "[bench]"
+USER_PREFIX = "bench-user-"
+GROUP_PREFIX = "bench-group-"
+PASSWORD = "bench-password"
+
+WORDS = (
+    "concerto festival teatro jazz rock fado cinema feira arte dança música "
+    "conferência workshop torneio futebol exposição livro poesia comédia ópera"
+).split()
+PLACES = {
+    "Lisboa": (38.72, -9.14),
+    "Porto": (41.15, -8.61),
+    "Coimbra": (40.21, -8.43),
+    "Braga": (41.55, -8.42),
+    "Faro": (37.02, -7.93),
+}
+
+
+def clear():
+    """Deletes the data of a previous run"""
+    Ticket.objects.filter(ticket_type__event__name__startswith=EVENT_PREFIX).delete()
+    Event.objects.filter(name__startswith=EVENT_PREFIX).delete()
+    User.objects.filter(username__startswith=USER_PREFIX).delete()
+    Group.objects.filter(name__startswith=GROUP_PREFIX).delete()
+
+
+@transaction.atomic
+def generate(events: int, ticket_types: int, tickets: int, users: int, groups: int):
+    """
+    Creates `events` events (a third of them in the past) with `ticket_types`
+    ticket types each, and `tickets` tickets per ticket type bought by random
+    users, half of them rated. Everything is inserted in bulk.
+    """
+    clear()
+    now = timezone.now()
+
+    group_objects = Group.objects.bulk_create(
+        Group(name=f"{GROUP_PREFIX}{i}") for i in range(groups)
+    )
+    # Hashing once, as the hasher is deliberately slow
+    password = make_password(PASSWORD)
+    user_objects = User.objects.bulk_create(
+        User(username=f"{USER_PREFIX}{i}", password=password) for i in range(users)
+    )
+    User.groups.through.objects.bulk_create(
+        User.groups.through(user_id=user.id, group_id=group_objects[i % groups].id)
+        for i, user in enumerate(user_objects)
+    )
+
+    event_objects = []
+    for i in range(events):
+        place, (latitude, longitude) = random.choice(list(PLACES.items()))
+        event_objects.append(
+            Event(
+                name=f"{EVENT_PREFIX} {' '.join(random.sample(WORDS, 2)).title()} {i}",
+                date=now + timedelta(days=random.randint(-events // 3, events)),
+                description=" ".join(random.choices(WORDS, k=40)),
+                location=place,
+                latitude=latitude + random.uniform(-0.1, 0.1),
+                longitude=longitude + random.uniform(-0.1, 0.1),
+                is_visible=True,
+            )
+        )
+    event_objects = Event.objects.bulk_create(event_objects)
+
+    ticket_type_objects = TicketType.objects.bulk_create(
+        TicketType(
+            event=event,
+            name=f"Tipo {j}",
+            price=random.choice([0, 5, 10, 15, 20]),
+            # Leaves plenty of room for the purchases of the scenarios
+            quantity_available=tickets * 3 + 1000,
+            tickets_sold=0,
+        )
+        for event in event_objects
+        for j in range(ticket_types)
+    )
+    TicketType.groups.through.objects.bulk_create(
+        TicketType.groups.through(tickettype_id=ticket_type.id, group_id=group.id)
+        for ticket_type in ticket_type_objects
+        for group in group_objects
+    )
+
+    ticket_objects = []
+    for ticket_type in ticket_type_objects:
+        # One ticket per user and ticket type
+        for user in random.sample(user_objects, min(tickets, users)):
+            quantity = random.randint(1, 4)
+            ticket_type.tickets_sold += quantity
+            rated = random.random() < 0.5
+            ticket_objects.append(
+                Ticket(
+                    ticket_type=ticket_type,
+                    user=user,
+                    quantity=quantity,
+                    rating=random.randint(1, 5) if rated else None,
+                    rating_comment="Muito bom!" if rated else None,
+                )
+            )
+    Ticket.objects.bulk_create(ticket_objects, batch_size=2000)
+    TicketType.objects.bulk_update(
+        ticket_type_objects, ["tickets_sold"], batch_size=2000
+    )
+    # The tickets were inserted without going through the purchase paths
+    rebuild()
+    return len(event_objects), len(ticket_type_objects), len(ticket_objects)
+
+
+class Command(BaseCommand):
+    help = (
+        "Gera dados para os benchmarks: eventos, tipos de bilhete, bilhetes "
+        f"avaliados, utilizadores ({USER_PREFIX}N, password {PASSWORD}) e grupos. "
+        "Os dados de uma execução anterior são apagados primeiro."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--events", type=int, default=1000)
+        parser.add_argument("--ticket-types", type=int, default=3)
+        parser.add_argument(
+            "--tickets", type=int, default=20, help="Bilhetes por tipo de bilhete"
+        )
+        parser.add_argument("--users", type=int, default=200)
+        parser.add_argument("--groups", type=int, default=3)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--clear", action="store_true", help="Só apaga os dados gerados"
+        )
+
+    def handle(self, *args, **options):
+        if options["clear"]:
+            clear()
+            return
+        random.seed(options["seed"])
+        events, ticket_types, tickets = generate(
+            options["events"],
+            options["ticket_types"],
+            options["tickets"],
+            options["users"],
+            options["groups"],
+        )
+        self.stdout.write(
+            f"Criados {events} eventos, {ticket_types} tipos de bilhete, "
+            f"{tickets} bilhetes e {options['users']} utilizadores."
+        )
@@ -0,0 +1,136 @@
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpRequest, HttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.views.decorators.http import require_safe
+
+from .images import CONTENT_ADDRESSED
+
+RANGE = re.compile(r"^bytes=(?P<start>\d*)-(?P<end>\d*)$")
+# Content addressed files never change, anything else may be replaced in place
+IMMUTABLE = "public, max-age=31536000, immutable"
+MUTABLE = "public, max-age=300, must-revalidate"
+
+
+def get_range(request: HttpRequest, size: int, etag: str):
+    """
+    Parses a single byte range of the Range header.
+    Returns (start, end) inclusive, None to send the whole file, or False if
+    the range can't be satisfied.
+    """
+    header = request.headers.get("Range")
+    if_range = request.headers.get("If-Range")
+    if not header or (if_range and if_range != etag):
+        return None
+    match = RANGE.match(header.strip())
+    # Multiple or malformed ranges may be ignored (RFC 9110, 14.2)
+    if not match or not (match["start"] or match["end"]):
+        return None
+
+    if match["start"]:
+        start = int(match["start"])
+        end = min(int(match["end"] or size - 1), size - 1)
+    else:
+        # Suffix range, the last N bytes
+        start, end = max(size - int(match["end"]), 0), size - 1
+    if start > end or start >= size:
+        return False
+    return start, end
+
+
+def offload(response: HttpResponse, path: str, relative_path: str):
+    """Hands the file over to the web server, if one is configured to send it"""
+    if settings.MEDIA_OFFLOAD == "x-sendfile":
+        response["X-Sendfile"] = path
+    elif settings.MEDIA_OFFLOAD == "x-accel-redirect":
+        response["X-Accel-Redirect"] = settings.MEDIA_ACCEL_PREFIX + relative_path
+    else:
+        return False
+    return True
+
+
+@require_safe
+def serve_media(request: HttpRequest, path: str):
+    """
+    Serves uploaded images with long-lived caching for content addressed
+    files, conditional and range requests, and optional X-Sendfile or
+    X-Accel-Redirect so the web server sends the bytes instead of Django.
+    """
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+        stat = os.stat(full_path)
+    except (OSError, SuspiciousFileOperation):
+        raise Http404("Imagem não encontrada.")
+    if not os.path.isfile(full_path):
+        raise Http404("Imagem não encontrada.")
+
+    immutable = CONTENT_ADDRESSED.match(settings.MEDIA_URL + path)
+    etag = f'"{stat.st_size:x}-{int(stat.st_mtime):x}"'
+    headers = {
+        "ETag": etag,
+        "Last-Modified": http_date(stat.st_mtime),
+        "Cache-Control": IMMUTABLE if immutable else MUTABLE,
+        "Accept-Ranges": "bytes",
+    }
+
+    not_modified = get_conditional_response(
+        request, etag=etag, last_modified=int(stat.st_mtime)
+    )
+    if not_modified is not None:
+        for header, value in headers.items():
+            not_modified[header] = value
+        return not_modified
+
+    content_type = mimetypes.guess_type(full_path)[0] or "application/octet-stream"
+    response = HttpResponse(content_type=content_type, headers=headers)
+    if offload(response, full_path, path):
+        # The web server takes care of ranges itself
+        return response
+
+    byte_range = get_range(request, stat.st_size, etag)
+    if byte_range is False:
+        response.status_code = 416
+        response["Content-Range"] = f"bytes */{stat.st_size}"
+        return response
+
+    file = open(full_path, "rb")
+    if byte_range is None:
+        response = FileResponse(file, content_type=content_type, headers=headers)
+        response["Content-Length"] = stat.st_size
+        return response
+
+    start, end = byte_range
+    file.seek(start)
+    response = FileResponse(
+        LimitedReader(file, end - start + 1),
+        status=206,
+        content_type=content_type,
+        headers=headers,
+    )
+    response["Content-Range"] = f"bytes {start}-{end}/{stat.st_size}"
+    response["Content-Length"] = end - start + 1
+    return response
+
+
+class LimitedReader:
+    """Reads at most `remaining` bytes of a file, for partial responses"""
+
+    def __init__(self, file, remaining: int):
+        self.file = file
+        self.remaining = remaining
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
@@ -0,0 +1,227 @@
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from hmac import compare_digest
+from threading import Lock
+from time import perf_counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.http import HttpRequest, HttpResponse
+from rest_framework.permissions import BasePermission
+from rest_framework.request import Request
+from rest_framework.views import APIView
+
+# Upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class RouteMetrics:
+    def __init__(self):
+        self.buckets = [0] * len(BUCKETS)
+        self.count = 0
+        self.duration = 0.0
+        self.queries = 0
+        self.db_duration = 0.0
+        self.response_bytes = 0
+        self.statuses = defaultdict(int)
+
+    def copy(self):
+        copy = RouteMetrics()
+        copy.__dict__.update(self.__dict__)
+        copy.buckets = list(self.buckets)
+        copy.statuses = dict(self.statuses)
+        return copy
+
+
+# Name, RouteMetrics attribute and description of the per route counters
+COUNTERS = [
+    ("db_queries_total", "queries", "Database queries made, per route."),
+    ("db_query_duration_seconds_total", "db_duration", "Time spent in the database."),
+    ("http_response_size_bytes_total", "response_bytes", "Bytes of response bodies."),
+]
+
+metrics = defaultdict(RouteMetrics)
+metrics_lock = Lock()
+
+
+class QueryTimer:
+    """Database execute wrapper that counts the queries of a request and times them"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += perf_counter() - start
+            self.count += 1
+
+
+# Timer of the request being answered. Context variables are copied to the
+# threads that asgiref runs sync code in, so it is seen wherever the ORM runs
+current_timer = ContextVar("query_timer", default=None)
+
+
+def time_query(execute, sql, params, many, context):
+    timer = current_timer.get()
+    if timer is None:
+        return execute(sql, params, many, context)
+    return timer(execute, sql, params, many, context)
+
+
+@receiver(connection_created)
+def install_query_timer(sender, connection, **kwargs):
+    """
+    Wraps every connection as it is opened. Connections belong to the
+    thread that opens them, and under ASGI that isn't the thread of the
+    middleware, so it can't wrap them itself.
+    """
+    if time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(time_query)
+
+
+@contextmanager
+def timing_queries(timer: QueryTimer):
+    token = current_timer.set(timer)
+    try:
+        yield
+    finally:
+        current_timer.reset(token)
+
+
+def record(request: HttpRequest, response: HttpResponse, duration, timer):
+    match = request.resolver_match
+    route = f"/{match.route}" if match else "unmatched"
+    size = None if response.streaming else len(response.content)
+
+    with metrics_lock:
+        route_metrics = metrics[route, request.method]
+        bucket = bisect_left(BUCKETS, duration)
+        if bucket < len(BUCKETS):
+            route_metrics.buckets[bucket] += 1
+        route_metrics.count += 1
+        route_metrics.duration += duration
+        route_metrics.queries += timer.count
+        route_metrics.db_duration += timer.duration
+        route_metrics.response_bytes += size or 0
+        route_metrics.statuses[response.status_code] += 1
+
+    if settings.SERVER_TIMING:
+        response["Server-Timing"] = (
+            f"app;dur={duration * 1000:.1f}, "
+            f'db;dur={timer.duration * 1000:.1f};desc="{timer.count} queries"'
+        )
+
+
+class MetricsMiddleware:
+    """
+    Records the wall time, database queries and response size of every
+    request per route, for /metrics and the Server-Timing header.
+    Works for both sync and async views without adapting them, as queries
+    are timed in the thread that runs them.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request: HttpRequest):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timer = QueryTimer()
+        start = perf_counter()
+        with timing_queries(timer):
+            response = self.get_response(request)
+        record(request, response, perf_counter() - start, timer)
+        return response
+
+    async def __acall__(self, request: HttpRequest):
+        timer = QueryTimer()
+        start = perf_counter()
+        with timing_queries(timer):
+            response = await self.get_response(request)
+        record(request, response, perf_counter() - start, timer)
+        return response
+
+
+def format_labels(**labels) -> str:
+    escaped = (
+        (name, str(value).replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n"))
+        for name, value in labels.items()
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def render_metrics() -> str:
+    """Metrics of this process in the Prometheus text format"""
+    with metrics_lock:
+        snapshot = {key: route.copy() for key, route in metrics.items()}
+
+    lines = [
+        "# HELP http_request_duration_seconds Time to answer requests, per route.",
+        "# TYPE http_request_duration_seconds histogram",
+    ]
+    for (route, method), route_metrics in snapshot.items():
+        cumulative = 0
+        for bound, count in zip(BUCKETS, route_metrics.buckets):
+            cumulative += count
+            labels = format_labels(route=route, method=method, le=bound)
+            lines.append(f"http_request_duration_seconds_bucket{labels} {cumulative}")
+        labels = format_labels(route=route, method=method, le="+Inf")
+        lines.append(
+            f"http_request_duration_seconds_bucket{labels} {route_metrics.count}"
+        )
+        labels = format_labels(route=route, method=method)
+        lines.append(
+            f"http_request_duration_seconds_sum{labels} {route_metrics.duration}"
+        )
+        lines.append(
+            f"http_request_duration_seconds_count{labels} {route_metrics.count}"
+        )
+
+    lines += [
+        "# HELP http_requests_total Requests answered, per route and status.",
+        "# TYPE http_requests_total counter",
+    ]
+    for (route, method), route_metrics in snapshot.items():
+        for status_code, count in sorted(route_metrics.statuses.items()):
+            labels = format_labels(route=route, method=method, status=status_code)
+            lines.append(f"http_requests_total{labels} {count}")
+
+    for name, attribute, description in COUNTERS:
+        lines += [f"# HELP {name} {description}", f"# TYPE {name} counter"]
+        for (route, method), route_metrics in snapshot.items():
+            labels = format_labels(route=route, method=method)
+            lines.append(f"{name}{labels} {getattr(route_metrics, attribute)}")
+    return "\n".join(lines) + "\n"
+
+
+class CanScrapeMetrics(BasePermission):
+    """Staff, or a scraper sending the METRICS_TOKEN as a bearer token"""
+
+    def has_permission(self, request: Request, view):
+        if request.user and request.user.is_staff:
+            return True
+        token = settings.METRICS_TOKEN
+        header = request.headers.get("Authorization", "")
+        return bool(token) and compare_digest(header, f"Bearer {token}")
+
+
+class MetricsView(APIView):
+    permission_classes = [CanScrapeMetrics]
+
+    def get(self, request: Request):
+        return HttpResponse(
+            render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8"
+        )
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:45
+
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def backfill_tickets_sold(apps, schema_editor):
+    TicketType = apps.get_model("api", "TicketType")
+    ticket_types = list(TicketType.objects.annotate(sold=Sum("tickets__quantity")))
+    for ticket_type in ticket_types:
+        ticket_type.tickets_sold = ticket_type.sold or 0
+    TicketType.objects.bulk_update(ticket_types, ["tickets_sold"], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0007_event_date_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="tickettype",
+            name="tickets_sold",
+            field=models.PositiveIntegerField(
+                default=0,
+                help_text="Soma das quantidades de todos os bilhetes vendidos",
+            ),
+        ),
+        migrations.RunPython(backfill_tickets_sold, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:01
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0009_updated_at"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="ticket",
+            index=models.Index(
+                fields=["user", "ticket_type"], name="api_ticket_user_id_058d5a_idx"
+            ),
+        ),
+    ]
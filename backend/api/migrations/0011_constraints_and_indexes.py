@@ -0,0 +1,90 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:11
+
+import django.core.validators
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, F, Sum
+
+
+def fix_existing_rows(apps, schema_editor):
+    """Brings older rows in line with the new constraints"""
+    Ticket = apps.get_model("api", "Ticket")
+    TicketType = apps.get_model("api", "TicketType")
+
+    # Merge duplicate tickets into the oldest one of each user and type
+    duplicates = (
+        Ticket.objects.values("user", "ticket_type")
+        .annotate(count=Count("id"), total=Sum("quantity"))
+        .filter(count__gt=1)
+    )
+    for duplicate in duplicates:
+        tickets = Ticket.objects.filter(
+            user=duplicate["user"], ticket_type=duplicate["ticket_type"]
+        ).order_by("id")
+        kept = tickets.first()
+        tickets.exclude(pk=kept.pk).delete()
+        Ticket.objects.filter(pk=kept.pk).update(quantity=duplicate["total"])
+
+    Ticket.objects.filter(quantity=0).delete()
+    # Seats that were sold before the quantity was lowered can't be taken back
+    TicketType.objects.filter(tickets_sold__gt=F("quantity_available")).update(
+        quantity_available=F("tickets_sold")
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0010_ticket_user_ticket_type_index"),
+        ("auth", "0012_alter_user_first_name_max_length"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(fix_existing_rows, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="ticket",
+            name="quantity",
+            field=models.PositiveSmallIntegerField(
+                validators=[django.core.validators.MinValueValidator(1)]
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="ticket",
+            constraint=models.UniqueConstraint(
+                fields=("user", "ticket_type"), name="unique_ticket_per_user_and_type"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="ticket",
+            constraint=models.CheckConstraint(
+                condition=models.Q(("quantity__gte", 1)), name="ticket_quantity_gte_1"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="tickettype",
+            constraint=models.CheckConstraint(
+                condition=models.Q(
+                    ("tickets_sold__lte", models.F("quantity_available"))
+                ),
+                name="tickets_sold_lte_quantity_available",
+            ),
+        ),
+        migrations.RemoveIndex(
+            model_name="event",
+            name="api_event_is_visi_1c949b_idx",
+        ),
+        migrations.AddIndex(
+            model_name="event",
+            index=models.Index(
+                condition=models.Q(("is_visible", True)),
+                fields=["date", "id"],
+                name="api_event_visible_date_idx",
+            ),
+        ),
+        # The unique constraint's index covers the same lookups
+        migrations.RemoveIndex(
+            model_name="ticket",
+            name="api_ticket_user_id_058d5a_idx",
+        ),
+    ]
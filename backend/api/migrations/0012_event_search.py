@@ -0,0 +1,105 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Copied rather than imported, so later changes to the app can't change what
+# this migration does. Kept in sync with name, description and location by
+# triggers (SQLite) or an expression index (PostgreSQL), so bulk inserts and
+# updates are indexed too. On SQLite, migrations that rebuild the api_event
+# table drop its triggers, so they must create them again.
+SQLITE_SEARCH_SQL = [
+    "CREATE VIRTUAL TABLE api_event_fts USING fts5("
+    "name, description, location, content='api_event', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2', prefix='3')",
+    "CREATE TRIGGER api_event_fts_insert AFTER INSERT ON api_event BEGIN "
+    "INSERT INTO api_event_fts(rowid, name, description, location) "
+    "VALUES (new.id, new.name, new.description, new.location); END",
+    "CREATE TRIGGER api_event_fts_delete AFTER DELETE ON api_event BEGIN "
+    "INSERT INTO api_event_fts(api_event_fts, rowid, name, description, location) "
+    "VALUES ('delete', old.id, old.name, old.description, old.location); END",
+    "CREATE TRIGGER api_event_fts_update "
+    "AFTER UPDATE OF name, description, location ON api_event BEGIN "
+    "INSERT INTO api_event_fts(api_event_fts, rowid, name, description, location) "
+    "VALUES ('delete', old.id, old.name, old.description, old.location); "
+    "INSERT INTO api_event_fts(rowid, name, description, location) "
+    "VALUES (new.id, new.name, new.description, new.location); END",
+    "INSERT INTO api_event_fts(api_event_fts) VALUES ('rebuild')",
+    # The rank column weighs matches in the name the most, then the location
+    "INSERT INTO api_event_fts(api_event_fts, rank) "
+    "VALUES ('rank', 'bm25(10.0, 1.0, 5.0)')",
+]
+SQLITE_DROP_SEARCH_SQL = [
+    "DROP TRIGGER IF EXISTS api_event_fts_insert",
+    "DROP TRIGGER IF EXISTS api_event_fts_delete",
+    "DROP TRIGGER IF EXISTS api_event_fts_update",
+    "DROP TABLE IF EXISTS api_event_fts",
+]
+# Must match api.search.POSTGRES_DOCUMENT for searches to use the index
+POSTGRES_SEARCH_SQL = [
+    "CREATE INDEX api_event_search_idx ON api_event USING GIN ("
+    "to_tsvector('portuguese', api_event.name || ' ' || api_event.description "
+    "|| ' ' || api_event.location))"
+]
+POSTGRES_DROP_SEARCH_SQL = ["DROP INDEX IF EXISTS api_event_search_idx"]
+
+
+def run(schema_editor, statements: dict):
+    for statement in statements.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(statement)
+
+
+def create_index(apps, schema_editor):
+    run(
+        schema_editor,
+        {
+            "sqlite": SQLITE_DROP_SEARCH_SQL + SQLITE_SEARCH_SQL,
+            "postgresql": POSTGRES_DROP_SEARCH_SQL + POSTGRES_SEARCH_SQL,
+        },
+    )
+
+
+def drop_index(apps, schema_editor):
+    run(
+        schema_editor,
+        {"sqlite": SQLITE_DROP_SEARCH_SQL, "postgresql": POSTGRES_DROP_SEARCH_SQL},
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0011_constraints_and_indexes"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="event",
+            index=models.Index(
+                fields=["latitude", "longitude"], name="api_event_latitud_aa3c9d_idx"
+            ),
+        ),
+        migrations.CreateModel(
+            name="EventSearch",
+            fields=[
+                (
+                    "event",
+                    models.OneToOneField(
+                        db_column="rowid",
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        primary_key=True,
+                        related_name="search",
+                        serialize=False,
+                        to="api.event",
+                    ),
+                ),
+                ("match", models.TextField(db_column="api_event_fts")),
+                ("rank", models.FloatField()),
+            ],
+            options={
+                "db_table": "api_event_fts",
+                "managed": False,
+            },
+        ),
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,103 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDate
+
+
+def backfill_rollups(apps, schema_editor):
+    """
+    Same as api.stats.rebuild at the time of this migration, copied so later
+    changes to the app can't change what it does
+    """
+    SalesRollup = apps.get_model("api", "SalesRollup")
+    RatingRollup = apps.get_model("api", "RatingRollup")
+    Ticket = apps.get_model("api", "Ticket")
+    SalesRollup.objects.bulk_create(
+        (
+            SalesRollup(**row)
+            for row in Ticket.objects.annotate(day=TruncDate("purchase_date"))
+            .values("ticket_type_id", "day")
+            .annotate(tickets=Sum("quantity"))
+            .order_by()
+            .iterator()
+        ),
+        batch_size=1000,
+    )
+    RatingRollup.objects.bulk_create(
+        (
+            RatingRollup(**row)
+            for row in Ticket.objects.filter(rating__isnull=False)
+            .values(event_id=F("ticket_type__event_id"))
+            .annotate(
+                **{f"rating_{i}": Count("id", filter=Q(rating=i)) for i in range(1, 6)}
+            )
+            .order_by()
+            .iterator()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0016_checkins"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RatingRollup",
+            fields=[
+                (
+                    "event",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="rating_rollup",
+                        serialize=False,
+                        to="api.event",
+                    ),
+                ),
+                ("rating_1", models.PositiveIntegerField(default=0)),
+                ("rating_2", models.PositiveIntegerField(default=0)),
+                ("rating_3", models.PositiveIntegerField(default=0)),
+                ("rating_4", models.PositiveIntegerField(default=0)),
+                ("rating_5", models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="SalesRollup",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("day", models.DateField()),
+                ("tickets", models.PositiveIntegerField(default=0)),
+                (
+                    "ticket_type",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="sales",
+                        to="api.tickettype",
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("ticket_type", "day"),
+                        name="unique_sales_per_type_and_day",
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
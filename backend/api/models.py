@@ -1,6 +1,63 @@
+import secrets
+from datetime import timedelta
+from math import ceil
+
+from django.conf import settings
 from django.contrib.auth.models import User, Group
-from django.db import models
+from django.db import connection, models, transaction
+from django.db.models import Avg, Count, Exists, F, Min, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
 from django.core.validators import MinValueValidator, MaxValueValidator
+from django.utils import timezone
+
+
+class EventQuerySet(models.QuerySet):
+    def touch(self):
+        """Marks the events as changed, for things their updated_at can't see"""
+        return self.update(updated_at=timezone.now())
+
+    def visible_to(self, user):
+        return self if user.is_staff else self.filter(is_visible=True)
+
+    def upcoming(self):
+        return self.filter(date__gt=timezone.now())
+
+    def past(self):
+        return self.filter(date__lte=timezone.now())
+
+    def with_summary(self):
+        ticket_types = TicketType.objects.filter(event=OuterRef("pk")).values("event")
+        return self.annotate(
+            min_price=Subquery(ticket_types.annotate(m=Min("price")).values("m")),
+            remaining=Coalesce(
+                Subquery(
+                    ticket_types.annotate(
+                        s=Sum(F("quantity_available") - F("tickets_sold"))
+                    ).values("s")
+                ),
+                0,
+            ),
+        )
+
+    def with_ticket_types(self):
+        # Reverse FK prefetches already cache the parent event on each ticket
+        # type, so nested serializers don't need to fetch it again
+        return self.prefetch_related("ticket_types__groups")
+
+
+RATING_AGGREGATES = {
+    "count": Count("id"),
+    "average": Avg("rating"),
+    **{f"rating_{i}": Count("id", filter=Q(rating=i)) for i in range(1, 6)},
+}
+
+
+def format_rating_summary(summary: dict) -> dict:
+    return {
+        "count": summary["count"],
+        "average": summary["average"],
+        "histogram": {i: summary[f"rating_{i}"] for i in range(1, 6)},
+    }
 
 
 # Create your models here.
@@ -17,6 +74,47 @@ class Event(models.Model):
         validators=[MinValueValidator(-180), MaxValueValidator(180)]
     )
     is_visible = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = EventQuerySet.as_manager()
+
+    def ratings(self):
+        return Ticket.objects.filter(ticket_type__event=self, rating__isnull=False)
+
+    def rating_summary(self) -> dict:
+        """Count, average and 1-5 histogram of the ratings, in a single query"""
+        return format_rating_summary(self.ratings().aggregate(**RATING_AGGREGATES))
+
+    async def arating_summary(self) -> dict:
+        return format_rating_summary(
+            await self.ratings().aaggregate(**RATING_AGGREGATES)
+        )
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["date", "id"]),
+            # Partial, as Django filters booleans with a bare "WHERE is_visible"
+            # that SQLite can't match against an is_visible index column
+            models.Index(
+                fields=["date", "id"],
+                condition=Q(is_visible=True),
+                name="api_event_visible_date_idx",
+            ),
+            # Bounding box prefilter of the "near me" search
+            models.Index(fields=["latitude", "longitude"]),
+        ]
+
+
+class TicketTypeQuerySet(models.QuerySet):
+    def with_eligibility(self, group_ids):
+        """Annotates whether a user of the given groups can buy each ticket type"""
+        return self.annotate(
+            can_purchase=Exists(
+                TicketType.groups.through.objects.filter(
+                    tickettype=OuterRef("pk"), group_id__in=group_ids
+                )
+            )
+        )
 
 
 class TicketType(models.Model):
@@ -29,6 +127,51 @@ class TicketType(models.Model):
     groups = models.ManyToManyField(
         Group, help_text="Grupos que podem comprar este tipo de bilhete"
     )
+    tickets_sold = models.PositiveIntegerField(
+        default=0,
+        help_text="Soma das quantidades dos bilhetes vendidos e das reservas ativas",
+    )
+
+    objects = TicketTypeQuerySet.as_manager()
+
+    @property
+    def remaining(self) -> int:
+        return self.quantity_available - self.tickets_sold
+
+    @staticmethod
+    def bulk_set_groups(groups: list, replaced=()):
+        """
+        Sets the groups of many ticket types, given as (ticket type, groups)
+        pairs, with one insert, after one delete of the groups of `replaced`.
+        """
+        Through = TicketType.groups.through
+        Through.objects.filter(tickettype__in=replaced).delete()
+        Through.objects.bulk_create(
+            Through(tickettype_id=ticket_type.id, group_id=group.id)
+            for ticket_type, ticket_groups in groups
+            for group in ticket_groups
+        )
+
+    def sell(self, quantity: int) -> bool:
+        """
+        Atomically takes `quantity` seats from the inventory with a conditional
+        UPDATE, so concurrent buyers can never oversell.
+        Returns False if there aren't enough seats left.
+        """
+        return bool(
+            TicketType.objects.filter(
+                pk=self.pk,
+                tickets_sold__lte=F("quantity_available") - quantity,
+            ).update(tickets_sold=F("tickets_sold") + quantity)
+        )
+
+    class Meta:
+        constraints = [
+            models.CheckConstraint(
+                condition=Q(tickets_sold__lte=F("quantity_available")),
+                name="tickets_sold_lte_quantity_available",
+            )
+        ]
 
 
 class Ticket(models.Model):
@@ -37,8 +180,302 @@ class Ticket(models.Model):
     )
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="tickets")
     purchase_date = models.DateTimeField(auto_now_add=True)
-    quantity = models.PositiveSmallIntegerField()
+    quantity = models.PositiveSmallIntegerField(validators=[MinValueValidator(1)])
     rating = models.PositiveSmallIntegerField(
         null=True, validators=[MinValueValidator(1), MaxValueValidator(5)]
     )
     rating_comment = models.TextField(null=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @staticmethod
+    def add(user: User, ticket_type: TicketType, quantity: int) -> tuple[int, int]:
+        """
+        Creates the ticket of the user for the ticket type, or adds to its
+        quantity if there already is one, in a single INSERT ... ON CONFLICT.
+        Returns the id of the ticket and its new quantity, which is only equal
+        to `quantity` if the ticket was just created.
+        """
+        table = connection.ops.quote_name(Ticket._meta.db_table)
+        now = connection.ops.adapt_datetimefield_value(timezone.now())
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {table} "
+                "(user_id, ticket_type_id, quantity, purchase_date, updated_at) "
+                "VALUES (%s, %s, %s, %s, %s) "
+                "ON CONFLICT (user_id, ticket_type_id) DO UPDATE SET "
+                f"quantity = {table}.quantity + excluded.quantity, "
+                "updated_at = excluded.updated_at "
+                "RETURNING id, quantity",
+                [user.pk, ticket_type.pk, quantity, now, now],
+            )
+            return cursor.fetchone()
+
+    class Meta:
+        constraints = [
+            # One ticket per user and type, purchases add to its quantity
+            models.UniqueConstraint(
+                fields=["user", "ticket_type"], name="unique_ticket_per_user_and_type"
+            ),
+            models.CheckConstraint(
+                condition=Q(quantity__gte=1), name="ticket_quantity_gte_1"
+            ),
+        ]
+
+
+class CheckIn(models.Model):
+    """
+    Entry of one seat of a ticket at the door. Seats are numbered from 0 to
+    the quantity of the ticket minus 1, each with its own code (see
+    api.checkin), and can only be checked in once.
+    """
+
+    ticket = models.ForeignKey(
+        Ticket, on_delete=models.CASCADE, related_name="checkins"
+    )
+    seat = models.PositiveSmallIntegerField()
+    # Same as the event of the ticket, so the check-ins of an event are read
+    # without joining the tickets
+    event = models.ForeignKey(Event, on_delete=models.CASCADE, related_name="checkins")
+    scanned_at = models.DateTimeField(default=timezone.now)
+    scanned_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["ticket", "seat"], name="unique_checkin_per_seat"
+            )
+        ]
+
+
+class SalesRollup(models.Model):
+    """
+    Tickets of a ticket type sold each day, added to by every purchase (see
+    api.stats) so sales figures never have to sum the tickets.
+    """
+
+    ticket_type = models.ForeignKey(
+        TicketType, on_delete=models.CASCADE, related_name="sales"
+    )
+    day = models.DateField()
+    tickets = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["ticket_type", "day"], name="unique_sales_per_type_and_day"
+            )
+        ]
+
+
+class RatingRollup(models.Model):
+    """Number of ratings of each value of an event, kept up to date by api.stats"""
+
+    event = models.OneToOneField(
+        Event, on_delete=models.CASCADE, primary_key=True, related_name="rating_rollup"
+    )
+    rating_1 = models.PositiveIntegerField(default=0)
+    rating_2 = models.PositiveIntegerField(default=0)
+    rating_3 = models.PositiveIntegerField(default=0)
+    rating_4 = models.PositiveIntegerField(default=0)
+    rating_5 = models.PositiveIntegerField(default=0)
+
+    def summary(self) -> dict:
+        """Same as Event.rating_summary, without reading the ratings"""
+        counts = {f"rating_{i}": getattr(self, f"rating_{i}") for i in range(1, 6)}
+        count = sum(counts.values())
+        total = sum(i * counts[f"rating_{i}"] for i in range(1, 6))
+        return format_rating_summary(
+            {"count": count, "average": total / count if count else None, **counts}
+        )
+
+
+class ReservationQuerySet(models.QuerySet):
+    def active(self):
+        return self.filter(expires_at__gt=timezone.now())
+
+    def expired(self):
+        return self.filter(expires_at__lte=timezone.now())
+
+
+class Reservation(models.Model):
+    """
+    Seats of a ticket type held for a user until `expires_at`. They are taken
+    from the inventory (tickets_sold) when held, and either become a ticket
+    on confirmation or are given back when the hold expires.
+    """
+
+    ticket_type = models.ForeignKey(
+        TicketType, on_delete=models.CASCADE, related_name="reservations"
+    )
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name="reservations"
+    )
+    quantity = models.PositiveSmallIntegerField(validators=[MinValueValidator(1)])
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+
+    objects = ReservationQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # The sweeper reads the oldest expired holds first
+            models.Index(fields=["expires_at"]),
+            # Expired holds of a sold out ticket type are released on demand
+            models.Index(fields=["ticket_type", "expires_at"]),
+        ]
+        constraints = [
+            models.CheckConstraint(
+                condition=Q(quantity__gte=1), name="reservation_quantity_gte_1"
+            )
+        ]
+
+
+class Task(models.Model):
+    """
+    Work queued by requests for the worker processes (see api.tasks). Tasks
+    are inserted in the transaction of the request that queues them, so they
+    exist if and only if that transaction commits.
+    """
+
+    class Status(models.TextChoices):
+        PENDING = "pending"
+        RUNNING = "running"
+        DONE = "done"
+        FAILED = "failed"
+
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    idempotency_key = models.CharField(max_length=200, null=True, unique=True)
+    status = models.CharField(
+        max_length=10, choices=Status.choices, default=Status.PENDING
+    )
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=3)
+    run_at = models.DateTimeField(default=timezone.now)
+    # Set while running, so tasks of a worker that died can be run again
+    claimed_by = models.CharField(max_length=32, null=True)
+    locked_until = models.DateTimeField(null=True)
+    last_error = models.TextField(blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "run_at"])]
+
+
+class WaitingRoom(models.Model):
+    """
+    Opt-in admission queue of an event. Buyers join it and are admitted one
+    at a time at `rate` per minute, so purchases arrive at a bounded pace
+    instead of all at once when the sale opens.
+    """
+
+    event = models.OneToOneField(
+        Event, on_delete=models.CASCADE, primary_key=True, related_name="waiting_room"
+    )
+    rate = models.PositiveIntegerField(
+        validators=[MinValueValidator(1)], help_text="Compradores admitidos por minuto"
+    )
+    next_admission = models.DateTimeField(
+        null=True, help_text="Hora a que o próximo comprador da fila é admitido"
+    )
+
+    @property
+    def interval(self) -> timedelta:
+        return timedelta(seconds=60 / self.rate)
+
+    def join(self, user: User) -> tuple["QueueEntry", bool]:
+        """
+        Gives the user the next admission slot, or returns their entry if it
+        hasn't expired yet. Slots are handed out under a lock on the waiting
+        room, so concurrent buyers never get the same one.
+        Returns the entry and whether it was created.
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            room = WaitingRoom.objects.select_for_update().get(pk=self.pk)
+            entry = room.entries.filter(user=user).first()
+            if entry and not entry.has_expired(now):
+                return entry, False
+            if entry:
+                entry.delete()
+
+            admit_at = max(now, room.next_admission or now)
+            room.next_admission = admit_at + room.interval
+            room.save(update_fields=["next_admission"])
+            entry = QueueEntry.objects.create(
+                waiting_room=room,
+                user=user,
+                token=secrets.token_urlsafe(32),
+                admit_at=admit_at,
+            )
+        entry.waiting_room = room
+        return entry, True
+
+
+class QueueEntry(models.Model):
+    waiting_room = models.ForeignKey(
+        WaitingRoom, on_delete=models.CASCADE, related_name="entries"
+    )
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name="queue_entries"
+    )
+    token = models.CharField(max_length=43, unique=True)
+    # The slot is fixed on joining, so polling never has to count the queue
+    admit_at = models.DateTimeField()
+
+    @property
+    def expires_at(self):
+        return self.admit_at + timedelta(seconds=settings.QUEUE_ADMISSION_WINDOW)
+
+    def is_admitted(self, now) -> bool:
+        return self.admit_at <= now < self.expires_at
+
+    def has_expired(self, now) -> bool:
+        return now >= self.expires_at
+
+    def ahead(self, now) -> int:
+        """Approximate number of buyers still to be admitted before this one"""
+        wait = (self.admit_at - now).total_seconds()
+        return max(0, ceil(wait / self.waiting_room.interval.total_seconds()))
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["waiting_room", "user"], name="unique_queue_entry_per_user"
+            )
+        ]
+
+
+class Match(models.Lookup):
+    lookup_name = "match"
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f"{lhs} MATCH {rhs}", lhs_params + rhs_params
+
+
+class EventSearch(models.Model):
+    """
+    Full-text index of the events on SQLite, an FTS5 table that triggers keep
+    in sync with api_event (see api.search).
+    """
+
+    event = models.OneToOneField(
+        Event,
+        on_delete=models.DO_NOTHING,
+        primary_key=True,
+        db_column="rowid",
+        related_name="search",
+    )
+    # The column named after the table matches against every column
+    match = models.TextField(db_column="api_event_fts")
+    rank = models.FloatField()
+
+    class Meta:
+        managed = False
+        db_table = "api_event_fts"
+
+
+EventSearch._meta.get_field("match").register_lookup(Match)
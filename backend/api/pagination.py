@@ -0,0 +1,147 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as BinasciiError
+
+from django.db.models import Q, QuerySet
+from django.http import HttpRequest
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ValidationError
+
+DEFAULT_PAGE_SIZE = 12
+MAX_PAGE_SIZE = 100
+
+
+def encode_cursor(date, pk: int) -> str:
+    return urlsafe_b64encode(f"{date.isoformat()}|{pk}".encode()).decode()
+
+
+def decode_cursor(cursor: str):
+    try:
+        date, pk = urlsafe_b64decode(cursor.encode()).decode().split("|")
+        date = parse_datetime(date)
+        pk = int(pk)
+    except (BinasciiError, UnicodeDecodeError, ValueError):
+        date = None
+    if date is None:
+        raise ValidationError("Cursor inválido.")
+    return date, pk
+
+
+def encode_score_cursor(score: float, pk: int) -> str:
+    return urlsafe_b64encode(f"{score!r}|{pk}".encode()).decode()
+
+
+def decode_score_cursor(cursor: str):
+    try:
+        score, pk = urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return float(score), int(pk)
+    except (BinasciiError, UnicodeDecodeError, ValueError):
+        raise ValidationError("Cursor inválido.")
+
+
+def get_page_size(request: HttpRequest) -> int:
+    try:
+        limit = int(request.GET.get("limit", DEFAULT_PAGE_SIZE))
+    except ValueError:
+        raise ValidationError("O parâmetro limit tem de ser um número.")
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def get_date_page(queryset: QuerySet, request: HttpRequest, descending=False):
+    """
+    Keyset pagination over (date, id), so every page is a single indexed range
+    scan no matter how deep the client goes.
+    Returns the queryset of the page, with one extra row to tell if there is a
+    next page, and the page size.
+    """
+    limit = get_page_size(request)
+    cursor = request.GET.get("cursor")
+
+    if cursor:
+        date, pk = decode_cursor(cursor)
+        if descending:
+            queryset = queryset.filter(Q(date__lt=date) | Q(date=date, id__lt=pk))
+        else:
+            queryset = queryset.filter(Q(date__gt=date) | Q(date=date, id__gt=pk))
+
+    ordering = ["-date", "-id"] if descending else ["date", "id"]
+    return queryset.order_by(*ordering)[: limit + 1], limit
+
+
+def get_id_page(queryset: QuerySet, request: HttpRequest):
+    """
+    Keyset pagination over the primary key, newest first.
+    Returns the queryset of the page, with one extra row to tell if there is a
+    next page, and the page size.
+    """
+    limit = get_page_size(request)
+    cursor = request.GET.get("cursor")
+
+    if cursor:
+        try:
+            queryset = queryset.filter(id__lt=int(cursor))
+        except ValueError:
+            raise ValidationError("Cursor inválido.")
+
+    return queryset.order_by("-id")[: limit + 1], limit
+
+
+def get_score_page(queryset: QuerySet, request: HttpRequest, field: str):
+    """
+    Keyset pagination over (field, id), lowest first, for results ordered by
+    a computed score such as a search rank or a distance.
+    Returns the queryset of the page, with one extra row to tell if there is a
+    next page, and the page size.
+    """
+    limit = get_page_size(request)
+    cursor = request.GET.get("cursor")
+
+    if cursor:
+        score, pk = decode_score_cursor(cursor)
+        queryset = queryset.filter(
+            Q(**{f"{field}__gt": score}) | Q(**{field: score, "id__gt": pk})
+        )
+
+    return queryset.order_by(field, "id")[: limit + 1], limit
+
+
+def split_page(page: list, limit: int, cursor_of):
+    """Returns the objects of the page and the cursor of the next one, if any"""
+    if len(page) <= limit:
+        return page, None
+    page = page[:limit]
+    return page, cursor_of(page[-1])
+
+
+def date_cursor(obj) -> str:
+    return encode_cursor(obj.date, obj.id)
+
+
+def id_cursor(obj) -> str:
+    return str(obj.id)
+
+
+def paginate_by_date(queryset: QuerySet, request: HttpRequest, descending=False):
+    page, limit = get_date_page(queryset, request, descending)
+    return split_page(list(page), limit, date_cursor)
+
+
+def paginate_by_id(queryset: QuerySet, request: HttpRequest):
+    page, limit = get_id_page(queryset, request)
+    return split_page(list(page), limit, id_cursor)
+
+
+def paginate_by_score(queryset: QuerySet, request: HttpRequest, field: str):
+    page, limit = get_score_page(queryset, request, field)
+    return split_page(
+        list(page), limit, lambda obj: encode_score_cursor(getattr(obj, field), obj.id)
+    )
+
+
+async def apaginate_by_date(queryset: QuerySet, request: HttpRequest, descending=False):
+    page, limit = get_date_page(queryset, request, descending)
+    return split_page([obj async for obj in page], limit, date_cursor)
+
+
+async def apaginate_by_id(queryset: QuerySet, request: HttpRequest):
+    page, limit = get_id_page(queryset, request)
+    return split_page([obj async for obj in page], limit, id_cursor)
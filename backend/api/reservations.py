@@ -0,0 +1,134 @@
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .availability import seats_changed
+from .cache import invalidate_listings
+from .models import Event, Reservation, Ticket, TicketType
+from .stats import record_sale
+from .tasks import on_purchase_confirmed
+
+
+def take_seats(ticket_type: TicketType, quantity: int) -> bool:
+    """
+    Takes seats from the inventory like TicketType.sell, releasing the expired
+    holds of the ticket type first when there aren't enough left, so
+    abandoned holds never block a sale even if the sweeper isn't running.
+    """
+    if ticket_type.sell(quantity):
+        return True
+    return bool(release_expired(ticket_type=ticket_type)) and ticket_type.sell(quantity)
+
+
+def hold(user: User, ticket_type: TicketType, quantity: int):
+    """
+    Takes `quantity` seats from the inventory for RESERVATION_TTL seconds.
+    Returns None if there aren't enough seats left.
+    """
+    with transaction.atomic():
+        if not take_seats(ticket_type, quantity):
+            return None
+        reservation = Reservation.objects.create(
+            ticket_type=ticket_type,
+            user=user,
+            quantity=quantity,
+            expires_at=timezone.now() + timedelta(seconds=settings.RESERVATION_TTL),
+        )
+        Event.objects.filter(pk=ticket_type.event_id).touch()
+        invalidate_listings()
+        seats_changed([ticket_type.event_id])
+    return reservation
+
+
+def confirm(user: User, pk: int):
+    """
+    Turns an active hold of the user into a ticket. The seats were already
+    taken from the inventory, so only the ticket is written.
+    Returns the id of the ticket and whether it was created, or None if the
+    hold doesn't exist or has expired.
+    """
+    with transaction.atomic():
+        reservation = (
+            Reservation.objects.active()
+            .filter(pk=pk, user=user)
+            .select_related("ticket_type")
+            .first()
+        )
+        # Deleting claims the hold, a sweeper that got there first wins
+        if (
+            not reservation
+            or not Reservation.objects.active().filter(pk=pk).delete()[0]
+        ):
+            return None
+        ticket_id, total = Ticket.add(
+            user, reservation.ticket_type, reservation.quantity
+        )
+        record_sale(reservation.ticket_type_id, reservation.quantity)
+        on_purchase_confirmed(ticket_id, reservation.quantity, total)
+    return ticket_id, total == reservation.quantity
+
+
+def cancel(user: User, pk: int) -> bool:
+    """Gives the seats of an active hold of the user back right away"""
+    with transaction.atomic():
+        reservation = Reservation.objects.active().filter(pk=pk, user=user).first()
+        if not reservation or not Reservation.objects.filter(pk=pk).delete()[0]:
+            return False
+        give_back({reservation.ticket_type_id: reservation.quantity})
+    return True
+
+
+def give_back(quantities: dict):
+    """Returns seats to the inventory, given as {ticket type id: quantity}"""
+    # One UPDATE per distinct quantity instead of one per ticket type, as
+    # expired batches give most ticket types back the same few quantities
+    by_quantity = defaultdict(list)
+    for ticket_type_id, quantity in quantities.items():
+        by_quantity[quantity].append(ticket_type_id)
+    for quantity, ticket_type_ids in by_quantity.items():
+        TicketType.objects.filter(pk__in=ticket_type_ids).update(
+            tickets_sold=F("tickets_sold") - quantity
+        )
+    event_ids = set(
+        TicketType.objects.filter(pk__in=list(quantities)).values_list(
+            "event_id", flat=True
+        )
+    )
+    Event.objects.filter(pk__in=event_ids).touch()
+    invalidate_listings()
+    seats_changed(event_ids)
+
+
+def release_expired(batch_size: int = 500, **filters) -> int:
+    """
+    Deletes expired holds and gives their seats back, oldest first, in
+    batches read through the expiry index instead of scanning every hold.
+    Returns the number of seats released.
+    """
+    released = 0
+    while True:
+        with transaction.atomic():
+            # Locked so confirmations can't claim the holds being released
+            batch = list(
+                Reservation.objects.expired()
+                .filter(**filters)
+                .order_by("expires_at")
+                .select_for_update(skip_locked=True)
+                .values_list("id", "ticket_type_id", "quantity")[:batch_size]
+            )
+            if not batch:
+                break
+            Reservation.objects.filter(pk__in=[pk for pk, _, _ in batch]).delete()
+            quantities = Counter()
+            for _, ticket_type_id, quantity in batch:
+                quantities[ticket_type_id] += quantity
+            give_back(quantities)
+        released += sum(quantities.values())
+        if len(batch) < batch_size:
+            break
+    return released
@@ -0,0 +1,130 @@
+import re
+from math import cos, radians
+
+from django.db import connection
+from django.db.models import BooleanField, F, FloatField, QuerySet
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import ASin, Cos, Power, Radians, Sin, Sqrt
+from rest_framework.exceptions import ValidationError
+
+EARTH_RADIUS_KM = 6371
+KM_PER_DEGREE = 111.32
+MAX_RADIUS_KM = 1000
+# Minimum length of the last word for it to be searched as a prefix
+PREFIX_LENGTH = 3
+
+# Indexed by migration 0012_event_search, which must be kept in sync
+POSTGRES_DOCUMENT = (
+    "to_tsvector('portuguese', api_event.name || ' ' || api_event.description "
+    "|| ' ' || api_event.location)"
+)
+
+
+def search_text(queryset: QuerySet, text: str) -> QuerySet:
+    """
+    Keeps the events matching every word of `text` (the last one as a prefix,
+    for search as you type), annotated with a `rank` where lower is better.
+    Shorter prefixes would match nearly every event and have to rank them all.
+    """
+    words = re.findall(r"\w+", text)
+    if not words:
+        raise ValidationError("A pesquisa tem de ter pelo menos uma palavra.")
+
+    if connection.vendor == "sqlite":
+        # Quoted so words are never read as FTS5 operators
+        match = " ".join(f'"{word}"' for word in words)
+        if len(words[-1]) >= PREFIX_LENGTH:
+            match += "*"
+        # Joined with the FTS table, so every match is ranked in the same scan
+        return queryset.filter(search__match=match).annotate(rank=F("search__rank"))
+
+    query = " & ".join(words)
+    if len(words[-1]) >= PREFIX_LENGTH:
+        query += ":*"
+    return queryset.annotate(
+        matches=RawSQL(
+            f"{POSTGRES_DOCUMENT} @@ to_tsquery('portuguese', %s)",
+            [query],
+            output_field=BooleanField(),
+        ),
+        rank=RawSQL(
+            f"-ts_rank_cd({POSTGRES_DOCUMENT}, to_tsquery('portuguese', %s))",
+            [query],
+            output_field=FloatField(),
+        ),
+    ).filter(matches=True)
+
+
+def search_near(
+    queryset: QuerySet, latitude: float, longitude: float, radius: float
+) -> QuerySet:
+    """
+    Keeps the events within `radius` km, annotated with their `distance` in
+    km. A bounding box on the indexed coordinates discards most events before
+    the great-circle distance is computed.
+    """
+    latitude_delta = radius / KM_PER_DEGREE
+    queryset = queryset.filter(
+        latitude__range=(latitude - latitude_delta, latitude + latitude_delta)
+    )
+    # Near the poles or the antimeridian the box would wrap, latitude is enough
+    if abs(latitude) + latitude_delta < 89:
+        longitude_delta = latitude_delta / cos(radians(latitude))
+        if abs(longitude) + longitude_delta < 180:
+            queryset = queryset.filter(
+                longitude__range=(
+                    longitude - longitude_delta,
+                    longitude + longitude_delta,
+                )
+            )
+
+    # Haversine formula
+    origin_latitude, origin_longitude = radians(latitude), radians(longitude)
+    a = Power(Sin((Radians("latitude") - origin_latitude) / 2), 2) + cos(
+        origin_latitude
+    ) * Cos(Radians("latitude")) * Power(
+        Sin((Radians("longitude") - origin_longitude) / 2), 2
+    )
+    return queryset.annotate(
+        distance=2 * EARTH_RADIUS_KM * ASin(Sqrt(a), output_field=FloatField())
+    ).filter(distance__lte=radius)
+
+
+def get_float_param(request, name: str, minimum: float, maximum: float):
+    value = request.GET.get(name)
+    if value is None:
+        return None
+    try:
+        value = float(value)
+    except ValueError:
+        value = None
+    if value is None or not minimum <= value <= maximum:
+        raise ValidationError(
+            f"O parâmetro {name} tem de ser um número entre {minimum} e {maximum}."
+        )
+    return value
+
+
+def search_events(queryset: QuerySet, request):
+    """
+    Applies the text (`q`) and "near me" (`lat`, `lon`, `radius`) searches of
+    the query string. Returns the events and the field to order them by.
+    """
+    text = request.GET.get("q", "").strip()
+    latitude = get_float_param(request, "lat", -90, 90)
+    longitude = get_float_param(request, "lon", -180, 180)
+    radius = get_float_param(request, "radius", 0.1, MAX_RADIUS_KM) or 25
+
+    if not text and latitude is None and longitude is None:
+        raise ValidationError("Indique uma pesquisa (q) ou uma localização (lat, lon).")
+    if (latitude is None) != (longitude is None):
+        raise ValidationError("Os parâmetros lat e lon têm de ser indicados juntos.")
+
+    order_by = None
+    if text:
+        queryset, order_by = search_text(queryset, text), "rank"
+    if latitude is not None:
+        # With a location, the nearest matches come first
+        queryset = search_near(queryset, latitude, longitude, radius)
+        order_by = "distance"
+    return queryset, order_by
@@ -1,7 +1,19 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User, Group
+from django.db import transaction
+from django.db.models import prefetch_related_objects
 from rest_framework.validators import UniqueValidator
-from .models import Event, TicketType, Ticket
+from .availability import seats_changed
+from .cache import invalidate_listings
+from .images import get_variant_urls
+from .models import (
+    Event,
+    QueueEntry,
+    Reservation,
+    TicketType,
+    Ticket,
+    WaitingRoom,
+)
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -28,6 +40,13 @@ class UserSerializer(serializers.ModelSerializer):
             "groups",
         ]
 
+    def get_fields(self):
+        fields = super().get_fields()
+        # Groups decide which tickets a user can buy, so only staff choose them
+        if not self.context.get("can_set_groups"):
+            fields["groups"].read_only = True
+        return fields
+
     def create(self, validated_data: dict):
         validated_data.pop("old_password", None)  # Not needed on create
         groups = validated_data.pop("groups", [1])
@@ -59,26 +78,94 @@ class UserSerializer(serializers.ModelSerializer):
         return instance
 
 
+class ImageVariantsField(serializers.Field):
+    """URLs of the resized copies of the event image"""
+
+    def __init__(self, **kwargs):
+        super().__init__(source="image", read_only=True, **kwargs)
+
+    def to_representation(self, value: str):
+        return get_variant_urls(value)
+
+
 class EventSummarySerializer(serializers.ModelSerializer):
     class Meta:
         model = Event
         fields = ["id", "name", "date", "location"]
 
 
+class EventListSerializer(serializers.ModelSerializer):
+    min_price = serializers.DecimalField(
+        max_digits=4, decimal_places=2, read_only=True, allow_null=True
+    )
+    remaining = serializers.IntegerField(read_only=True)
+    image_variants = ImageVariantsField()
+
+    class Meta:
+        model = Event
+        fields = [
+            "id",
+            "name",
+            "image",
+            "image_variants",
+            "date",
+            "location",
+            "min_price",
+            "remaining",
+        ]
+
+
+class EventSearchSerializer(EventListSerializer):
+    rank = serializers.FloatField(read_only=True, required=False)
+    distance = serializers.FloatField(read_only=True, required=False)
+
+    class Meta(EventListSerializer.Meta):
+        fields = EventListSerializer.Meta.fields + ["rank", "distance"]
+
+
 class TicketRatingSerializer(serializers.ModelSerializer):
+    # The rating summary only counts ratings from 1 to 5, left out to clear it
+    rating = serializers.IntegerField(
+        min_value=1,
+        max_value=5,
+        allow_null=True,
+        required=False,
+        error_messages={
+            key: "A avaliação tem de ser entre 1 e 5."
+            for key in ("invalid", "min_value", "max_value", "max_string_length")
+        },
+    )
+
     class Meta:
         model = Ticket
         fields = ["rating", "rating_comment"]
 
 
+class GroupField(serializers.PrimaryKeyRelatedField):
+    """
+    Loads every group once and reuses them for the rest of the serializer,
+    instead of one query per id of every nested ticket type.
+    """
+
+    def to_internal_value(self, data):
+        if not hasattr(self, "groups_by_id"):
+            self.groups_by_id = {group.pk: group for group in self.get_queryset()}
+        try:
+            return self.groups_by_id[int(data)]
+        except KeyError:
+            self.fail("does_not_exist", pk_value=data)
+        except (TypeError, ValueError):
+            self.fail("incorrect_type", data_type=type(data).__name__)
+
+
 class TicketTypeSerializer(serializers.ModelSerializer):
     id = serializers.IntegerField(required=False, default=None)
     event = EventSummarySerializer(read_only=True)
-    tickets = TicketRatingSerializer(many=True, read_only=True)
-    groups = serializers.PrimaryKeyRelatedField(
+    groups = GroupField(
         queryset=Group.objects.all(),
         many=True,
     )
+    remaining = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = TicketType
@@ -87,15 +174,26 @@ class TicketTypeSerializer(serializers.ModelSerializer):
             "name",
             "price",
             "quantity_available",
+            "remaining",
             "event",
-            "tickets",
             "groups",
         ]
 
+    def to_representation(self, instance: TicketType):
+        data = super().to_representation(instance)
+        # Set by views that show events to a user, see eligibility_context
+        group_ids = self.context.get("group_ids")
+        if group_ids is not None:
+            data["can_purchase"] = not group_ids.isdisjoint(data["groups"])
+            if not self.context.get("show_groups"):
+                del data["groups"]
+        return data
+
 
 class EventSerializer(serializers.ModelSerializer):
     ticket_types = TicketTypeSerializer(many=True, required=False)
     image = serializers.CharField(required=False, allow_null=True)
+    image_variants = ImageVariantsField()
 
     class Meta:
         model = Event
@@ -103,6 +201,7 @@ class EventSerializer(serializers.ModelSerializer):
             "id",
             "name",
             "image",
+            "image_variants",
             "date",
             "description",
             "location",
@@ -112,15 +211,55 @@ class EventSerializer(serializers.ModelSerializer):
             "is_visible",
         ]
 
+    @staticmethod
+    def save_ticket_types(event: Event, ticket_types_data: list, existing=()):
+        """
+        Creates or updates the ticket types of an event with one bulk query per
+        operation, whatever the number of ticket types.
+        Returns the ids of every ticket type that was sent.
+        """
+        existing = {ticket_type.id: ticket_type for ticket_type in existing}
+        to_create, to_update, update_fields, groups = [], [], set(), []
+
+        for ticket_data in ticket_types_data:
+            ticket_data = dict(ticket_data)
+            ticket_groups = ticket_data.pop("groups", [])
+            ticket_type = existing.get(ticket_data.pop("id", None))
+            if ticket_type:
+                quantity = ticket_data.get("quantity_available")
+                if quantity is not None and quantity < ticket_type.tickets_sold:
+                    raise serializers.ValidationError(
+                        {
+                            "ticket_types": f"Já foram vendidos {ticket_type.tickets_sold} bilhetes do tipo {ticket_type.name}."
+                        }
+                    )
+                for attr, value in ticket_data.items():
+                    setattr(ticket_type, attr, value)
+                update_fields.update(ticket_data)
+                to_update.append(ticket_type)
+            else:
+                ticket_type = TicketType(event=event, **ticket_data)
+                to_create.append(ticket_type)
+            groups.append((ticket_type, ticket_groups))
+
+        TicketType.objects.bulk_create(to_create)
+        # Never write back tickets_sold, purchases update it concurrently
+        if to_update and update_fields:
+            TicketType.objects.bulk_update(to_update, list(update_fields))
+
+        TicketType.bulk_set_groups(groups, replaced=to_update)
+        return [ticket_type.id for ticket_type, _ in groups]
+
+    @transaction.atomic
     def create(self, validated_data: dict):
         ticket_types_data = validated_data.pop("ticket_types", [])
         event = Event.objects.create(**validated_data)
-        for ticket_data in ticket_types_data:
-            groups = ticket_data.pop("groups", [])
-            ticket = TicketType.objects.create(event=event, **ticket_data)
-            ticket.groups.set(groups)
+        self.save_ticket_types(event, ticket_types_data)
+        invalidate_listings()
+        prefetch_related_objects([event], "ticket_types__groups")
         return event
 
+    @transaction.atomic
     def update(self, instance, validated_data: dict):
         ticket_types_data = validated_data.pop("ticket_types", None)
 
@@ -129,42 +268,70 @@ class EventSerializer(serializers.ModelSerializer):
         instance.save()
 
         if ticket_types_data is not None:
-            sent_ids = []
-            for ticket_data in ticket_types_data:
-                groups = ticket_data.pop("groups", [])
-                ticket_id = ticket_data.get("id", None)
-                if ticket_id:
-                    try:
-                        ticket_type = instance.ticket_types.get(id=ticket_id)
-                        for attr, value in ticket_data.items():
-                            if attr != "id":
-                                setattr(ticket_type, attr, value)
-                        ticket_type.save()
-                        ticket_type.groups.set(groups)
-                        sent_ids.append(ticket_id)
-                    except TicketType.DoesNotExist:
-                        new_ticket = TicketType.objects.create(
-                            event=instance, **ticket_data
-                        )
-                        new_ticket.groups.set(groups)
-                else:
-                    new_ticket = TicketType.objects.create(
-                        event=instance, **ticket_data
-                    )
-                    new_ticket.groups.set(groups)
-                    sent_ids.append(new_ticket.id)
+            # Locked so no purchase sells below a new quantity once it is checked
+            sent_ids = self.save_ticket_types(
+                instance, ticket_types_data, instance.ticket_types.select_for_update()
+            )
 
             # Delete ticket types not included in the update
             instance.ticket_types.exclude(id__in=sent_ids).delete()
 
+        invalidate_listings()
+        seats_changed([instance.id])
+        prefetch_related_objects([instance], "ticket_types__groups")
         return instance
 
 
+class EventDetailSerializer(EventSerializer):
+    rating_summary = serializers.SerializerMethodField()
+
+    class Meta(EventSerializer.Meta):
+        fields = EventSerializer.Meta.fields + ["rating_summary"]
+
+    def get_rating_summary(self, event: Event):
+        # Async views compute it beforehand, as serializers can't await queries
+        if "rating_summary" in self.context:
+            return self.context["rating_summary"]
+        return event.rating_summary()
+
+
+class TicketTypeSummarySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = TicketType
+        fields = ["id", "name", "price"]
+
+
+class PurchasableTicketTypeField(serializers.PrimaryKeyRelatedField):
+    """
+    Loads the ticket type already annotated with whether the groups in the
+    context can buy it, so the check costs no extra query.
+    """
+
+    def get_queryset(self):
+        # The waiting room is joined so events without one cost no extra query
+        return TicketType.objects.with_eligibility(
+            self.context.get("group_ids", ())
+        ).select_related("event__waiting_room")
+
+
+def validate_purchase(data: dict) -> dict:
+    """Checks shared by purchases and reservations of a ticket type"""
+    ticket_type: TicketType = data.get("ticket_type")
+
+    if ticket_type and not ticket_type.can_purchase:
+        raise serializers.ValidationError(
+            "Este tipo de bilhete não está disponível para os seus grupos."
+        )
+
+    # Not checked against remaining here: seats of expired holds still count
+    # as sold until they are released, which only taking seats does
+    return data
+
+
 class TicketSerializer(serializers.ModelSerializer):
-    ticket_type = TicketTypeSerializer(read_only=True)
-    ticket_type_id = serializers.PrimaryKeyRelatedField(
-        queryset=TicketType.objects.all(), source="ticket_type", write_only=True
-    )
+    ticket_type = TicketTypeSummarySerializer(read_only=True)
+    event = EventSummarySerializer(source="ticket_type.event", read_only=True)
+    ticket_type_id = PurchasableTicketTypeField(source="ticket_type", write_only=True)
 
     class Meta:
         model = Ticket
@@ -172,6 +339,7 @@ class TicketSerializer(serializers.ModelSerializer):
             "id",
             "ticket_type",
             "ticket_type_id",
+            "event",
             "purchase_date",
             "quantity",
             "rating",
@@ -180,16 +348,48 @@ class TicketSerializer(serializers.ModelSerializer):
         read_only_fields = ["id", "user", "purchase_date"]
 
     def validate(self, data: dict):
-        ticket_type: TicketType = data.get("ticket_type")
-        quantity: int = data.get("quantity")
+        return validate_purchase(data)
 
-        if ticket_type and quantity:
-            tickets_sold = sum(t.quantity for t in ticket_type.tickets.all())
-            remaining = ticket_type.quantity_available - tickets_sold
 
-            if quantity > remaining:
-                raise serializers.ValidationError(
-                    f"Sobram apenas {remaining} bilhetes deste tipo para compra."
-                )
+class ReservationSerializer(serializers.ModelSerializer):
+    ticket_type = TicketTypeSummarySerializer(read_only=True)
+    event = EventSummarySerializer(source="ticket_type.event", read_only=True)
+    ticket_type_id = PurchasableTicketTypeField(source="ticket_type", write_only=True)
 
-        return data
+    class Meta:
+        model = Reservation
+        fields = [
+            "id",
+            "ticket_type",
+            "ticket_type_id",
+            "event",
+            "quantity",
+            "created_at",
+            "expires_at",
+        ]
+        read_only_fields = ["id", "created_at", "expires_at"]
+
+    def validate(self, data: dict):
+        return validate_purchase(data)
+
+
+class WaitingRoomSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = WaitingRoom
+        fields = ["rate"]
+
+
+class QueueEntrySerializer(serializers.ModelSerializer):
+    expires_at = serializers.DateTimeField(read_only=True)
+    admitted = serializers.SerializerMethodField()
+    ahead = serializers.SerializerMethodField()
+
+    class Meta:
+        model = QueueEntry
+        fields = ["token", "admit_at", "expires_at", "admitted", "ahead"]
+
+    def get_admitted(self, entry: QueueEntry) -> bool:
+        return entry.is_admitted(self.context["now"])
+
+    def get_ahead(self, entry: QueueEntry) -> int:
+        return entry.ahead(self.context["now"])
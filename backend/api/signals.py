@@ -0,0 +1,24 @@
+from django.core.mail import send_mail
+from django.dispatch import Signal, receiver
+from django.utils import timezone
+
+# Sent by a background task after a purchase commits, with the ticket and
+# the quantity just bought. Connect receivers here for post-purchase work.
+purchase_confirmed = Signal()
+
+
+@receiver(purchase_confirmed)
+def send_confirmation_email(sender, ticket, quantity: int, **kwargs):
+    if not ticket.user.email:
+        return
+    event = ticket.ticket_type.event
+    date = timezone.localtime(event.date)
+    send_mail(
+        f"Compra confirmada: {event.name}",
+        f"Olá {ticket.user.first_name or ticket.user.username},\n\n"
+        f"Comprou {quantity} bilhete(s) {ticket.ticket_type.name} para "
+        f"{event.name}, a {date:%d/%m/%Y %H:%M} em {event.location}.\n"
+        f"Tem agora {ticket.quantity} bilhete(s) deste tipo.",
+        None,
+        [ticket.user.email],
+    )
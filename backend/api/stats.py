@@ -0,0 +1,158 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import Greatest, TruncDate
+from django.utils import timezone
+
+from .models import Event, RatingRollup, SalesRollup, Ticket, TicketType
+
+RATING_COUNTS = {f"rating_{i}": Count("id", filter=Q(rating=i)) for i in range(1, 6)}
+
+
+def record_sale(ticket_type_id: int, quantity: int):
+    """
+    Adds a purchase to today's sales of the ticket type, in a single
+    INSERT ... ON CONFLICT. Called in the transaction of the purchase.
+    """
+    table = connection.ops.quote_name(SalesRollup._meta.db_table)
+    day = connection.ops.adapt_datefield_value(timezone.localdate())
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {table} (ticket_type_id, day, tickets) "
+            "VALUES (%s, %s, %s) "
+            "ON CONFLICT (ticket_type_id, day) DO UPDATE SET "
+            f"tickets = {table}.tickets + excluded.tickets",
+            [ticket_type_id, day, quantity],
+        )
+
+
+def record_rating(event_id: int, old: int | None, new: int | None):
+    """Moves a rating of the event from `old` to `new`, either may be None"""
+    if old == new:
+        return
+    changes = {}
+    if old is not None:
+        # Ratings from before the last rebuild may be missing from the rollup
+        changes[f"rating_{old}"] = Greatest(F(f"rating_{old}") - 1, 0)
+    if new is not None:
+        changes[f"rating_{new}"] = F(f"rating_{new}") + 1
+    RatingRollup.objects.bulk_create(
+        [RatingRollup(event_id=event_id)], ignore_conflicts=True
+    )
+    RatingRollup.objects.filter(event_id=event_id).update(**changes)
+
+
+def event_stats(event: Event) -> dict:
+    """
+    Sales per ticket type and per day, and the rating distribution of the
+    event. Only reads the rollups, so the cost depends on the number of
+    ticket types and days with sales, never on the number of tickets.
+    Revenue is counted at the current price of each ticket type.
+    """
+    ticket_types = list(
+        TicketType.objects.filter(event=event)
+        .annotate(sold=Sum("sales__tickets", default=0))
+        .order_by("id")
+    )
+    prices = {ticket_type.id: ticket_type.price for ticket_type in ticket_types}
+    days = defaultdict(lambda: {"tickets": 0, "revenue": Decimal("0.00")})
+    for day, ticket_type_id, tickets in (
+        SalesRollup.objects.filter(ticket_type__event=event)
+        .order_by("day")
+        .values_list("day", "ticket_type_id", "tickets")
+    ):
+        days[day]["tickets"] += tickets
+        days[day]["revenue"] += tickets * prices[ticket_type_id]
+    ratings = RatingRollup.objects.filter(event=event).first()
+
+    return {
+        "id": event.id,
+        "name": event.name,
+        "tickets_sold": sum(ticket_type.sold for ticket_type in ticket_types),
+        "revenue": sum(
+            (ticket_type.sold * ticket_type.price for ticket_type in ticket_types),
+            Decimal("0.00"),
+        ),
+        "ticket_types": [
+            {
+                "id": ticket_type.id,
+                "name": ticket_type.name,
+                "price": ticket_type.price,
+                "quantity_available": ticket_type.quantity_available,
+                "tickets_sold": ticket_type.sold,
+                "revenue": ticket_type.sold * ticket_type.price,
+            }
+            for ticket_type in ticket_types
+        ],
+        "sales": [{"day": day, **totals} for day, totals in days.items()],
+        "ratings": (ratings or RatingRollup()).summary(),
+    }
+
+
+def events_stats(events: list[Event]) -> list[dict]:
+    """
+    Totals of each event of a page of the dashboard, with one query for all
+    of their sales. Expects the rating rollups to be selected with them.
+    """
+    totals = {
+        event.id: {"tickets_sold": 0, "revenue": Decimal("0.00")} for event in events
+    }
+    for event_id, price, tickets in (
+        SalesRollup.objects.filter(ticket_type__event__in=list(totals))
+        .values("ticket_type__event_id", "ticket_type__price")
+        .annotate(sold=Sum("tickets"))
+        .values_list("ticket_type__event_id", "ticket_type__price", "sold")
+    ):
+        totals[event_id]["tickets_sold"] += tickets
+        totals[event_id]["revenue"] += tickets * price
+
+    results = []
+    for event in events:
+        ratings = getattr(event, "rating_rollup", None)
+        results.append(
+            {
+                "id": event.id,
+                "name": event.name,
+                "date": event.date,
+                **totals[event.id],
+                "ratings": (ratings or RatingRollup()).summary(),
+            }
+        )
+    return results
+
+
+@transaction.atomic
+def rebuild() -> tuple[int, int]:
+    """
+    Recomputes every rollup from the tickets, for backfills and to fix drift
+    (e.g. tickets deleted with their user). Tickets only keep the date of
+    their first purchase, so later purchases of a ticket are counted then.
+    Returns the number of sales and rating rows written.
+    """
+    SalesRollup.objects.all().delete()
+    RatingRollup.objects.all().delete()
+    sales = SalesRollup.objects.bulk_create(
+        (
+            SalesRollup(**row)
+            for row in Ticket.objects.annotate(day=TruncDate("purchase_date"))
+            .values("ticket_type_id", "day")
+            .annotate(tickets=Sum("quantity"))
+            .order_by()
+            .iterator()
+        ),
+        batch_size=1000,
+    )
+    ratings = RatingRollup.objects.bulk_create(
+        (
+            RatingRollup(**row)
+            for row in Ticket.objects.filter(rating__isnull=False)
+            .values(event_id=F("ticket_type__event_id"))
+            .annotate(**RATING_COUNTS)
+            .order_by()
+            .iterator()
+        ),
+        batch_size=1000,
+    )
+    return len(sales), len(ratings)
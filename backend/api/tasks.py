@@ -0,0 +1,176 @@
+import logging
+import traceback
+from datetime import timedelta
+from uuid import uuid4
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Task, Ticket
+from .signals import purchase_confirmed
+
+logger = logging.getLogger(__name__)
+
+# Functions that can be queued, by name, with their maximum number of attempts
+TASKS = {}
+
+
+def task(name: str = None, max_attempts: int = 3):
+    """Registers a function as a task. Its arguments must be JSON serializable."""
+
+    def decorator(func):
+        TASKS[name or func.__name__] = (func, max_attempts)
+        return func
+
+    return decorator
+
+
+class DatabaseBackend:
+    """Stores tasks in the Task table, where the run_tasks workers pick them up"""
+
+    def enqueue(self, name: str, payload: dict, key: str, run_at):
+        # A task with the same key was already queued, this one is a duplicate
+        Task.objects.bulk_create(
+            [
+                Task(
+                    name=name,
+                    payload=payload,
+                    idempotency_key=key,
+                    max_attempts=TASKS[name][1],
+                    run_at=run_at,
+                )
+            ],
+            ignore_conflicts=key is not None,
+        )
+
+
+class ImmediateBackend:
+    """
+    Runs tasks in the process that queued them once its transaction commits,
+    for development without a worker. There are no retries.
+    """
+
+    def enqueue(self, name: str, payload: dict, key: str, run_at):
+        transaction.on_commit(lambda: TASKS[name][0](**payload), robust=True)
+
+
+def enqueue(name: str, payload: dict = None, key: str = None, delay: float = 0):
+    """
+    Queues the task `name` with the TASK_BACKEND. Tasks with the same
+    idempotency `key` are only queued once.
+    """
+    if name not in TASKS:
+        raise ValueError(f"Unknown task {name}")
+    backend = import_string(settings.TASK_BACKEND)()
+    backend.enqueue(name, payload or {}, key, timezone.now() + timedelta(seconds=delay))
+
+
+def claim(batch_size: int) -> list[Task]:
+    """
+    Marks up to `batch_size` due tasks as running for this worker. The
+    conditional UPDATE means concurrent workers never claim the same task.
+    """
+    now = timezone.now()
+    ids = list(
+        Task.objects.filter(status=Task.Status.PENDING, run_at__lte=now)
+        .order_by("run_at")
+        .values_list("id", flat=True)[:batch_size]
+    )
+    if not ids:
+        return []
+    token = uuid4().hex
+    Task.objects.filter(pk__in=ids, status=Task.Status.PENDING).update(
+        status=Task.Status.RUNNING,
+        claimed_by=token,
+        locked_until=now + timedelta(seconds=settings.TASK_TIMEOUT),
+        attempts=F("attempts") + 1,
+    )
+    return list(Task.objects.filter(pk__in=ids, claimed_by=token).order_by("run_at"))
+
+
+def run(task: Task):
+    """Runs a claimed task, and schedules a retry with backoff if it fails"""
+    tasks = Task.objects.filter(pk=task.pk, claimed_by=task.claimed_by)
+    try:
+        func, _ = TASKS[task.name]
+        func(**task.payload)
+    except Exception:
+        logger.exception("Task %s (%s) failed", task.pk, task.name)
+        if task.name in TASKS and task.attempts < task.max_attempts:
+            delay = settings.TASK_RETRY_DELAY * 2 ** (task.attempts - 1)
+            tasks.update(
+                status=Task.Status.PENDING,
+                run_at=timezone.now() + timedelta(seconds=delay),
+                claimed_by=None,
+                locked_until=None,
+                last_error=traceback.format_exc(),
+            )
+        else:
+            tasks.update(
+                status=Task.Status.FAILED,
+                locked_until=None,
+                last_error=traceback.format_exc(),
+            )
+        return False
+    tasks.update(status=Task.Status.DONE, locked_until=None, last_error="")
+    return True
+
+
+def run_pending(batch_size: int = 10) -> int:
+    """Runs due tasks until there are none left. Returns how many ran."""
+    count = 0
+    while batch := claim(batch_size):
+        for claimed in batch:
+            run(claimed)
+        count += len(batch)
+    return count
+
+
+def requeue_stale() -> int:
+    """Queues again the tasks of workers that died while running them"""
+    return Task.objects.filter(
+        status=Task.Status.RUNNING, locked_until__lt=timezone.now()
+    ).update(status=Task.Status.PENDING, claimed_by=None, locked_until=None)
+
+
+def purge_finished() -> int:
+    """
+    Deletes tasks that finished more than TASK_RETENTION seconds ago. Their
+    idempotency keys are kept until then. Failed tasks are kept to inspect.
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.TASK_RETENTION)
+    finished = Task.objects.filter(status=Task.Status.DONE, updated_at__lt=cutoff)
+    return finished.delete()[0]
+
+
+def on_purchase_confirmed(ticket_id: int, quantity: int, total: int):
+    """
+    Hook of the purchase paths, called inside their transaction once the seats
+    are taken. Only queues the work, so the response isn't slowed by it.
+    `total` is the new quantity of the ticket, which identifies the purchase.
+    """
+    enqueue(
+        "purchase_confirmed",
+        {"ticket_id": ticket_id, "quantity": quantity},
+        key=f"purchase_confirmed:{ticket_id}:{total}",
+    )
+
+
+@task("purchase_confirmed")
+def send_purchase_confirmed(ticket_id: int, quantity: int):
+    """
+    Sends the purchase_confirmed signal from the worker. Receivers may run
+    again if another one fails, so they should tolerate being repeated.
+    """
+    ticket = (
+        Ticket.objects.select_related("user", "ticket_type__event")
+        .filter(pk=ticket_id)
+        .first()
+    )
+    # Deleted since, there's nothing left to confirm
+    if ticket is None:
+        return
+    purchase_confirmed.send(sender=Ticket, ticket=ticket, quantity=quantity)
@@ -1,3 +1,2007 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from io import BytesIO, StringIO
+from threading import Barrier
+from unittest import skipUnless
 
-# Create your tests here.
+from importlib.util import find_spec
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import AnonymousUser, Group, User
+from django.core import mail
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F, Sum
+from django.test import (
+    AsyncClient,
+    Client,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+
+from .bulk import import_events
+from .availability import publish, stream, subscriptions
+from .cache import get_cache
+from .checkin import forget_redeemed, make_code, read_code
+from .images import VARIANTS, executor, get_variant_urls, save_upload
+from .metrics import metrics
+from .models import (
+    CheckIn,
+    Event,
+    QueueEntry,
+    RatingRollup,
+    Reservation,
+    SalesRollup,
+    Task,
+    TicketType,
+    Ticket,
+    WaitingRoom,
+)
+from .reservations import release_expired
+from .stats import rebuild
+from .tasks import claim, enqueue, requeue_stale, run_pending, task
+
+# Calls of the test task, which fails while `failures` is positive
+flaky_calls = []
+
+
+@task("test_flaky", max_attempts=2)
+def flaky(value: int, failures: int = 0):
+    flaky_calls.append(value)
+    if len(flaky_calls) <= failures:
+        raise RuntimeError("Falhou")
+
+
+def create_events(count: int, ticket_types_per_event: int = 5, start=None):
+    group, _ = Group.objects.get_or_create(name="Aluno")
+    user, _ = User.objects.get_or_create(username="buyer")
+    for i in range(count):
+        event = Event.objects.create(
+            name=f"Evento {i}",
+            date=(start or timezone.now()) + timedelta(days=i + 1),
+            description="Descrição",
+            location="ISCTE",
+            latitude=38.7,
+            longitude=-9.1,
+            is_visible=True,
+        )
+        for j in range(ticket_types_per_event):
+            ticket_type = TicketType.objects.create(
+                event=event, name=f"Tipo {j}", price=5, quantity_available=100
+            )
+            ticket_type.groups.set([group])
+            Ticket.objects.create(
+                ticket_type=ticket_type, user=user, quantity=1, rating=5
+            )
+
+
+class APITestCase(TestCase):
+    def setUp(self):
+        # Cached responses would otherwise leak between tests
+        get_cache().clear()
+        # As would cached sessions and users, since rolled back ids are reused
+        caches["sessions"].clear()
+
+
+class EventListQueryCountTests(APITestCase):
+    def count_list_queries(self, detail="full"):
+        get_cache().clear()
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get("/api/events/", {"detail": detail, "limit": 100})
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries), response.json()["results"]
+
+    def test_query_count_does_not_grow_with_events(self):
+        create_events(2)
+        small_count, small_data = self.count_list_queries()
+
+        create_events(20)
+        large_count, large_data = self.count_list_queries()
+
+        self.assertEqual(len(small_data), 2)
+        self.assertEqual(len(large_data), 22)
+        self.assertEqual(small_count, large_count)
+
+    def test_summary_query_count_does_not_grow_with_events(self):
+        create_events(2)
+        small_count, _ = self.count_list_queries(detail="summary")
+
+        create_events(20)
+        large_count, _ = self.count_list_queries(detail="summary")
+
+        # The version check and the listing itself
+        self.assertEqual(small_count, 2)
+        self.assertEqual(small_count, large_count)
+
+    def test_nested_ticket_types_are_serialized(self):
+        create_events(1, ticket_types_per_event=2)
+        _, data = self.count_list_queries()
+
+        ticket_type = data[0]["ticket_types"][0]
+        self.assertEqual(ticket_type["event"]["id"], data[0]["id"])
+        self.assertNotIn("tickets", ticket_type)
+        # Anonymous users can't buy, nor see who can
+        self.assertFalse(ticket_type["can_purchase"])
+        self.assertNotIn("groups", ticket_type)
+
+
+class EventListPaginationTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        create_events(5, ticket_types_per_event=2)
+        create_events(
+            3, ticket_types_per_event=1, start=timezone.now() - timedelta(days=10)
+        )
+        Event.objects.filter(name="Evento 4").update(is_visible=False)
+
+    def get_all_pages(self, params: dict):
+        results, cursor = [], None
+        while True:
+            page_params = {**params, **({"cursor": cursor} if cursor else {})}
+            data = self.client.get("/api/events/", page_params).json()
+            results += data["results"]
+            cursor = data["next"]
+            if not cursor:
+                return results
+
+    def test_cursor_walks_every_event_once(self):
+        events = self.get_all_pages({"limit": 3})
+        self.assertEqual(len(events), 7)
+        self.assertEqual(len({e["id"] for e in events}), 7)
+        self.assertEqual([e["date"] for e in events], sorted(e["date"] for e in events))
+
+    def test_period_filters(self):
+        upcoming = self.get_all_pages({"period": "upcoming", "limit": 2})
+        past = self.get_all_pages({"period": "past", "limit": 2})
+
+        self.assertEqual(len(upcoming), 4)
+        self.assertEqual(len(past), 3)
+        # Past events come most recent first
+        self.assertEqual(
+            [e["date"] for e in past], sorted((e["date"] for e in past), reverse=True)
+        )
+
+    def test_date_range_filter(self):
+        now = timezone.now()
+        events = self.get_all_pages(
+            {
+                "from": (now + timedelta(hours=36)).isoformat(),
+                "to": (now + timedelta(days=3, hours=12)).isoformat(),
+            }
+        )
+        self.assertEqual([e["name"] for e in events], ["Evento 1", "Evento 2"])
+
+    def test_summary_representation(self):
+        TicketType.objects.filter(event__name="Evento 0").update(tickets_sold=7)
+        event = self.client.get("/api/events/", {"period": "upcoming"}).json()[
+            "results"
+        ][0]
+
+        self.assertEqual(
+            set(event),
+            {
+                "id",
+                "name",
+                "image",
+                "image_variants",
+                "date",
+                "location",
+                "min_price",
+                "remaining",
+            },
+        )
+        self.assertEqual(event["min_price"], "5.00")
+        self.assertEqual(event["remaining"], 2 * 100 - 2 * 7)
+
+    def test_invalid_parameters(self):
+        for params in ({"cursor": "nope"}, {"period": "soon"}, {"from": "ontem"}):
+            response = self.client.get("/api/events/", params)
+            self.assertEqual(response.status_code, 400)
+
+
+class PurchaseTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        create_events(1, ticket_types_per_event=1)
+        self.ticket_type = TicketType.objects.get()
+        self.user = User.objects.create_user(username="comprador", password="x")
+        self.user.groups.set(Group.objects.all())
+        self.client.force_login(self.user)
+
+    def buy(self, quantity: int):
+        return self.client.post(
+            "/api/purchases/",
+            {"ticket_type_id": self.ticket_type.id, "quantity": quantity},
+            content_type="application/json",
+        )
+
+    def test_repeated_purchases_accumulate_on_one_ticket(self):
+        self.assertEqual(self.buy(2).status_code, 201)
+        response = self.buy(3)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["quantity"], 5)
+        self.ticket_type.refresh_from_db()
+        self.assertEqual(self.ticket_type.tickets_sold, 5)
+
+    def test_cannot_buy_more_than_remaining(self):
+        TicketType.objects.filter(pk=self.ticket_type.pk).update(tickets_sold=98)
+        response = self.buy(3)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("Sobram apenas 2 bilhetes", str(response.json()))
+
+    def test_quantity_must_be_positive(self):
+        self.assertEqual(self.buy(0).status_code, 400)
+        self.assertFalse(Ticket.objects.filter(user=self.user).exists())
+
+
+class PurchaseListTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        create_events(6, ticket_types_per_event=2)
+        self.user = User.objects.create_user(username="comprador", password="x")
+        for ticket_type in TicketType.objects.all():
+            Ticket.objects.create(ticket_type=ticket_type, user=self.user, quantity=2)
+        self.client.force_login(self.user)
+
+    def test_compact_representation_in_bounded_queries(self):
+        # Session, user, version check and one query for the whole page
+        with self.assertNumQueries(4):
+            data = self.client.get("/api/purchases/", {"limit": 100}).json()
+
+        self.assertEqual(len(data["results"]), 12)
+        purchase = data["results"][0]
+        self.assertEqual(set(purchase["ticket_type"]), {"id", "name", "price"})
+        self.assertEqual(set(purchase["event"]), {"id", "name", "date", "location"})
+        self.assertNotIn("tickets", purchase["ticket_type"])
+
+    def test_pagination(self):
+        first = self.client.get("/api/purchases/", {"limit": 5}).json()
+        second = self.client.get(
+            "/api/purchases/", {"limit": 10, "cursor": first["next"]}
+        ).json()
+
+        ids = [p["id"] for p in first["results"] + second["results"]]
+        self.assertEqual(len(set(ids)), 12)
+        self.assertIsNone(second["next"])
+
+    def test_event_filter(self):
+        event = Event.objects.first()
+        data = self.client.get("/api/purchases/", {"event": event.id}).json()
+
+        self.assertEqual(len(data["results"]), 2)
+        self.assertTrue(all(p["event"]["id"] == event.id for p in data["results"]))
+        self.assertEqual(
+            self.client.get("/api/purchases/", {"event": "x"}).status_code, 400
+        )
+
+
+class EligibilityTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        create_events(1, ticket_types_per_event=2)
+        self.event = Event.objects.get()
+        self.aluno = Group.objects.get()
+        self.socio = Group.objects.create(name="Sócio")
+        self.members_only = TicketType.objects.get(name="Tipo 1")
+        self.members_only.groups.set([self.socio])
+        self.user = User.objects.create_user(username="aluno", password="x")
+        self.user.groups.set([self.aluno])
+
+    def login(self, user: User):
+        response = self.client.post(
+            "/api/login/",
+            {"username": user.username, "password": "x"},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def buy(self, ticket_type: TicketType):
+        return self.client.post(
+            "/api/purchases/",
+            {"ticket_type_id": ticket_type.id, "quantity": 1},
+            content_type="application/json",
+        )
+
+    def can_purchase(self, path: str) -> dict:
+        data = self.client.get(path).json()
+        return {t["name"]: t["can_purchase"] for t in data["ticket_types"]}
+
+    def test_ticket_types_are_flagged_for_the_user(self):
+        self.login(self.user)
+        detail = self.client.get(f"/api/events/{self.event.id}/").json()
+
+        self.assertEqual(
+            {t["name"]: t["can_purchase"] for t in detail["ticket_types"]},
+            {"Tipo 0": True, "Tipo 1": False},
+        )
+        self.assertTrue(all("groups" not in t for t in detail["ticket_types"]))
+        self.assertEqual(
+            self.can_purchase(f"/api/async/events/{self.event.id}/"),
+            {"Tipo 0": True, "Tipo 1": False},
+        )
+
+    def test_staff_see_the_groups(self):
+        staff = User.objects.create_user(username="staff", password="x", is_staff=True)
+        self.login(staff)
+        detail = self.client.get(f"/api/events/{self.event.id}/").json()
+
+        groups = {t["name"]: t["groups"] for t in detail["ticket_types"]}
+        self.assertEqual(groups, {"Tipo 0": [self.aluno.id], "Tipo 1": [self.socio.id]})
+
+    def test_groups_do_not_share_cached_details(self):
+        socio = User.objects.create_user(username="socio", password="x")
+        socio.groups.set([self.socio])
+        path = f"/api/events/{self.event.id}/"
+
+        self.login(self.user)
+        self.assertEqual(self.can_purchase(path), {"Tipo 0": True, "Tipo 1": False})
+        self.login(socio)
+        self.assertEqual(self.client.get(path)["X-Cache"], "MISS")
+        self.assertEqual(self.can_purchase(path), {"Tipo 0": False, "Tipo 1": True})
+
+    @override_settings(USER_CACHE_ALIAS="sessions")
+    def test_purchase_is_enforced_without_querying_groups(self):
+        self.login(self.user)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.buy(self.members_only)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("não está disponível para os seus grupos", str(response.json()))
+        self.assertFalse(Ticket.objects.filter(user=self.user).exists())
+        # Read from the session stored at login
+        self.assertFalse(
+            any("auth_user_groups" in q["sql"] for q in ctx.captured_queries)
+        )
+
+        self.assertEqual(
+            self.buy(TicketType.objects.get(name="Tipo 0")).status_code, 201
+        )
+
+    def test_users_cannot_choose_their_groups(self):
+        self.client.force_login(self.user)
+        response = self.client.patch(
+            "/api/user/", {"groups": [self.socio.id]}, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["groups"], [self.aluno.id])
+        self.assertEqual(self.buy(self.members_only).status_code, 400)
+
+        self.client.logout()
+        response = self.client.post(
+            "/api/signup/",
+            {
+                "username": "novo",
+                "password": "Palavra-passe-1",
+                "groups": [self.socio.id],
+            },
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn(self.socio, User.objects.get(username="novo").groups.all())
+
+    def test_changed_groups_are_seen_at_once(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.buy(self.members_only).status_code, 400)
+
+        # Read from the database, as other workers couldn't drop them
+        self.user.groups.set([self.socio])
+        self.assertEqual(self.buy(self.members_only).status_code, 201)
+
+    @override_settings(USER_CACHE_ALIAS="sessions")
+    def test_changed_groups_are_dropped_from_the_session(self):
+        self.login(self.user)
+        self.user.groups.add(self.socio)
+        self.assertEqual(self.buy(self.members_only).status_code, 201)
+
+        self.user.groups.remove(self.socio)
+        self.assertEqual(self.buy(self.members_only).status_code, 400)
+        # Also when changed through the group
+        self.socio.user_set.add(self.user)
+        # Adds to the ticket bought before
+        self.assertEqual(self.buy(self.members_only).status_code, 200)
+        self.socio.user_set.clear()
+        self.assertEqual(self.buy(self.members_only).status_code, 400)
+
+    @override_settings(USER_CACHE_ALIAS="sessions")
+    def test_expired_groups_are_reloaded(self):
+        self.login(self.user)
+        self.assertEqual(self.buy(self.members_only).status_code, 400)
+
+        # As if changed without signals, e.g. with a queryset delete
+        User.groups.through.objects.create(user=self.user, group=self.socio)
+        self.assertEqual(self.buy(self.members_only).status_code, 400)
+        session = self.client.session
+        session["group_ids"]["until"] = 0
+        session.save()
+        self.assertEqual(self.buy(self.members_only).status_code, 201)
+
+
+class ReservationTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        create_events(1, ticket_types_per_event=1)
+        self.ticket_type = TicketType.objects.get()
+        self.user = User.objects.create_user(username="comprador", password="x")
+        self.user.groups.set(Group.objects.all())
+        self.client.force_login(self.user)
+
+    def hold(self, quantity: int):
+        return self.client.post(
+            "/api/reservations/",
+            {"ticket_type_id": self.ticket_type.id, "quantity": quantity},
+            content_type="application/json",
+        )
+
+    def remaining(self) -> int:
+        self.ticket_type.refresh_from_db()
+        return self.ticket_type.remaining
+
+    def expire(self, **filters):
+        Reservation.objects.filter(**filters).update(
+            expires_at=timezone.now() - timedelta(seconds=1)
+        )
+
+    def test_hold_then_confirm(self):
+        response = self.hold(3)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.remaining(), 97)
+        reservation = response.json()
+        self.assertEqual(
+            self.client.get("/api/reservations/").json()["results"], [reservation]
+        )
+
+        response = self.client.post(f"/api/reservations/{reservation['id']}/confirm/")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()["quantity"], 3)
+        # The seats were taken by the hold, confirming doesn't take them again
+        self.assertEqual(self.remaining(), 97)
+        self.assertFalse(Reservation.objects.exists())
+        response = self.client.post(f"/api/reservations/{reservation['id']}/confirm/")
+        self.assertEqual(response.status_code, 400)
+
+    def test_expired_holds_cannot_be_confirmed(self):
+        reservation = self.hold(2).json()
+        self.expire()
+        response = self.client.post(f"/api/reservations/{reservation['id']}/confirm/")
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Ticket.objects.filter(user=self.user).exists())
+
+    def test_cancel_gives_seats_back(self):
+        reservation = self.hold(5).json()
+        other = User.objects.create_user(username="outro", password="x")
+        self.client.force_login(other)
+        path = f"/api/reservations/{reservation['id']}/"
+        self.assertEqual(self.client.delete(path).status_code, 400)
+
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.delete(path).status_code, 204)
+        self.assertEqual(self.remaining(), 100)
+
+    def test_sweeper_releases_expired_holds_in_batches(self):
+        for quantity in (1, 2, 3, 4):
+            self.hold(quantity)
+        self.expire(quantity__lte=3)
+
+        self.assertEqual(release_expired(batch_size=2), 6)
+        self.assertEqual(self.remaining(), 96)
+        self.assertEqual(
+            list(Reservation.objects.values_list("quantity", flat=True)), [4]
+        )
+        self.assertEqual(release_expired(), 0)
+
+        out = StringIO()
+        call_command("release_reservations", stdout=out)
+        self.assertIn("Libertados 0 lugares", out.getvalue())
+
+    def test_sold_out_holds_release_expired_ones_first(self):
+        TicketType.objects.filter(pk=self.ticket_type.pk).update(tickets_sold=90)
+        self.assertEqual(self.hold(10).status_code, 201)
+        self.assertEqual(self.hold(1).status_code, 400)
+
+        self.expire()
+        self.assertEqual(self.hold(4).status_code, 201)
+        self.assertEqual(self.remaining(), 6)
+
+    def test_purchases_release_expired_holds_too(self):
+        TicketType.objects.filter(pk=self.ticket_type.pk).update(tickets_sold=90)
+        self.hold(10)
+        self.expire()
+        response = self.client.post(
+            "/api/purchases/",
+            {"ticket_type_id": self.ticket_type.id, "quantity": 10},
+            content_type="application/json",
+        )
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.remaining(), 0)
+
+    @skipUnless(connection.vendor == "sqlite", "Query plans are SQLite specific")
+    def test_sweeper_reads_the_expiry_index(self):
+        plan = Reservation.objects.expired().order_by("expires_at")[:500].explain()
+        self.assertRegex(plan, r"USING (COVERING )?INDEX api_reserva_expires_\w+")
+        self.assertNotIn("TEMP B-TREE", plan)
+
+
+class WaitingRoomTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        create_events(1, ticket_types_per_event=1)
+        self.event = Event.objects.get()
+        self.ticket_type = TicketType.objects.get()
+        self.users = [
+            User.objects.create_user(username=f"comprador{i}", password="x")
+            for i in range(3)
+        ]
+        Group.objects.get().user_set.add(*self.users)
+        self.staff = User.objects.create_user(
+            username="staff", password="x", is_staff=True
+        )
+        self.client.force_login(self.staff)
+        response = self.client.put(
+            f"/api/events/{self.event.id}/queue/",
+            {"rate": 60},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def join(self, user: User):
+        self.client.force_login(user)
+        return self.client.post(f"/api/events/{self.event.id}/queue/")
+
+    def buy(self, token=None):
+        return self.client.post(
+            "/api/purchases/",
+            {
+                "ticket_type_id": self.ticket_type.id,
+                "quantity": 1,
+                "queue_token": token,
+            },
+            content_type="application/json",
+        )
+
+    def test_buyers_are_admitted_at_the_configured_rate(self):
+        entries = [self.join(user).json() for user in self.users]
+
+        self.assertTrue(entries[0]["admitted"])
+        self.assertEqual([e["ahead"] for e in entries[1:]], [1, 2])
+        admit_at = [QueueEntry.objects.get(token=e["token"]).admit_at for e in entries]
+        self.assertEqual(admit_at[2] - admit_at[1], timedelta(seconds=1))
+
+        # Joining again keeps the place in the queue
+        response = self.join(self.users[2])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["token"], entries[2]["token"])
+
+    def test_only_admitted_buyers_can_purchase(self):
+        first = self.join(self.users[0]).json()["token"]
+        self.assertEqual(self.buy().status_code, 403)
+        self.assertEqual(self.buy(first).status_code, 201)
+
+        second = self.join(self.users[1]).json()["token"]
+        self.assertEqual(self.buy(second).status_code, 403)
+        # Tokens belong to the user who joined
+        self.assertEqual(self.buy(first).status_code, 403)
+
+        QueueEntry.objects.filter(token=second).update(admit_at=timezone.now())
+        self.assertEqual(self.buy(second).status_code, 201)
+        QueueEntry.objects.filter(token=second).update(
+            admit_at=timezone.now() - timedelta(hours=1)
+        )
+        self.assertIn("expirou", str(self.buy(second).json()))
+        self.assertEqual(self.join(self.users[1]).status_code, 201)
+
+    def test_polling_costs_one_query(self):
+        self.join(self.users[0])
+        token = self.join(self.users[1]).json()["token"]
+        self.client.logout()
+
+        with self.assertNumQueries(1):
+            response = self.client.get(f"/api/queue/{token}/")
+        self.assertEqual(response.json()["ahead"], 1)
+        self.assertEqual(response["Retry-After"], "1")
+        self.assertEqual(self.client.get("/api/queue/x/").status_code, 400)
+
+    def test_only_staff_manage_the_waiting_room(self):
+        self.client.force_login(self.users[0])
+        path = f"/api/events/{self.event.id}/queue/"
+        self.assertEqual(self.client.delete(path).status_code, 403)
+
+        self.client.force_login(self.staff)
+        self.assertEqual(self.client.delete(path).status_code, 204)
+        self.assertFalse(WaitingRoom.objects.exists())
+        # Without a waiting room, purchases need no token
+        self.client.force_login(self.users[0])
+        self.assertEqual(self.client.post(path).status_code, 400)
+        self.assertEqual(self.buy().status_code, 201)
+
+
+class ConcurrentPurchaseTests(TransactionTestCase):
+    buyers = 8
+    attempts_per_buyer = 15
+
+    def setUp(self):
+        create_events(1, ticket_types_per_event=1)
+        self.ticket_type = TicketType.objects.get()
+        TicketType.objects.filter(pk=self.ticket_type.pk).update(
+            quantity_available=50, tickets_sold=0
+        )
+        Ticket.objects.all().delete()
+        self.users = [
+            User.objects.create_user(username=f"comprador{i}", password="x")
+            for i in range(self.buyers)
+        ]
+        Group.objects.get().user_set.add(*self.users)
+
+    def hammer(self, user: User):
+        client = Client()
+        client.force_login(user)
+        bought = 0
+        try:
+            for _ in range(self.attempts_per_buyer):
+                response = client.post(
+                    "/api/purchases/",
+                    {"ticket_type_id": self.ticket_type.id, "quantity": 1},
+                    content_type="application/json",
+                )
+                if response.status_code in (200, 201):
+                    bought += 1
+        finally:
+            connection.close()
+        return bought
+
+    def test_no_oversell_under_contention(self):
+        with ThreadPoolExecutor(max_workers=self.buyers) as executor:
+            bought = sum(executor.map(self.hammer, self.users))
+
+        self.ticket_type.refresh_from_db()
+        tickets = Ticket.objects.filter(ticket_type=self.ticket_type)
+        self.assertEqual(bought, 50)
+        self.assertEqual(self.ticket_type.tickets_sold, 50)
+        self.assertEqual(sum(t.quantity for t in tickets), 50)
+
+
+class ConstraintTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        create_events(1, ticket_types_per_event=1)
+        self.ticket_type = TicketType.objects.get()
+        self.ticket = Ticket.objects.get()
+
+    def test_one_ticket_per_user_and_type(self):
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Ticket.objects.create(
+                ticket_type=self.ticket_type, user=self.ticket.user, quantity=1
+            )
+
+    def test_quantities(self):
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Ticket.objects.filter(pk=self.ticket.pk).update(quantity=0)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            TicketType.objects.filter(pk=self.ticket_type.pk).update(
+                tickets_sold=F("quantity_available") + 1
+            )
+
+    def test_cannot_lower_quantity_below_tickets_sold(self):
+        TicketType.objects.filter(pk=self.ticket_type.pk).update(tickets_sold=10)
+        group = Group.objects.get()
+        payload = event_payload(1, [group.id], ids=[self.ticket_type.id])
+        payload["ticket_types"][0]["quantity_available"] = 9
+        response = self.client.patch(
+            f"/api/events/{self.ticket_type.event_id}/",
+            payload,
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("Já foram vendidos 10 bilhetes", str(response.json()))
+
+
+@skipUnless(connection.vendor == "sqlite", "Query plans are SQLite's")
+class QueryPlanTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        create_events(3, ticket_types_per_event=2)
+        self.user = User.objects.get(username="buyer")
+
+    def assert_uses_index(self, queryset, index: str):
+        plan = queryset.explain()
+        self.assertRegex(plan, rf"(SEARCH|SCAN) \w+ USING (COVERING )?INDEX {index}\b")
+        # Sorting in a temporary B-tree means the index didn't give the order
+        self.assertNotIn("TEMP B-TREE", plan)
+
+    def test_public_listings(self):
+        events = Event.objects.visible_to(AnonymousUser())
+        self.assert_uses_index(
+            events.upcoming().order_by("date", "id")[:13],
+            "api_event_visible_date_idx",
+        )
+        self.assert_uses_index(
+            events.past().order_by("-date", "-id")[:13],
+            "api_event_visible_date_idx",
+        )
+
+    def test_staff_listing(self):
+        index = Event._meta.indexes[0].name
+        self.assert_uses_index(
+            Event.objects.upcoming().order_by("date", "id")[:13], index
+        )
+
+    def test_ticket_of_user_and_type(self):
+        # SQLite backs unique constraints with an automatic index
+        self.assert_uses_index(
+            Ticket.objects.filter(
+                user=self.user, ticket_type=TicketType.objects.first()
+            ),
+            "sqlite_autoindex_api_ticket_1",
+        )
+
+    def test_purchases_of_user(self):
+        self.assert_uses_index(
+            Ticket.objects.filter(user=self.user).order_by("-id")[:13],
+            "api_ticket_user_id_\\w+",
+        )
+
+
+class RatingTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        create_events(1, ticket_types_per_event=2)
+        self.event = Event.objects.get()
+        Ticket.objects.filter(ticket_type__name="Tipo 1").update(rating=2)
+        self.user = User.objects.create_user(username="avaliador", password="x")
+        self.ticket = Ticket.objects.create(
+            ticket_type=TicketType.objects.first(), user=self.user, quantity=1
+        )
+        self.client.force_login(self.user)
+
+    def rate(self, rating, comment="Bom"):
+        return self.client.patch(
+            f"/api/purchase/{self.ticket.id}/",
+            {"rating": rating, "rating_comment": comment},
+            content_type="application/json",
+        )
+
+    def test_detail_includes_rating_summary(self):
+        self.assertEqual(self.rate(2).status_code, 204)
+        self.client.logout()
+        # Version check, event, ticket types, groups and the rating aggregate
+        with self.assertNumQueries(5):
+            data = self.client.get(f"/api/events/{self.event.id}/").json()
+
+        self.assertEqual(
+            data["rating_summary"],
+            {
+                "count": 3,
+                "average": 3.0,
+                "histogram": {"1": 0, "2": 2, "3": 0, "4": 0, "5": 1},
+            },
+        )
+
+    def test_rating_out_of_range_is_rejected(self):
+        self.assertEqual(self.rate(0).status_code, 400)
+        self.assertEqual(self.rate(True).status_code, 400)
+        self.assertEqual(self.rate("cinco").status_code, 400)
+        self.ticket.refresh_from_db()
+        self.assertIsNone(self.ticket.rating)
+
+    def test_reviews_are_paginated(self):
+        self.rate(4, "Excelente")
+        first = self.client.get(
+            f"/api/events/{self.event.id}/reviews/", {"limit": 2}
+        ).json()
+        second = self.client.get(
+            f"/api/events/{self.event.id}/reviews/",
+            {"limit": 2, "cursor": first["next"]},
+        ).json()
+
+        self.assertEqual(
+            first["results"][0], {"rating": 4, "rating_comment": "Excelente"}
+        )
+        self.assertEqual(len(first["results"]) + len(second["results"]), 3)
+        self.assertIsNone(second["next"])
+
+    def test_reviews_of_missing_event(self):
+        response = self.client.get("/api/events/999/reviews/")
+        self.assertEqual(response.status_code, 400)
+
+
+class EventCacheTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        create_events(1, ticket_types_per_event=1)
+        self.event = Event.objects.get()
+        self.staff = User.objects.create_user(
+            username="staff", password="x", is_staff=True
+        )
+        self.buyer = User.objects.create_user(username="comprador", password="x")
+        self.buyer.groups.set(Group.objects.all())
+
+    def get_detail(self):
+        return self.client.get(f"/api/events/{self.event.id}/")
+
+    def test_repeated_reads_are_served_from_cache(self):
+        self.assertEqual(self.get_detail()["X-Cache"], "MISS")
+        # Only the version check
+        with self.assertNumQueries(1):
+            response = self.get_detail()
+        self.assertEqual(response["X-Cache"], "HIT")
+        self.assertEqual(response.json()["id"], self.event.id)
+
+        self.assertEqual(self.client.get("/api/events/")["X-Cache"], "MISS")
+        self.assertEqual(self.client.get("/api/events/")["X-Cache"], "HIT")
+
+    def test_staff_and_public_entries_are_separate(self):
+        Event.objects.update(is_visible=False)
+        self.assertEqual(self.client.get("/api/events/").json()["results"], [])
+
+        self.client.force_login(self.staff)
+        response = self.client.get("/api/events/")
+        self.assertEqual(response["X-Cache"], "MISS")
+        self.assertEqual(len(response.json()["results"]), 1)
+
+    def test_staff_update_invalidates(self):
+        self.get_detail()
+        self.client.get("/api/events/")
+
+        self.client.force_login(self.staff)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(
+                f"/api/events/{self.event.id}/",
+                {"name": "Novo nome"},
+                content_type="application/json",
+            )
+        self.client.logout()
+
+        response = self.get_detail()
+        self.assertEqual(response["X-Cache"], "MISS")
+        self.assertEqual(response.json()["name"], "Novo nome")
+        listing = self.client.get("/api/events/")
+        self.assertEqual(listing["X-Cache"], "MISS")
+        self.assertEqual(listing.json()["results"][0]["name"], "Novo nome")
+
+    def test_purchase_and_rating_invalidate(self):
+        ticket_type = TicketType.objects.get()
+        self.client.force_login(self.buyer)
+        remaining = self.get_detail().json()["ticket_types"][0]["remaining"]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                "/api/purchases/",
+                {"ticket_type_id": ticket_type.id, "quantity": 2},
+                content_type="application/json",
+            )
+        detail = self.get_detail().json()
+        self.assertEqual(detail["ticket_types"][0]["remaining"], remaining - 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(
+                f"/api/purchase/{response.json()['id']}/",
+                {"rating": 1, "rating_comment": "Mau"},
+                content_type="application/json",
+            )
+        self.assertEqual(self.get_detail().json()["rating_summary"]["count"], 2)
+
+    def test_stats_are_staff_only(self):
+        self.get_detail()
+        self.get_detail()
+        self.assertEqual(self.client.get("/api/cache/stats/").status_code, 403)
+
+        self.client.force_login(self.staff)
+        stats = self.client.get("/api/cache/stats/").json()
+        self.assertGreaterEqual(stats["hits"], 1)
+        self.assertGreaterEqual(stats["misses"], 1)
+
+
+class MetricsTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        metrics.clear()
+        create_events(2, ticket_types_per_event=1)
+        self.staff = User.objects.create_user(username="staff", is_staff=True)
+
+    def test_server_timing_counts_queries(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get("/api/events/")
+        timing = response["Server-Timing"]
+        self.assertRegex(timing, r"^app;dur=[\d.]+, db;dur=[\d.]+;")
+        self.assertIn(f'desc="{len(ctx.captured_queries)} queries"', timing)
+
+        response = self.client.get(f"/api/async/events/{Event.objects.first().id}/")
+        self.assertNotIn('desc="0 queries"', response["Server-Timing"])
+
+    def test_server_timing_counts_queries_of_asgi_worker_threads(self):
+        # Outside of the test's event loop, ASGI runs the ORM calls of sync and
+        # async views in worker threads, each with its own connections
+        event = Event.objects.first()
+        for path in [f"/api/events/{event.id}/", f"/api/async/events/{event.id}/"]:
+            response = asyncio.run(AsyncClient().get(path))
+            self.assertRegex(response["Server-Timing"], r'desc="[1-9]\d* queries"')
+
+    def test_metrics_per_route(self):
+        event = Event.objects.first()
+        self.client.get(f"/api/events/{event.id}/")
+        self.client.get(f"/api/events/{event.id}/")
+        self.client.get("/api/events/?period=soon")
+
+        self.client.force_login(self.staff)
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        detail = 'route="/api/events/<int:pk>/",method="GET"'
+        self.assertIn(f"http_request_duration_seconds_count{{{detail}}} 2", body)
+        self.assertIn(
+            f'http_request_duration_seconds_bucket{{{detail},le="+Inf"}} 2', body
+        )
+        self.assertIn(
+            'http_requests_total{route="/api/events/",method="GET",status="400"} 1',
+            body,
+        )
+        self.assertRegex(body, rf"db_queries_total\{{{detail}\}} [1-9]")
+        self.assertRegex(body, rf"http_response_size_bytes_total\{{{detail}\}} [1-9]")
+
+    @override_settings(METRICS_TOKEN="segredo")
+    def test_metrics_access(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 403)
+        response = self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer errado")
+        self.assertEqual(response.status_code, 403)
+        response = self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer segredo")
+        self.assertEqual(response.status_code, 200)
+
+
+class ConditionalGetTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        create_events(2, ticket_types_per_event=1)
+        self.event = Event.objects.first()
+        self.user = User.objects.create_user(username="comprador", password="x")
+
+    def assert_revalidates(self, url: str, queries=1):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("no-cache", response["Cache-Control"])
+
+        # Only the version query (and authentication) runs
+        with self.assertNumQueries(queries):
+            not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(not_modified.status_code, 304)
+
+        not_modified = self.client.get(
+            url, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"]
+        )
+        self.assertEqual(not_modified.status_code, 304)
+        return response["ETag"]
+
+    def test_event_detail(self):
+        url = f"/api/events/{self.event.id}/"
+        etag = self.assert_revalidates(url)
+
+        Event.objects.filter(pk=self.event.pk).touch()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_event_list(self):
+        etag = self.assert_revalidates("/api/events/?period=upcoming")
+
+        # Another query string is another representation
+        response = self.client.get("/api/events/?period=past", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        # Hiding doesn't touch updated_at, but the event leaves the listing
+        Event.objects.filter(pk=self.event.pk).update(is_visible=False)
+        response = self.client.get(
+            "/api/events/?period=upcoming", HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_events_move_to_the_past_listing_when_they_start(self):
+        # Last changed well before they start
+        Event.objects.update(updated_at=timezone.now() - timedelta(hours=1))
+        upcoming = self.client.get("/api/events/?period=upcoming")
+        past = self.client.get("/api/events/?period=past")
+
+        # As if the event had just started, without touching updated_at
+        Event.objects.filter(pk=self.event.pk).update(
+            date=timezone.now() - timedelta(minutes=1)
+        )
+        for path, before in [("upcoming", upcoming), ("past", past)]:
+            response = self.client.get(
+                f"/api/events/?period={path}", HTTP_IF_NONE_MATCH=before["ETag"]
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response["ETag"], before["ETag"])
+        self.assertIn(self.event.id, [e["id"] for e in response.json()["results"]])
+        response = self.client.get(
+            "/api/events/?period=upcoming",
+            HTTP_IF_MODIFIED_SINCE=upcoming["Last-Modified"],
+        )
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.get(
+            "/api/async/events/?period=upcoming",
+            HTTP_IF_NONE_MATCH=upcoming["ETag"],
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_purchases_change_with_ratings(self):
+        self.client.force_login(self.user)
+        ticket = Ticket.objects.create(
+            ticket_type=TicketType.objects.first(), user=self.user, quantity=1
+        )
+        # Session and user lookups come first
+        etag = self.assert_revalidates("/api/purchases/", queries=3)
+
+        self.client.patch(
+            f"/api/purchase/{ticket.id}/",
+            {"rating": 5, "rating_comment": "Ótimo"},
+            content_type="application/json",
+        )
+        response = self.client.get("/api/purchases/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+def event_payload(ticket_types: int, groups: list, ids=None):
+    return {
+        "name": "Importado",
+        "date": (timezone.now() + timedelta(days=1)).isoformat(),
+        "description": "Descrição",
+        "location": "ISCTE",
+        "latitude": 38.7,
+        "longitude": -9.1,
+        "ticket_types": [
+            {
+                **({"id": ids[i]} if ids and ids[i] else {}),
+                "name": f"Tipo {i}",
+                "price": "5.00",
+                "quantity_available": 10 + i,
+                "groups": groups,
+            }
+            for i in range(ticket_types)
+        ],
+    }
+
+
+class AsyncReadTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        create_events(3, ticket_types_per_event=2)
+        self.event = Event.objects.first()
+        self.user = User.objects.get(username="buyer")
+
+    def assert_same_as_sync(self, path: str):
+        get_cache().clear()
+        expected = self.client.get(f"/api/{path}")
+        get_cache().clear()
+        response = self.client.get(f"/api/async/{path}")
+        self.assertEqual(response.status_code, expected.status_code)
+        self.assertEqual(response.json(), expected.json())
+        return response
+
+    def test_responses_match_sync_views(self):
+        self.assert_same_as_sync("events/?limit=2")
+        self.assert_same_as_sync("events/?detail=full&period=upcoming")
+        self.assert_same_as_sync(f"events/{self.event.id}/")
+        self.assert_same_as_sync("events/?period=soon")
+        self.assert_same_as_sync("events/0/")
+
+        self.client.force_login(self.user)
+        self.assert_same_as_sync("purchases/?limit=1")
+        self.assert_same_as_sync("user/")
+
+    def test_cache_and_conditional_requests(self):
+        url = f"/api/async/events/{self.event.id}/"
+        self.assertEqual(self.client.get(url)["X-Cache"], "MISS")
+        response = self.client.get(url)
+        self.assertEqual(response["X-Cache"], "HIT")
+        self.assertIn("no-cache", response["Cache-Control"])
+
+        not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(not_modified.status_code, 304)
+
+    def test_login_required_and_read_only(self):
+        response = self.client.get("/api/async/purchases/")
+        self.assertEqual(response.status_code, 403)
+        self.assertIn("detail", response.json()["errors"])
+        self.assertEqual(self.client.post("/api/async/events/").status_code, 405)
+
+    async def test_async_client(self):
+        response = await self.async_client.get("/api/async/events/", {"limit": 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["results"]), 1)
+        self.assertIsNotNone(response.json()["next"])
+
+
+class EventWriteQueryCountTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.groups = [
+            Group.objects.create(name=name).id for name in ("Aluno", "Sócio")
+        ]
+
+    def create(self, ticket_types: int):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(
+                "/api/events/",
+                event_payload(ticket_types, self.groups),
+                content_type="application/json",
+            )
+        self.assertEqual(response.status_code, 201)
+        return len(ctx.captured_queries), response.json()
+
+    def update(self, event: dict):
+        payload = event_payload(
+            len(event["ticket_types"]) + 1,
+            self.groups[:1],
+            ids=[t["id"] for t in event["ticket_types"]] + [None],
+        )
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.patch(
+                f"/api/events/{event['id']}/",
+                payload,
+                content_type="application/json",
+            )
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries), response.json()
+
+    def test_create_query_count_is_constant(self):
+        small_count, _ = self.create(1)
+        large_count, event = self.create(20)
+
+        self.assertEqual(small_count, large_count)
+        self.assertEqual(len(event["ticket_types"]), 20)
+        self.assertEqual(event["ticket_types"][19]["groups"], self.groups)
+
+    def test_update_query_count_is_constant(self):
+        small_count, _ = self.update(self.create(1)[1])
+        large_count, event = self.update(self.create(20)[1])
+
+        self.assertEqual(small_count, large_count)
+        self.assertEqual(len(event["ticket_types"]), 21)
+        self.assertTrue(
+            all(t["groups"] == self.groups[:1] for t in event["ticket_types"])
+        )
+
+    def test_update_keeps_sold_counter_and_drops_missing_types(self):
+        event = self.create(3)[1]
+        kept = event["ticket_types"][0]["id"]
+        TicketType.objects.filter(pk=kept).update(tickets_sold=4)
+
+        payload = event_payload(2, self.groups, ids=[kept, 999])
+        response = self.client.patch(
+            f"/api/events/{event['id']}/", payload, content_type="application/json"
+        )
+
+        ticket_types = response.json()["ticket_types"]
+        self.assertEqual(len(ticket_types), 2)
+        self.assertEqual(ticket_types[0]["remaining"], 10 - 4)
+        # Unknown ids create a new ticket type instead of being dropped
+        self.assertNotIn(999, [t["id"] for t in ticket_types])
+
+
+class TaskTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        flaky_calls.clear()
+
+    def test_tasks_only_exist_if_the_transaction_commits(self):
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            enqueue("test_flaky", {"value": 1})
+            raise RuntimeError()
+        enqueue("test_flaky", {"value": 2})
+
+        self.assertEqual(run_pending(), 1)
+        self.assertEqual(flaky_calls, [2])
+        self.assertEqual(Task.objects.get().status, Task.Status.DONE)
+
+    def test_idempotency_key(self):
+        enqueue("test_flaky", {"value": 1}, key="um")
+        enqueue("test_flaky", {"value": 2}, key="um")
+        enqueue("test_flaky", {"value": 3}, key="dois")
+
+        run_pending()
+        self.assertEqual(flaky_calls, [1, 3])
+        with self.assertRaises(ValueError):
+            enqueue("nao_existe")
+
+    def test_failed_tasks_are_retried_with_backoff(self):
+        enqueue("test_flaky", {"value": 1, "failures": 5})
+        with self.assertLogs("api.tasks", "ERROR"):
+            self.assertEqual(run_pending(), 1)
+        task = Task.objects.get()
+        self.assertEqual(task.status, Task.Status.PENDING)
+        self.assertIn("Falhou", task.last_error)
+        # Not due yet
+        self.assertEqual(run_pending(), 0)
+
+        Task.objects.update(run_at=timezone.now())
+        with self.assertLogs("api.tasks", "ERROR"):
+            run_pending()
+        task.refresh_from_db()
+        self.assertEqual((task.status, task.attempts), (Task.Status.FAILED, 2))
+        self.assertEqual(flaky_calls, [1, 1])
+
+    def test_tasks_of_dead_workers_are_requeued(self):
+        enqueue("test_flaky", {"value": 1})
+        self.assertEqual(len(claim(10)), 1)
+        self.assertEqual(claim(10), [])
+
+        self.assertEqual(requeue_stale(), 0)
+        Task.objects.update(locked_until=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(requeue_stale(), 1)
+        self.assertEqual(run_pending(), 1)
+        self.assertEqual(flaky_calls, [1])
+
+    def test_purchase_confirmation_is_sent_by_the_worker(self):
+        create_events(1, ticket_types_per_event=1)
+        user = User.objects.create_user(
+            username="comprador", password="x", email="comprador@example.com"
+        )
+        user.groups.set(Group.objects.all())
+        self.client.force_login(user)
+        for _ in range(2):
+            response = self.client.post(
+                "/api/purchases/",
+                {"ticket_type_id": TicketType.objects.get().id, "quantity": 2},
+                content_type="application/json",
+            )
+        self.assertEqual(response.status_code, 200)
+        # Nothing was sent during the requests
+        self.assertEqual(len(mail.outbox), 0)
+
+        out = StringIO()
+        call_command("run_tasks", once=True, stdout=out)
+        self.assertIn("Corridas 2 tarefas", out.getvalue())
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(mail.outbox[0].to, ["comprador@example.com"])
+        self.assertIn("Evento 0", mail.outbox[0].subject)
+        self.assertIn("Tem agora 4 bilhete(s)", mail.outbox[1].body)
+
+
+class BenchmarkDataTests(APITestCase):
+    def test_generated_data_is_consistent(self):
+        call_command(
+            "seed_benchmark",
+            events=6,
+            ticket_types=2,
+            tickets=3,
+            users=4,
+            groups=2,
+            stdout=StringIO(),
+        )
+        self.assertEqual(Event.objects.count(), 6)
+        self.assertEqual(TicketType.objects.count(), 12)
+        self.assertEqual(Ticket.objects.count(), 36)
+        for ticket_type in TicketType.objects.annotate(sold=Sum("tickets__quantity")):
+            self.assertEqual(ticket_type.tickets_sold, ticket_type.sold)
+        self.assertTrue(
+            self.client.login(username="bench-user-0", password="bench-password")
+        )
+
+        # Running it again replaces the data instead of adding to it
+        call_command("seed_benchmark", events=2, users=2, stdout=StringIO())
+        self.assertEqual(Event.objects.count(), 2)
+        self.assertEqual(User.objects.filter(username__startswith="bench").count(), 2)
+
+
+class EventSearchTests(APITestCase):
+    def create_event(self, name, description="Descrição", location="ISCTE", **kwargs):
+        return Event.objects.create(
+            name=name,
+            date=timezone.now() + timedelta(days=1),
+            description=description,
+            location=location,
+            latitude=kwargs.pop("latitude", 38.7),
+            longitude=kwargs.pop("longitude", -9.1),
+            is_visible=kwargs.pop("is_visible", True),
+        )
+
+    def search(self, **params):
+        response = self.client.get("/api/events/search/", params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def names(self, **params):
+        return [event["name"] for event in self.search(**params)["results"]]
+
+    def test_text_search_is_ranked(self):
+        self.create_event("Noite de fado", location="Alfama")
+        self.create_event("Jantar", description="Com fado ao vivo")
+        self.create_event("Concerto de rock")
+        self.create_event("Fado escondido", is_visible=False)
+
+        # Matches in the name rank above matches in the description
+        self.assertEqual(self.names(q="fado"), ["Noite de fado", "Jantar"])
+        self.assertEqual(self.names(q="fado alfama"), ["Noite de fado"])
+        # Accents are ignored and the last word is a prefix
+        self.assertEqual(self.names(q="concer"), ["Concerto de rock"])
+        self.assertEqual(self.names(q="cônçêrtó"), ["Concerto de rock"])
+        # Words are never read as FTS operators
+        self.assertEqual(self.names(q='fado" OR rock*'), [])
+
+    def test_index_follows_writes(self):
+        event = self.create_event("Festival de verão")
+        Event.objects.filter(pk=event.pk).update(name="Festival de inverno")
+        self.assertEqual(self.names(q="verão"), [])
+        self.assertEqual(self.names(q="inverno"), ["Festival de inverno"])
+
+        event.delete()
+        self.assertEqual(self.names(q="inverno"), [])
+
+    def test_near_me(self):
+        self.create_event("Lisboa", latitude=38.7223, longitude=-9.1393)
+        self.create_event("Sintra", latitude=38.8029, longitude=-9.3817)
+        self.create_event("Porto", latitude=41.1579, longitude=-8.6291)
+
+        results = self.search(lat=38.7223, lon=-9.1393)["results"]
+        self.assertEqual([event["name"] for event in results], ["Lisboa", "Sintra"])
+        self.assertAlmostEqual(results[1]["distance"], 22.5, delta=0.5)
+        self.assertEqual(len(self.names(lat=38.7223, lon=-9.1393, radius=300)), 3)
+        # Text narrows the search down, distance still decides the order
+        self.assertEqual(
+            self.names(q="porto", lat=38.7, lon=-9.1, radius=300), ["Porto"]
+        )
+
+    def test_cursor_walks_every_match_once(self):
+        for i in range(7):
+            self.create_event(f"Feira {i}", description="feira " * i)
+        seen, cursor = [], None
+        while True:
+            page = self.search(
+                q="feira", limit=3, **({"cursor": cursor} if cursor else {})
+            )
+            seen += [event["name"] for event in page["results"]]
+            cursor = page["next"]
+            if not cursor:
+                break
+        self.assertCountEqual(seen, [f"Feira {i}" for i in range(7)])
+
+    def test_invalid_parameters(self):
+        for params in [
+            {},
+            {"q": "!!"},
+            {"lat": 38},
+            {"lat": 91, "lon": 0},
+            {"lat": "x", "lon": 0},
+        ]:
+            response = self.client.get("/api/events/search/", params)
+            self.assertEqual(response.status_code, 400, params)
+
+
+class EventBulkTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.group = Group.objects.create(name="Aluno")
+        self.staff = User.objects.create_user(
+            username="staff", password="x", is_staff=True
+        )
+        self.client.force_login(self.staff)
+
+    def import_lines(self, lines: list, **kwargs):
+        body = "\n".join(
+            line if isinstance(line, str) else json.dumps(line) for line in lines
+        )
+        return self.client.post(
+            "/api/events/bulk/", body, content_type="application/x-ndjson", **kwargs
+        )
+
+    def test_import_reports_errors_per_line(self):
+        valid = event_payload(2, [self.group.id])
+        response = self.import_lines(
+            [valid, "{nope", {**valid, "latitude": 500}, "", valid]
+        )
+
+        self.assertEqual(response.status_code, 201)
+        report = response.json()
+        self.assertEqual(report["created"], 2)
+        self.assertEqual([e["line"] for e in report["errors"]], [2, 3])
+        self.assertIn("latitude", report["errors"][1]["errors"])
+        self.assertEqual(TicketType.objects.count(), 4)
+        self.assertEqual(
+            TicketType.groups.through.objects.filter(group=self.group).count(), 4
+        )
+
+    def test_import_is_batched(self):
+        lines = [json.dumps(event_payload(1, [self.group.id])) for _ in range(7)]
+        with CaptureQueriesContext(connection) as ctx:
+            import_events(lines, batch_size=3)
+
+        inserts = [
+            q
+            for q in ctx.captured_queries
+            if q["sql"].startswith('INSERT INTO "api_event"')
+        ]
+        self.assertEqual(len(inserts), 3)
+        self.assertEqual(Event.objects.count(), 7)
+
+    def test_export_round_trips(self):
+        self.import_lines([event_payload(3, [self.group.id]) for _ in range(2)])
+
+        response = self.client.get("/api/events/bulk/")
+        self.assertTrue(response.streaming)
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(len(json.loads(lines[0])["ticket_types"]), 3)
+
+        self.assertEqual(self.import_lines(lines).json()["created"], 2)
+        self.assertEqual(Event.objects.count(), 4)
+
+    def test_staff_only(self):
+        self.client.logout()
+        self.assertEqual(self.client.get("/api/events/bulk/").status_code, 403)
+        response = self.import_lines([event_payload(1, [self.group.id])])
+        self.assertEqual(response.status_code, 403)
+
+
+def make_image(width=2000, height=1000, image_format="PNG", color="red"):
+    buffer = BytesIO()
+    Image.new("RGB", (width, height), color).save(buffer, image_format)
+    return SimpleUploadedFile(
+        f"imagem.{image_format.lower()}", buffer.getvalue(), f"image/{image_format}"
+    )
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), MEDIA_URL="/images/")
+class ImageUploadTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        os.makedirs(settings.MEDIA_ROOT, exist_ok=True)
+
+    def tearDown(self):
+        # Variants of uploads made through the view may still be being written.
+        # Each worker only reaches the barrier once done with its earlier jobs
+        barrier = Barrier(settings.IMAGE_WORKERS)
+        for future in [
+            executor.submit(barrier.wait) for _ in range(settings.IMAGE_WORKERS)
+        ]:
+            future.result()
+        shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
+
+    def upload(self, image):
+        return self.client.post("/api/upload/", {"image": image})
+
+    def test_variants_are_resized_webp(self):
+        url, future = save_upload(make_image())
+        future.result()
+
+        base = os.path.join(settings.MEDIA_ROOT, url.removeprefix("/images/"))
+        self.assertTrue(os.path.exists(base))
+        for variant, width in VARIANTS.items():
+            with Image.open(f"{os.path.splitext(base)[0]}-{variant}.webp") as image:
+                self.assertEqual(image.format, "WEBP")
+                self.assertEqual(image.size, (width, width // 2))
+
+    def test_small_images_are_not_upscaled(self):
+        url, future = save_upload(make_image(100, 100, "JPEG"))
+        future.result()
+
+        self.assertTrue(url.endswith(".jpg"))
+        thumb = get_variant_urls(url)["thumb"].removeprefix("/images/")
+        with Image.open(os.path.join(settings.MEDIA_ROOT, thumb)) as image:
+            self.assertEqual(image.size, (100, 100))
+
+    def test_identical_uploads_are_stored_once(self):
+        first = self.upload(make_image()).json()
+        second = self.upload(make_image()).json()
+        other = self.upload(make_image(color="blue")).json()
+
+        self.assertEqual(first["image_path"], second["image_path"])
+        self.assertNotEqual(first["image_path"], other["image_path"])
+        self.assertEqual(
+            first["image_variants"]["card"],
+            os.path.splitext(first["image_path"])[0] + "-card.webp",
+        )
+
+    def test_rejects_non_images_and_large_files(self):
+        fake = SimpleUploadedFile("imagem.png", b"not an image", "image/png")
+        self.assertEqual(self.upload(fake).status_code, 400)
+
+        with self.settings(MAX_IMAGE_UPLOAD_SIZE=100):
+            self.assertEqual(self.upload(make_image()).status_code, 400)
+            # Refused from its Content-Length, before reading it
+            large = SimpleUploadedFile("imagem.png", bytes(200 * 1024), "image/png")
+            response = self.upload(large)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn("não pode ter mais de", str(response.json()))
+        self.assertEqual(os.listdir(settings.MEDIA_ROOT), [])
+
+    def test_missing_variants_are_made_again(self):
+        url, future = save_upload(make_image())
+        future.result()
+        self.assertIsNone(save_upload(make_image())[1])
+
+        thumb = get_variant_urls(url)["thumb"].removeprefix("/images/")
+        os.remove(os.path.join(settings.MEDIA_ROOT, thumb))
+        _, future = save_upload(make_image())
+        future.result()
+        self.assertTrue(os.path.exists(os.path.join(settings.MEDIA_ROOT, thumb)))
+
+    def test_event_serializers_return_variants(self):
+        create_events(1, ticket_types_per_event=1)
+        url = "/images/ab/" + "ab" * 32 + ".png"
+        Event.objects.update(image=url)
+
+        listing = self.client.get("/api/events/").json()["results"][0]
+        self.assertEqual(
+            listing["image_variants"]["thumb"], url.replace(".png", "-thumb.webp")
+        )
+        Event.objects.update(image="/images/upload_antiga.png")
+        detail = self.client.get(f"/api/events/{listing['id']}/").json()
+        self.assertIsNone(detail["image_variants"])
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), MEDIA_OFFLOAD=None)
+class MediaServingTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.content = bytes(range(256)) * 4
+        self.hashed = f"ab/{'ab' * 32}.png"
+        self.variant = f"ab/{'ab' * 32}-card.webp"
+        for name in (self.hashed, self.variant, "upload_antiga.png"):
+            path = os.path.join(settings.MEDIA_ROOT, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as file:
+                file.write(self.content)
+
+    def tearDown(self):
+        shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
+
+    def get(self, name: str, **headers):
+        return self.client.get(f"/images/{name}", headers=headers)
+
+    def test_content_addressed_files_are_immutable(self):
+        response = self.get(self.hashed)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), self.content)
+        self.assertIn("immutable", response["Cache-Control"])
+        self.assertEqual(response["Content-Type"], "image/png")
+
+        variant = self.get(self.variant)
+        self.assertEqual(variant.status_code, 200)
+        self.assertIn("immutable", variant["Cache-Control"])
+        self.assertEqual(variant["Content-Type"], "image/webp")
+
+        legacy = self.get("upload_antiga.png")
+        self.assertNotIn("immutable", legacy["Cache-Control"])
+
+    def test_conditional_requests(self):
+        response = self.get(self.hashed)
+        self.assertEqual(
+            self.get(self.hashed, if_none_match=response["ETag"]).status_code, 304
+        )
+        self.assertEqual(
+            self.get(
+                self.hashed, if_modified_since=response["Last-Modified"]
+            ).status_code,
+            304,
+        )
+
+    def test_range_requests(self):
+        response = self.get(self.hashed, range="bytes=10-19")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b"".join(response.streaming_content), self.content[10:20])
+        self.assertEqual(response["Content-Range"], f"bytes 10-19/{len(self.content)}")
+
+        suffix = self.get(self.hashed, range="bytes=-4")
+        self.assertEqual(b"".join(suffix.streaming_content), self.content[-4:])
+
+        self.assertEqual(self.get(self.hashed, range="bytes=5000-").status_code, 416)
+        # A range for another version of the file gets the whole file
+        stale = self.get(self.hashed, range="bytes=0-1", if_range='"outro"')
+        self.assertEqual(stale.status_code, 200)
+
+    def test_offload_to_web_server(self):
+        with self.settings(MEDIA_OFFLOAD="x-accel-redirect"):
+            response = self.get(self.hashed)
+        self.assertEqual(
+            response["X-Accel-Redirect"], f"/protected-images/{self.hashed}"
+        )
+        self.assertEqual(response.content, b"")
+
+        with self.settings(MEDIA_OFFLOAD="x-sendfile"):
+            response = self.get(self.hashed)
+        self.assertEqual(
+            response["X-Sendfile"], os.path.join(settings.MEDIA_ROOT, self.hashed)
+        )
+
+    def test_missing_files_and_traversal(self):
+        self.assertEqual(self.get("nada.png").status_code, 404)
+        self.assertEqual(self.get("../settings.py").status_code, 404)
+        self.assertEqual(self.get("ab").status_code, 404)
+
+
+@override_settings(
+    CACHES={
+        # Stand-in for a cache shared by several processes, such as Redis
+        "shared": {
+            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+            "LOCATION": os.path.join(tempfile.gettempdir(), "api_test_cache"),
+        },
+        "sessions": settings.CACHES["sessions"],
+    },
+    EVENT_CACHE_ALIAS="shared",
+)
+class SharedEventCacheTests(EventCacheTests):
+    def tearDown(self):
+        get_cache().clear()
+
+
+class CheckInTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        # Seats checked in by other tests are kept in memory
+        forget_redeemed()
+        create_events(2, ticket_types_per_event=1)
+        self.ticket = Ticket.objects.select_related("ticket_type").first()
+        Ticket.objects.filter(pk=self.ticket.pk).update(quantity=3)
+        self.event_id = self.ticket.ticket_type.event_id
+        self.staff = User.objects.create_user(username="porteiro", is_staff=True)
+        self.client.force_login(self.staff)
+
+    def scan(self, *codes, event=None):
+        return self.client.post(
+            "/api/checkin/",
+            {"event": event or self.event_id, "codes": list(codes)},
+            content_type="application/json",
+        )
+
+    def statuses(self, response) -> list[str]:
+        self.assertEqual(response.status_code, 200)
+        return [result["status"] for result in response.json()["results"]]
+
+    def test_codes_are_signed(self):
+        code = make_code(self.event_id, self.ticket.pk, 2)
+        self.assertEqual(read_code(code), (self.event_id, self.ticket.pk, 2))
+        forged = code.replace(f".{self.ticket.pk}.", f".{self.ticket.pk + 1}.")
+        self.assertIsNone(read_code(forged))
+        self.assertIsNone(read_code("lixo"))
+
+    def test_owner_gets_one_code_per_seat(self):
+        self.client.force_login(self.ticket.user)
+        codes = self.client.get(f"/api/purchase/{self.ticket.pk}/codes/").json()
+        self.assertEqual(
+            [read_code(code) for code in codes["codes"]],
+            [(self.event_id, self.ticket.pk, seat) for seat in range(3)],
+        )
+
+        response = self.client.get(f"/api/purchase/{self.ticket.pk}/pdf/")
+        self.assertEqual(response["Content-Type"], "application/pdf")
+        self.assertTrue(response.content.startswith(b"%PDF"))
+        self.assertEqual(response.content.count(b"/Type /Page\n"), 3)
+
+    def test_only_the_owner_gets_the_codes(self):
+        self.client.force_login(User.objects.create_user(username="outro"))
+        response = self.client.get(f"/api/purchase/{self.ticket.pk}/codes/")
+        self.assertEqual(response.status_code, 403)
+        response = self.client.get(f"/api/purchase/{self.ticket.pk}/pdf/")
+        self.assertEqual(response.status_code, 403)
+
+    def test_each_seat_checks_in_once(self):
+        first, second = (make_code(self.event_id, self.ticket.pk, s) for s in (0, 1))
+        response = self.scan(first, second, first)
+        self.assertEqual(self.statuses(response), ["admitted", "admitted", "duplicate"])
+        self.assertEqual(response.json()["admitted"], 2)
+        self.assertEqual(self.statuses(self.scan(second)), ["duplicate"])
+        self.assertEqual(CheckIn.objects.filter(event_id=self.event_id).count(), 2)
+
+        # Seats checked in by another process are rejected by the INSERT
+        CheckIn.objects.create(ticket=self.ticket, seat=2, event_id=self.event_id)
+        third = make_code(self.event_id, self.ticket.pk, 2)
+        # Session, user, ticket and INSERT
+        with self.assertNumQueries(4):
+            self.assertEqual(self.statuses(self.scan(third)), ["duplicate"])
+        # Then they are known, and rejected without querying
+        with self.assertNumQueries(2):
+            self.assertEqual(self.statuses(self.scan(third)), ["duplicate"])
+
+        # A new process loads the seats checked in so far
+        forget_redeemed()
+        self.assertEqual(self.statuses(self.scan(first)), ["duplicate"])
+
+    def test_rejects_other_events_and_invalid_seats(self):
+        other = Ticket.objects.exclude(pk=self.ticket.pk).select_related("ticket_type")
+        other = other.get()
+        codes = [
+            make_code(other.ticket_type.event_id, other.pk, 0),
+            make_code(self.event_id, self.ticket.pk, 3),
+            make_code(self.event_id, other.pk, 0),
+            "1.2.3:assinatura",
+            None,
+        ]
+        self.assertEqual(
+            self.statuses(self.scan(*codes)),
+            ["other_event", "revoked", "revoked", "invalid", "invalid"],
+        )
+        self.assertFalse(CheckIn.objects.exists())
+
+    def test_only_staff_can_check_in(self):
+        self.client.force_login(self.ticket.user)
+        code = make_code(self.event_id, self.ticket.pk, 0)
+        self.assertEqual(self.scan(code).status_code, 403)
+        with self.settings(CHECKIN_MAX_BATCH=1):
+            self.client.force_login(self.staff)
+            self.assertEqual(self.scan(code, code).status_code, 400)
+
+
+class StatsTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        create_events(2, ticket_types_per_event=2)
+        self.event = Event.objects.first()
+        self.ticket_type = self.event.ticket_types.first()
+        self.user = User.objects.create_user(username="comprador")
+        self.user.groups.set(Group.objects.all())
+        self.staff = User.objects.create_user(username="gestor", is_staff=True)
+
+    def buy(self, quantity: int):
+        self.client.force_login(self.user)
+        response = self.client.post(
+            "/api/purchases/",
+            {"ticket_type_id": self.ticket_type.id, "quantity": quantity},
+            content_type="application/json",
+        )
+        self.assertIn(response.status_code, (200, 201))
+        return response.json()["id"]
+
+    def rate(self, ticket_id: int, rating):
+        self.client.force_login(self.user)
+        response = self.client.patch(
+            f"/api/purchase/{ticket_id}/",
+            {"rating": rating, "rating_comment": None},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 204)
+
+    def stats(self) -> dict:
+        response = self.client.get(f"/api/events/{self.event.id}/stats/")
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_purchases_and_ratings_update_the_rollups(self):
+        # The tickets created by create_events predate the rollups
+        rebuild()
+        ticket_id = self.buy(2)
+        self.buy(1)
+        reservation = self.client.post(
+            "/api/reservations/",
+            {"ticket_type_id": self.ticket_type.id, "quantity": 4},
+            content_type="application/json",
+        ).json()
+        self.client.post(f"/api/reservations/{reservation['id']}/confirm/")
+        self.rate(ticket_id, 1)
+        self.rate(ticket_id, 3)
+
+        self.client.force_login(self.staff)
+        stats = self.stats()
+        self.assertEqual(stats["tickets_sold"], 9)
+        self.assertEqual(stats["revenue"], "45.00")
+        self.assertEqual(
+            [(t["tickets_sold"], t["revenue"]) for t in stats["ticket_types"]],
+            [(8, "40.00"), (1, "5.00")],
+        )
+        self.assertEqual(
+            stats["sales"],
+            [
+                {
+                    "day": timezone.localdate().isoformat(),
+                    "tickets": 9,
+                    "revenue": "45.00",
+                }
+            ],
+        )
+        self.assertEqual(
+            stats["ratings"]["histogram"], {"1": 0, "2": 0, "3": 1, "4": 0, "5": 2}
+        )
+
+        # A rebuild from the tickets gives the same figures
+        rebuild()
+        self.assertEqual(self.stats(), stats)
+        self.rate(ticket_id, None)
+        self.client.force_login(self.staff)
+        self.assertEqual(
+            self.stats()["ratings"],
+            json.loads(json.dumps(self.event.rating_summary())),
+        )
+
+    def test_stats_read_only_the_rollups(self):
+        rebuild()
+        self.client.force_login(self.staff)
+        # Session, user, event, ticket types, sales and ratings
+        with self.assertNumQueries(6):
+            self.stats()
+        Ticket.objects.bulk_create(
+            Ticket(ticket_type=self.ticket_type, user=user, quantity=1, rating=4)
+            for user in User.objects.bulk_create(
+                User(username=f"fã {i}") for i in range(50)
+            )
+        )
+        rebuild()
+        with self.assertNumQueries(6):
+            self.assertEqual(self.stats()["tickets_sold"], 52)
+        self.assertEqual(SalesRollup.objects.count(), 4)
+        self.assertEqual(RatingRollup.objects.count(), 2)
+
+    def test_dashboard_lists_every_event(self):
+        call_command("rebuild_stats", stdout=StringIO())
+        self.client.force_login(self.staff)
+        # Session, user, events with their ratings and their sales
+        with self.assertNumQueries(4):
+            data = self.client.get("/api/stats/?limit=1").json()
+        self.assertEqual(len(data["results"]), 1)
+        latest = data["results"][0]
+        self.assertEqual(latest["tickets_sold"], 2)
+        self.assertEqual(latest["revenue"], "10.00")
+        self.assertEqual(latest["ratings"]["count"], 2)
+        data = self.client.get(f"/api/stats/?cursor={data['next']}").json()
+        self.assertEqual(data["results"][0]["id"], self.event.id)
+
+    def test_only_staff_see_stats(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get("/api/stats/").status_code, 403)
+        response = self.client.get(f"/api/events/{self.event.id}/stats/")
+        self.assertEqual(response.status_code, 403)
+
+
+class AvailabilityTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        create_events(2, ticket_types_per_event=2)
+        self.event = Event.objects.first()
+        self.ticket_type = self.event.ticket_types.first()
+        self.url = f"/api/events/{self.event.id}/availability/stream/"
+        self.user = User.objects.create_user(username="comprador")
+        self.user.groups.set(Group.objects.all())
+
+    def seats(self, message: bytes) -> dict:
+        data = message.decode().split("data: ")[1]
+        return {t["id"]: t["remaining"] for t in json.loads(data)["ticket_types"]}
+
+    def buy(self, quantity: int):
+        self.client.force_login(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                "/api/purchases/",
+                {"ticket_type_id": self.ticket_type.id, "quantity": quantity},
+                content_type="application/json",
+            )
+        self.assertEqual(response.status_code, 201)
+
+    def publish_once(self):
+        # One read for all of the watchers, none for events without watchers
+        other = Event.objects.exclude(pk=self.event.pk).get()
+        with self.assertNumQueries(1):
+            publish([self.event.id, other.id])
+
+    async def test_changes_are_pushed_to_every_watcher(self):
+        watchers = []
+        for _ in range(3):
+            response = await self.async_client.get(self.url)
+            self.assertEqual(response["Content-Type"], "text/event-stream")
+            watchers.append(response.streaming_content)
+        for messages in watchers:
+            first = await anext(messages)
+            self.assertTrue(first.startswith(b"retry: 5000\n"))
+            self.assertEqual(self.seats(first)[self.ticket_type.id], 100)
+
+        await sync_to_async(self.buy)(2)
+        for messages in watchers:
+            self.assertEqual(self.seats(await anext(messages))[self.ticket_type.id], 98)
+
+        await sync_to_async(self.publish_once)()
+        for messages in watchers:
+            await anext(messages)
+            await messages.aclose()
+
+    async def test_closed_streams_stop_watching(self):
+        messages = stream(self.event.id, keep_open=True)
+        await anext(messages)
+        self.assertIn(self.event.id, subscriptions)
+        await messages.aclose()
+        self.assertNotIn(self.event.id, subscriptions)
+
+    async def test_idle_streams_send_heartbeats(self):
+        with self.settings(AVAILABILITY_HEARTBEAT=0.01):
+            messages = (await self.async_client.get(self.url)).streaming_content
+            await anext(messages)
+            self.assertEqual(await anext(messages), b": ping\n\n")
+            await messages.aclose()
+
+    def test_wsgi_servers_send_one_message(self):
+        response = self.client.get(self.url)
+        # As a WSGI server reads it
+        with self.assertWarns(Warning):
+            messages = list(response)
+        self.assertEqual(len(messages), 1)
+        self.assertEqual(len(self.seats(messages[0])), 2)
+
+    def test_hidden_events_are_not_streamed(self):
+        Event.objects.filter(pk=self.event.pk).update(is_visible=False)
+        self.assertEqual(self.client.get(self.url).status_code, 400)
+
+
+# As when REDIS_URL is set
+@override_settings(
+    SESSION_ENGINE="django.contrib.sessions.backends.cached_db",
+    USER_CACHE_ALIAS="sessions",
+)
+class SessionTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.staff = User.objects.create_user(
+            username="staff", password="x", is_staff=True
+        )
+
+    def login(self, username: str, password: str = "x"):
+        response = self.client.post(
+            "/api/login/",
+            {"username": username, "password": password},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_authenticated_requests_do_not_query_the_session_or_user(self):
+        self.login("staff")
+        self.assertEqual(self.client.get("/api/cache/stats/").status_code, 200)
+
+        with self.assertNumQueries(0):
+            response = self.client.get("/api/cache/stats/")
+        self.assertEqual(response.status_code, 200)
+
+    def test_saved_users_are_not_served_from_the_cache(self):
+        self.login("staff")
+        self.assertEqual(self.client.get("/api/cache/stats/").status_code, 200)
+
+        self.staff.is_staff = False
+        self.staff.save()
+        self.assertEqual(self.client.get("/api/cache/stats/").status_code, 403)
+
+        self.staff.delete()
+        self.assertEqual(self.client.get("/api/user/").status_code, 403)
+
+    @override_settings(
+        SESSION_ENGINE="django.contrib.sessions.backends.db", USER_CACHE_ALIAS=None
+    )
+    def test_users_are_not_cached_in_memory_of_a_single_process(self):
+        self.login("staff")
+        self.assertEqual(self.client.get("/api/cache/stats/").status_code, 200)
+
+        # As if another worker had changed them
+        User.objects.filter(pk=self.staff.pk).update(is_staff=False)
+        self.assertEqual(self.client.get("/api/cache/stats/").status_code, 403)
+
+    def test_signup_logs_in(self):
+        # New users join the first group
+        Group.objects.create(pk=1, name="Aluno")
+        response = self.client.post(
+            "/api/signup/",
+            {"username": "novo", "password": "Palavra-passe-1"},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.client.get("/api/user/").json()["username"], "novo")
+
+    @skipUnless(find_spec("argon2"), "Needs argon2-cffi")
+    def test_passwords_are_rehashed_with_argon2_on_login(self):
+        User.objects.create(
+            username="antigo", password=make_password("x", hasher="pbkdf2_sha256")
+        )
+        self.login("antigo")
+
+        password = User.objects.get(username="antigo").password
+        self.assertTrue(password.startswith("argon2$argon2id$v=19$m=19456,t=2,p=1$"))
+        # The new hash still works
+        self.client.logout()
+        self.login("antigo")
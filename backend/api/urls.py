@@ -1,5 +1,5 @@
 from django.urls import path
-from . import views
+from . import async_views, views
 
 app_name = "api"
 
@@ -9,8 +9,28 @@ urlpatterns = [
     path("logout/", views.LogoutView.as_view()),
     path("user/", views.UserView.as_view()),
     path("events/", views.EventMultipleView.as_view()),
+    path("events/bulk/", views.EventBulkView.as_view()),
+    path("events/search/", views.EventSearchView.as_view()),
     path("events/<int:pk>/", views.EventSingleView.as_view()),
+    path("events/<int:pk>/reviews/", views.EventReviewsView.as_view()),
+    path("events/<int:pk>/stats/", views.EventStatsView.as_view()),
+    path("events/<int:pk>/availability/stream/", async_views.availability),
+    path("events/<int:pk>/queue/", views.WaitingRoomView.as_view()),
+    path("queue/<str:token>/", views.QueueEntryView.as_view()),
     path("purchase/<int:pk>/", views.PurchaseSingleView.as_view()),
+    path("purchase/<int:pk>/codes/", views.TicketCodesView.as_view()),
+    path("purchase/<int:pk>/pdf/", views.TicketPdfView.as_view()),
     path("purchases/", views.PurchasesView.as_view()),
+    path("checkin/", views.CheckInView.as_view()),
+    path("stats/", views.StatsView.as_view()),
+    path("reservations/", views.ReservationsView.as_view()),
+    path("reservations/<int:pk>/", views.ReservationSingleView.as_view()),
+    path("reservations/<int:pk>/confirm/", views.ReservationConfirmView.as_view()),
     path("upload/", views.UploadImageView.as_view()),
+    path("cache/stats/", views.CacheStatsView.as_view()),
+    # Non-blocking versions of the read endpoints, for ASGI servers
+    path("async/user/", async_views.user),
+    path("async/events/", async_views.event_list),
+    path("async/events/<int:pk>/", async_views.event_detail),
+    path("async/purchases/", async_views.purchases),
 ]
@@ -1,39 +1,81 @@
 from django.contrib.auth.models import User
 from django.contrib.auth import authenticate, login, logout
-from django.core.files.storage import FileSystemStorage
-from django.http import JsonResponse
+from django.db import transaction
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from rest_framework.decorators import permission_classes
 from rest_framework.exceptions import ValidationError, PermissionDenied
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.request import Request
 from rest_framework.views import APIView
 from rest_framework import status
-from backend.settings import MEDIA_ROOT
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .availability import seats_changed
+from .bulk import export_events, import_events
+from .checkin import ADMITTED, check_in, get_codes, render_pdf
+from .cache import (
+    cached_response,
+    get_detail_key,
+    get_list_key,
+    invalidate_listings,
+    stats as cache_stats,
+)
+from .conditional import (
+    conditional,
+    event_detail_etag,
+    event_detail_last_modified,
+    event_detail_version,
+    event_list_etag,
+    event_list_last_modified,
+    purchases_etag,
+    purchases_last_modified,
+)
+from .groups import eligibility_context, remember_group_ids
+from .images import (
+    UploadLimitHandler,
+    get_variant_urls,
+    save_upload,
+    too_large_error,
+)
+from . import reservations
+from .pagination import paginate_by_date, paginate_by_id, paginate_by_score
+from .search import search_events
+from .stats import event_stats, events_stats, record_rating, record_sale
+from .tasks import on_purchase_confirmed
 
 from .serializers import (
     UserSerializer,
     EventSerializer,
+    EventDetailSerializer,
+    EventListSerializer,
+    EventSearchSerializer,
     TicketTypeSerializer,
     TicketSerializer,
+    TicketRatingSerializer,
+    QueueEntrySerializer,
+    ReservationSerializer,
+    WaitingRoomSerializer,
 )
-from .models import Event, TicketType, Ticket
+from .models import Event, QueueEntry, Reservation, TicketType, Ticket, WaitingRoom
 
 
 class SignupView(APIView):
     def post(self, request: Request):
-        serializer: UserSerializer = UserSerializer(data=request.data)
+        serializer: UserSerializer = UserSerializer(
+            data=request.data, context={"can_set_groups": request.user.is_staff}
+        )
         if serializer.is_valid():
             user: User = serializer.save()
-            user = authenticate(
-                request, username=user.username, password=request.data.get("password")
+            # Just created with this password, so it isn't hashed again to check it
+            login(request, user)
+            remember_group_ids(request, serializer.data["groups"])
+            return JsonResponse(
+                serializer.data,
+                status=status.HTTP_201_CREATED,
             )
-            if user is not None:
-                login(request, user)
-                return JsonResponse(
-                    serializer.data,
-                    status=status.HTTP_201_CREATED,
-                )
         raise ValidationError(serializer.errors)
 
 
@@ -44,10 +86,10 @@ class LoginView(APIView):
         user = authenticate(request, username=username, password=password)
         if user is not None:
             login(request, user)
-            return JsonResponse(
-                UserSerializer(user).data,
-                status=status.HTTP_200_OK,
-            )
+            data = UserSerializer(user).data
+            # The groups were just loaded, so purchases don't query them again
+            remember_group_ids(request, data["groups"])
+            return JsonResponse(data, status=status.HTTP_200_OK)
         raise ValidationError("Credenciais inválidas.")
 
 
@@ -65,21 +107,135 @@ class UserView(APIView):
         )
 
     def patch(self, request: Request):
-        serializer = UserSerializer(request.user, data=request.data, partial=True)
+        serializer = UserSerializer(
+            request.user,
+            data=request.data,
+            partial=True,
+            context={"can_set_groups": request.user.is_staff},
+        )
         if serializer.is_valid():
             serializer.save()
+            remember_group_ids(request, serializer.data["groups"])
             return JsonResponse(serializer.data, status=status.HTTP_200_OK)
         raise ValidationError(serializer.errors)
 
 
+def get_date_param(request: Request, name: str):
+    value = request.GET.get(name)
+    if not value:
+        return None
+    date = parse_datetime(value)
+    if date is None:
+        raise ValidationError(f"Data inválida no parâmetro {name}.")
+    return date
+
+
+def get_period(request: Request) -> str | None:
+    period = request.GET.get("period")
+    if period and period not in ("upcoming", "past"):
+        raise ValidationError("O parâmetro period tem de ser upcoming ou past.")
+    return period
+
+
+def filter_events(request: Request):
+    """
+    The events the user can see between the dates of the query string,
+    whatever the period, which changes as time passes
+    """
+    events = Event.objects.visible_to(request.user)
+    date_from = get_date_param(request, "from")
+    if date_from:
+        events = events.filter(date__gte=date_from)
+    date_to = get_date_param(request, "to")
+    if date_to:
+        events = events.filter(date__lte=date_to)
+    return events
+
+
+def get_event_listing(request: Request):
+    """
+    Applies the filters of the query string to the events the user can see.
+    Returns the events, the serializer to use and whether the most recent come
+    first, so the sync and async views list events the same way.
+    """
+    period = get_period(request)
+    events = filter_events(request)
+    if period == "upcoming":
+        events = events.upcoming()
+    elif period == "past":
+        events = events.past()
+
+    # Full representation (with ticket types) is only sent when asked for
+    if request.GET.get("detail") == "full":
+        events, serializer_class = events.with_ticket_types(), EventSerializer
+    else:
+        events, serializer_class = events.with_summary(), EventListSerializer
+
+    # Past events are shown most recent first
+    return events, serializer_class, period == "past"
+
+
+def get_purchases(request: Request):
+    tickets = Ticket.objects.filter(user=request.user).select_related(
+        "ticket_type__event"
+    )
+
+    event = request.GET.get("event")
+    if event:
+        try:
+            tickets = tickets.filter(ticket_type__event_id=int(event))
+        except ValueError:
+            raise ValidationError("O parâmetro event tem de ser um número.")
+    return tickets
+
+
+def check_admission(request: Request, event: Event):
+    """
+    Only lets buyers admitted by the waiting room of the event through, if it
+    has one. The waiting room must already be loaded with the event.
+    """
+    try:
+        waiting_room = event.waiting_room
+    except WaitingRoom.DoesNotExist:
+        return
+
+    token = request.data.get("queue_token")
+    entry = token and (
+        QueueEntry.objects.filter(
+            token=token, waiting_room=waiting_room, user=request.user
+        ).first()
+    )
+    if not entry:
+        raise PermissionDenied(
+            "Este evento tem fila de espera. Entre na fila para comprar bilhetes."
+        )
+    now = timezone.now()
+    if entry.has_expired(now):
+        raise PermissionDenied(
+            "A sua vez na fila de espera expirou. Volte a entrar na fila."
+        )
+    if not entry.is_admitted(now):
+        raise PermissionDenied("Ainda não chegou a sua vez na fila de espera.")
+
+
 class EventMultipleView(APIView):
+    @conditional(event_list_etag, event_list_last_modified)
     def get(self, request: Request):
-        if request.user.is_staff:
-            events = Event.objects.all()
-        else:
-            events = Event.objects.filter(is_visible=True)
-        serializer = EventSerializer(events, many=True)
-        return JsonResponse(serializer.data, status=status.HTTP_200_OK, safe=False)
+        return cached_response(
+            get_list_key(request, event_list_etag(request)),
+            lambda: self.list_events(request),
+        )
+
+    def list_events(self, request: Request):
+        events, serializer_class, descending = get_event_listing(request)
+        page, next_cursor = paginate_by_date(events, request, descending)
+        serializer = serializer_class(
+            page, many=True, context=eligibility_context(request)
+        )
+        return JsonResponse(
+            {"results": serializer.data, "next": next_cursor},
+            status=status.HTTP_200_OK,
+        )
 
     def post(self, request: Request):
         serializer = EventSerializer(data=request.data, partial=True)
@@ -91,16 +247,64 @@ class EventMultipleView(APIView):
         raise ValidationError(serializer.errors)
 
 
+class EventSearchView(APIView):
+    def get(self, request: Request):
+        events, order_by = search_events(
+            Event.objects.visible_to(request.user), request
+        )
+        page, next_cursor = paginate_by_score(events.only("id"), request, order_by)
+
+        # The summary subqueries only run for the page, not for every match
+        summaries = Event.objects.with_summary().in_bulk([event.id for event in page])
+        for event in page:
+            summary = summaries[event.id]
+            summary.rank = getattr(event, "rank", None)
+            summary.distance = getattr(event, "distance", None)
+        serializer = EventSearchSerializer(
+            [summaries[event.id] for event in page], many=True
+        )
+        return JsonResponse(
+            {"results": serializer.data, "next": next_cursor},
+            status=status.HTTP_200_OK,
+        )
+
+
+class EventBulkView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request: Request):
+        return StreamingHttpResponse(
+            export_events(Event.objects.all()), content_type="application/x-ndjson"
+        )
+
+    def post(self, request: Request):
+        # Read line by line from the raw stream instead of parsing request.data
+        report = import_events(request.stream or [])
+        status_code = (
+            status.HTTP_201_CREATED
+            if report["created"]
+            else status.HTTP_400_BAD_REQUEST
+        )
+        return JsonResponse(report, status=status_code)
+
+
 class EventSingleView(APIView):
-    def get_object(self, pk: int):
+    def get_object(self, pk: int, queryset=Event.objects):
         try:
-            return Event.objects.get(pk=pk)
+            return queryset.get(pk=pk)
         except Event.DoesNotExist:
             raise ValidationError("Evento não encontrado.")
 
+    @conditional(event_detail_etag, event_detail_last_modified)
     def get(self, request: Request, pk):
-        event = self.get_object(pk)
-        serializer = EventSerializer(event)
+        return cached_response(
+            get_detail_key(request, pk, event_detail_version(request, pk)),
+            lambda: self.retrieve_event(request, pk),
+        )
+
+    def retrieve_event(self, request: Request, pk: int):
+        event = self.get_object(pk, Event.objects.with_ticket_types())
+        serializer = EventDetailSerializer(event, context=eligibility_context(request))
         return JsonResponse(serializer.data, status=status.HTTP_200_OK, safe=False)
 
     def patch(self, request: Request, pk: int):
@@ -119,75 +323,337 @@ class EventSingleView(APIView):
                     "Não é possível excluir o evento, pois existem bilhetes associados."
                 )
         event.delete()
+        invalidate_listings()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
+class EventStatsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request: Request, pk: int):
+        """Sales and ratings of the event, read from the rollups"""
+        event = Event.objects.filter(pk=pk).only("id", "name").first()
+        if not event:
+            raise ValidationError("Evento não encontrado.")
+        return JsonResponse(event_stats(event), status=status.HTTP_200_OK)
+
+
+class StatsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request: Request):
+        """Sales and ratings of every event, most recent first"""
+        events = Event.objects.select_related("rating_rollup").only(
+            "id", "name", "date", "rating_rollup"
+        )
+        page, next_cursor = paginate_by_date(events, request, descending=True)
+        return JsonResponse(
+            {"results": events_stats(page), "next": next_cursor},
+            status=status.HTTP_200_OK,
+        )
+
+
+class EventReviewsView(APIView):
+    def get(self, request: Request, pk: int):
+        if not Event.objects.filter(pk=pk).exists():
+            raise ValidationError("Evento não encontrado.")
+        reviews = Ticket.objects.filter(
+            ticket_type__event_id=pk, rating__isnull=False
+        ).only("id", "rating", "rating_comment")
+        page, next_cursor = paginate_by_id(reviews, request)
+        serializer = TicketRatingSerializer(page, many=True)
+        return JsonResponse(
+            {"results": serializer.data, "next": next_cursor},
+            status=status.HTTP_200_OK,
+        )
+
+
 class PurchasesView(APIView):
     permission_classes = [IsAuthenticated]
 
+    @conditional(purchases_etag, purchases_last_modified)
     def get(self, request: Request):
-        tickets = Ticket.objects.filter(user=request.user)
-        serializer = TicketSerializer(tickets, many=True)
-        return JsonResponse(serializer.data, status=status.HTTP_200_OK, safe=False)
+        tickets = get_purchases(request)
+        page, next_cursor = paginate_by_id(tickets, request)
+        serializer = TicketSerializer(page, many=True)
+        return JsonResponse(
+            {"results": serializer.data, "next": next_cursor},
+            status=status.HTTP_200_OK,
+        )
 
     def post(self, request: Request):
-        serializer = TicketSerializer(data=request.data)
+        serializer = TicketSerializer(
+            data=request.data, context=eligibility_context(request)
+        )
         if serializer.is_valid():
-            ticket_type = serializer.validated_data["ticket_type"]
+            ticket_type: TicketType = serializer.validated_data["ticket_type"]
             quantity = serializer.validated_data.get("quantity")
+            check_admission(request, ticket_type.event)
+
+            with transaction.atomic():
+                if not reservations.take_seats(ticket_type, quantity):
+                    ticket_type.refresh_from_db(
+                        fields=["quantity_available", "tickets_sold"]
+                    )
+                    raise ValidationError(
+                        f"Sobram apenas {ticket_type.remaining} bilhetes deste tipo para compra."
+                    )
+
+                # Adds to the quantity of the existing ticket, if there is one
+                ticket_id, total = Ticket.add(request.user, ticket_type, quantity)
+                record_sale(ticket_type.pk, quantity)
+                Event.objects.filter(pk=ticket_type.event_id).touch()
+                invalidate_listings()
+                seats_changed([ticket_type.event_id])
+                # The rest of the work is done by a worker after the response
+                on_purchase_confirmed(ticket_id, quantity, total)
+
+            ticket = Ticket.objects.select_related("ticket_type__event").get(
+                pk=ticket_id
+            )
+            return Response(
+                TicketSerializer(ticket).data,
+                status=(
+                    status.HTTP_201_CREATED if total == quantity else status.HTTP_200_OK
+                ),
+            )
 
-            # Check if a ticket with the same type already exists for the user
-            existing_ticket = Ticket.objects.filter(
-                user=request.user, ticket_type=ticket_type
-            ).first()
-
-            if existing_ticket:
-                # Increase the quantity of the existing ticket
-                existing_ticket.quantity += quantity
-                existing_ticket.save()
-                updated_serializer = TicketSerializer(existing_ticket)
-                return Response(updated_serializer.data, status=status.HTTP_200_OK)
-            else:
-                # Create a new ticket
-                serializer.save(user=request.user)
-                return Response(serializer.data, status=status.HTTP_201_CREATED)
+        raise ValidationError(serializer.errors)
+
+
+class ReservationsView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request: Request):
+        held = (
+            Reservation.objects.active()
+            .filter(user=request.user)
+            .select_related("ticket_type__event")
+            .order_by("expires_at")
+        )
+        serializer = ReservationSerializer(held, many=True)
+        return JsonResponse({"results": serializer.data}, status=status.HTTP_200_OK)
+
+    def post(self, request: Request):
+        """Holds seats for RESERVATION_TTL seconds until they're confirmed"""
+        serializer = ReservationSerializer(
+            data=request.data, context=eligibility_context(request)
+        )
+        if serializer.is_valid():
+            ticket_type: TicketType = serializer.validated_data["ticket_type"]
+            check_admission(request, ticket_type.event)
+
+            reservation = reservations.hold(
+                request.user, ticket_type, serializer.validated_data["quantity"]
+            )
+            if reservation is None:
+                ticket_type.refresh_from_db(
+                    fields=["quantity_available", "tickets_sold"]
+                )
+                raise ValidationError(
+                    f"Sobram apenas {ticket_type.remaining} bilhetes deste tipo para compra."
+                )
+            return JsonResponse(
+                ReservationSerializer(reservation).data,
+                status=status.HTTP_201_CREATED,
+            )
 
         raise ValidationError(serializer.errors)
 
 
-class PurchaseSingleView(APIView):
+class ReservationSingleView(APIView):
     permission_classes = [IsAuthenticated]
 
-    def patch(self, request: Request, pk: int):
+    def delete(self, request: Request, pk: int):
+        if not reservations.cancel(request.user, pk):
+            raise ValidationError("Reserva não encontrada ou expirada.")
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class ReservationConfirmView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request: Request, pk: int):
+        result = reservations.confirm(request.user, pk)
+        if result is None:
+            raise ValidationError("Reserva não encontrada ou expirada.")
+
+        ticket_id, created = result
+        ticket = Ticket.objects.select_related("ticket_type__event").get(pk=ticket_id)
+        return Response(
+            TicketSerializer(ticket).data,
+            status=status.HTTP_201_CREATED if created else status.HTTP_200_OK,
+        )
+
+
+class WaitingRoomView(APIView):
+    def get_permissions(self):
+        if self.request.method == "POST":
+            return [IsAuthenticated()]
+        return [IsAdminUser()]
+
+    def get_waiting_room(self, pk: int) -> WaitingRoom:
         try:
-            ticket = Ticket.objects.get(pk=pk)
-        except Ticket.DoesNotExist:
-            raise ValidationError("Bilhete não encontrado.")
+            return WaitingRoom.objects.get(event_id=pk)
+        except WaitingRoom.DoesNotExist:
+            raise ValidationError("Este evento não tem fila de espera.")
+
+    def post(self, request: Request, pk: int):
+        """Joins the queue, or returns the entry the user already has"""
+        entry, created = self.get_waiting_room(pk).join(request.user)
+        serializer = QueueEntrySerializer(entry, context={"now": timezone.now()})
+        return JsonResponse(
+            serializer.data,
+            status=status.HTTP_201_CREATED if created else status.HTTP_200_OK,
+        )
+
+    def put(self, request: Request, pk: int):
+        """Opens the waiting room of the event, or changes its rate"""
+        if not Event.objects.filter(pk=pk).exists():
+            raise ValidationError("Evento não encontrado.")
+        serializer = WaitingRoomSerializer(data=request.data)
+        if serializer.is_valid():
+            WaitingRoom.objects.update_or_create(
+                event_id=pk, defaults=serializer.validated_data
+            )
+            return JsonResponse(serializer.data, status=status.HTTP_200_OK)
+        raise ValidationError(serializer.errors)
+
+    def delete(self, request: Request, pk: int):
+        self.get_waiting_room(pk).delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
 
-        if ticket.user != request.user:
-            raise PermissionDenied("Não tem permissão para editar este bilhete.")
 
-        rating = request.data.get("rating")
-        rating_comment = request.data.get("rating_comment")
+class QueueEntryView(APIView):
+    # The token identifies the buyer, so polling skips the session and user
+    authentication_classes = []
 
-        ticket.rating = rating
-        ticket.rating_comment = rating_comment
-        ticket.save()
+    def get(self, request: Request, token: str):
+        entry = (
+            QueueEntry.objects.select_related("waiting_room")
+            .filter(token=token)
+            .first()
+        )
+        if not entry:
+            raise ValidationError("Entrada na fila não encontrada.")
+
+        now = timezone.now()
+        serializer = QueueEntrySerializer(entry, context={"now": now})
+        response = JsonResponse(serializer.data, status=status.HTTP_200_OK)
+        if entry.admit_at > now:
+            # Tells clients when polling again is worth it
+            wait = (entry.admit_at - now).total_seconds()
+            response["Retry-After"] = max(1, min(30, int(wait)))
+        return response
+
+
+def get_own_ticket(request: Request, pk: int, queryset=Ticket.objects) -> Ticket:
+    try:
+        ticket = queryset.select_related("ticket_type__event", "user").get(pk=pk)
+    except Ticket.DoesNotExist:
+        raise ValidationError("Bilhete não encontrado.")
+
+    if ticket.user != request.user:
+        raise PermissionDenied("Não tem permissão para aceder a este bilhete.")
+    return ticket
+
+
+class PurchaseSingleView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def patch(self, request: Request, pk: int):
+        serializer = TicketRatingSerializer(data=request.data)
+        if not serializer.is_valid():
+            raise ValidationError(serializer.errors)
+        rating = serializer.validated_data.get("rating")
+        rating_comment = serializer.validated_data.get("rating_comment")
+
+        with transaction.atomic():
+            # Locked so the rollup moves the rating it replaces
+            ticket = get_own_ticket(
+                request, pk, Ticket.objects.select_for_update(of=("self",))
+            )
+            record_rating(ticket.ticket_type.event_id, ticket.rating, rating)
+            ticket.rating = rating
+            ticket.rating_comment = rating_comment
+            ticket.save(update_fields=["rating", "rating_comment", "updated_at"])
+        Event.objects.filter(pk=ticket.ticket_type.event_id).touch()
+        invalidate_listings()
 
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class UploadImageView(APIView):
+class TicketCodesView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request: Request, pk: int):
+        """The codes to show at the door, one per seat of the ticket"""
+        ticket = get_own_ticket(request, pk)
+        return JsonResponse({"codes": get_codes(ticket)}, status=status.HTTP_200_OK)
+
+
+class TicketPdfView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request: Request, pk: int):
+        ticket = get_own_ticket(request, pk)
+        return HttpResponse(
+            render_pdf(ticket),
+            content_type="application/pdf",
+            headers={
+                "Content-Disposition": f'attachment; filename="bilhetes-{pk}.pdf"'
+            },
+        )
+
+
+class CheckInView(APIView):
+    permission_classes = [IsAdminUser]
+
     def post(self, request: Request):
+        """Checks in a batch of codes scanned at the door of an event"""
+        event_id = request.data.get("event")
+        codes = request.data.get("codes")
+        if not isinstance(event_id, int):
+            raise ValidationError("Indique o evento.")
+        if not isinstance(codes, list) or not codes:
+            raise ValidationError("Indique os códigos lidos.")
+        if len(codes) > settings.CHECKIN_MAX_BATCH:
+            raise ValidationError(
+                f"Não pode enviar mais de {settings.CHECKIN_MAX_BATCH} códigos de cada vez."
+            )
 
-        if request.FILES and request.FILES.get("image"):
-            uploaded_file = request.FILES["image"]
+        results = check_in(event_id, codes, request.user)
+        admitted = sum(result["status"] == ADMITTED for result in results)
+        return JsonResponse(
+            {"admitted": admitted, "results": results}, status=status.HTTP_200_OK
+        )
 
-            filename = f"upload_{uploaded_file.name}"
 
-            fs = FileSystemStorage(location=MEDIA_ROOT)
-            saved_path = fs.save(filename, uploaded_file)
+class CacheStatsView(APIView):
+    permission_classes = [IsAdminUser]
 
-            return JsonResponse({"image_path": f"/images/{saved_path}"})
+    def get(self, request: Request):
+        return JsonResponse(dict(cache_stats), status=status.HTTP_200_OK)
+
+
+class UploadImageView(APIView):
+    def initialize_request(self, request, *args, **kwargs):
+        # Before authentication reads the body for the CSRF token
+        self.upload_limit = UploadLimitHandler(request)
+        request.upload_handlers.insert(0, self.upload_limit)
+        return super().initialize_request(request, *args, **kwargs)
+
+    def post(self, request: Request):
+        image = request.FILES.get("image")
+        if self.upload_limit.too_large:
+            raise too_large_error()
+        if image:
+            image_path, _ = save_upload(image)
+            return JsonResponse(
+                {
+                    "image_path": image_path,
+                    "image_variants": get_variant_urls(image_path),
+                }
+            )
 
         raise ValidationError("No file uploaded")
@@ -5,11 +5,13 @@ import LoginModal from "../components/LoginModal.tsx"
 import SignupModal from "../components/SignupModal.tsx"
 import { useAuth } from "../contexts/AuthContext"
 import {
+	fallbackToOriginal,
 	fetchWithCSRF,
 	getErrorMessage,
 	type APIError,
 	type Event,
-	type EditableEvent,
+	type Page,
+	type Review,
 	type Ticket,
 	type TicketPostData,
 	type TicketType,
@@ -17,7 +19,7 @@ import {
 
 function EventDetails() {
 	const { id } = useParams<{ id: string }>()
-	const [event, setEvent] = useState<EditableEvent | null>(null)
+	const [event, setEvent] = useState<Event | null>(null)
 	const [eventTicket, setEventTicket] = useState<Ticket | null>(null)
 	const [showLogin, setShowLogin] = useState(false)
 	const [showSignup, setShowSignup] = useState(false)
@@ -51,40 +53,62 @@ function EventDetails() {
 
 	const fetchEvaluations = async () => {
 		try {
-			const response = await fetch(`http://localhost:8000/api/events/${id}/`),
-				eventData: APIError | Event = await response.json()
-			if ("errors" in eventData) throw new Error(getErrorMessage(eventData))
+			const response = await fetch(`http://localhost:8000/api/events/${id}/reviews/?limit=100`),
+				reviewsData: APIError | Page<Review> = await response.json()
+			if ("errors" in reviewsData) throw new Error(getErrorMessage(reviewsData))
 
-			const allTickets = eventData.ticket_types
-				.flatMap((type: TicketType) => type.tickets || [])
-				.filter((ticket: Ticket) => ticket.rating !== null)
-				.map((ticket: Ticket) => ({
-					stars: ticket.rating,
-					comment: ticket.rating_comment,
+			setEvaluations(
+				reviewsData.results.map((review: Review) => ({
+					stars: review.rating,
+					comment: review.rating_comment,
 				}))
-			setEvaluations(allTickets)
+			)
 		} catch (err) {
 			setError(err.message)
 		}
 	}
 
-	useEffect(() => {
-		fetch(`http://localhost:8000/api/events/${id}/`)
+	const fetchEvent = () =>
+		fetch(`http://localhost:8000/api/events/${id}/`, { credentials: "include" })
 			.then(res => res.json())
 			.then(data => {
 				setEvent(data)
 				fetchEvaluations()
 			})
 			.catch(err => setError(err.message))
-			.finally(() => setLoading(false))
+
+	useEffect(() => {
+		fetchEvent().finally(() => setLoading(false))
+	}, [id, user])
+	useEffect(() => {
+		// Keeps the remaining seats up to date while the page is open
+		const source = new EventSource(`http://localhost:8000/api/events/${id}/availability/stream/`, {
+			withCredentials: true,
+		})
+		source.addEventListener("seats", message => {
+			const seats: { ticket_types: Pick<TicketType, "id" | "remaining">[] } = JSON.parse(message.data),
+				remaining = new Map(seats.ticket_types.map(type => [type.id, type.remaining]))
+			setEvent(event =>
+				event
+					? {
+							...event,
+							ticket_types: event.ticket_types.map(type => ({
+								...type,
+								remaining: remaining.get(type.id) ?? type.remaining,
+							})),
+						}
+					: event
+			)
+		})
+		return () => source.close()
 	}, [id])
 	useEffect(() => {
-		fetchWithCSRF(`http://localhost:8000/api/purchases/`, {
+		fetchWithCSRF(`http://localhost:8000/api/purchases/?event=${id}&limit=1`, {
 			credentials: "include",
 		})
 			.then(r => r.json())
-			.then((tickets: Ticket[]) =>
-				setEventTicket(tickets.find(t => t.ticket_type.event.id === Number(id)) || null)
+			.then((tickets: APIError | Page<Ticket>) =>
+				setEventTicket("results" in tickets ? tickets.results[0] || null : null)
 			)
 	}, [evaluations])
 
@@ -156,7 +180,7 @@ function EventDetails() {
 			setSelectedStars(0)
 			form.reset()
 
-			await fetchEvaluations()
+			await fetchEvent()
 		} catch (err) {
 			setError(err.message)
 		}
@@ -206,7 +230,8 @@ function EventDetails() {
 				{event.image && (
 					<Card.Img
 						variant="top"
-						src={"http://localhost:8000" + event.image}
+						src={"http://localhost:8000" + (event.image_variants?.full ?? event.image)}
+						onError={fallbackToOriginal("http://localhost:8000" + event.image)}
 						alt={event.name}
 						style={{ objectFit: "cover" }}
 					/>
@@ -265,10 +290,10 @@ function EventDetails() {
 											Selecione um tipo de bilhete
 										</option>
 										{event.ticket_types
-											.filter(type => type.groups.some(role => user.groups.includes(role)))
+											.filter(type => type.can_purchase)
 											.map((type, index) => (
-												<option key={index} value={type.id}>
-													{type.name} – €{type.price}
+												<option key={index} value={type.id} disabled={type.remaining <= 0}>
+													{type.name} – €{type.price} ({type.remaining} disponíveis)
 												</option>
 											))}
 									</select>
@@ -384,6 +409,12 @@ function EventDetails() {
 				<div ref={evaluationsRef} className="mb-4 mt-4">
 					<div className="mt-4">
 						<h5>Avaliações</h5>
+						{event.rating_summary && event.rating_summary.count > 0 && (
+							<p className="text-muted">
+								Média: {event.rating_summary.average?.toFixed(1)}/5 ({event.rating_summary.count}{" "}
+								avaliações)
+							</p>
+						)}
 						{evaluations.length === 0 ? (
 							<p>Sem avaliações ainda.</p>
 						) : (
@@ -1,41 +1,63 @@
 import { useEffect, useState } from "react"
-import { Card, Row, Col, Spinner } from "react-bootstrap"
+import { Button, Card, Row, Col, Spinner } from "react-bootstrap"
 import { useNavigate } from "react-router"
-import type { Event } from "../utils"
+import { fallbackToOriginal, type EventSummary, type Page } from "../utils"
+
+type Period = "upcoming" | "past"
+
+function fetchEventsPage(period: Period, cursor: string | null): Promise<Page<EventSummary>> {
+	const params = new URLSearchParams({ period })
+	if (cursor) params.set("cursor", cursor)
+	return fetch(`http://localhost:8000/api/events/?${params}`).then(res => res.json())
+}
 
 function Home() {
-	const [events, setEvents] = useState<Event[]>([])
+	const [upcomingEvents, setUpcomingEvents] = useState<EventSummary[]>([])
+	const [pastEvents, setPastEvents] = useState<EventSummary[]>([])
+	const [nextCursors, setNextCursors] = useState<Record<Period, string | null>>({ upcoming: null, past: null })
 	const navigate = useNavigate()
 	const [loading, setLoading] = useState(true)
 
 	useEffect(() => {
-		fetch("http://localhost:8000/api/events/")
-			.then(res => res.json())
-			.then(data => setEvents(data))
+		Promise.all([fetchEventsPage("upcoming", null), fetchEventsPage("past", null)])
+			.then(([upcoming, past]) => {
+				setUpcomingEvents(upcoming.results)
+				setPastEvents(past.results)
+				setNextCursors({ upcoming: upcoming.next, past: past.next })
+			})
 			.catch(err => console.error("Failed to load events", err))
 			.finally(() => setLoading(false))
 	}, [])
 
-	if (loading) return <Spinner animation="border" />
+	const loadMore = (period: Period) => {
+		const setEvents = period === "upcoming" ? setUpcomingEvents : setPastEvents
+		fetchEventsPage(period, nextCursors[period])
+			.then(page => {
+				setEvents(events => [...events, ...page.results])
+				setNextCursors(cursors => ({ ...cursors, [period]: page.next }))
+			})
+			.catch(err => console.error("Failed to load events", err))
+	}
 
-	const now = Date.now()
-	const upcomingEvents = events.filter(e => Date.parse(e.date) > now)
-	const pastEvents = events.filter(e => Date.parse(e.date) <= now)
+	if (loading) return <Spinner animation="border" />
 
-	const renderEventCard = (event: Event) => (
+	const renderEventCard = (event: EventSummary) => (
 		<Col key={event.id} md={4} className="mb-4">
 			<Card onClick={() => navigate(`/event/${event.id}`)} style={{ cursor: "pointer" }}>
 				{event.image && (
 					<Card.Img
 						variant="top"
-						src={"http://localhost:8000" + event.image}
+						src={"http://localhost:8000" + (event.image_variants?.card ?? event.image)}
+						onError={fallbackToOriginal("http://localhost:8000" + event.image)}
+						loading="lazy"
 						alt={event.name}
 						style={{ objectFit: "cover" }}
 					/>
 				)}
 				<Card.Body>
 					<Card.Title>{event.name}</Card.Title>
-					<Card.Text>{event.description}</Card.Text>
+					<Card.Text>{event.location}</Card.Text>
+					{event.min_price !== null && <Card.Text>Desde €{event.min_price}</Card.Text>}
 					<Card.Text className="text-muted">
 						{new Date(event.date).toLocaleString("pt", { dateStyle: "short", timeStyle: "short" })}
 					</Card.Text>
@@ -44,13 +66,22 @@ function Home() {
 		</Col>
 	)
 
+	const renderLoadMore = (period: Period) =>
+		nextCursors[period] && (
+			<Button variant="outline-primary" onClick={() => loadMore(period)}>
+				Ver mais
+			</Button>
+		)
+
 	return (
 		<div>
 			<h2 className="mb-4">Próximos Eventos</h2>
 			<Row>{upcomingEvents.length > 0 ? upcomingEvents.map(renderEventCard) : <p>Nenhum evento futuro.</p>}</Row>
+			{renderLoadMore("upcoming")}
 
 			<h2 className="mt-5 mb-4">Eventos Passados</h2>
 			<Row>{pastEvents.length > 0 ? pastEvents.map(renderEventCard) : <p>Nenhum evento passado.</p>}</Row>
+			{renderLoadMore("past")}
 		</div>
 	)
 }
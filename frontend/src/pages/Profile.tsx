@@ -2,24 +2,28 @@ import { useEffect, useState } from "react"
 import { Button, Card, Table, Spinner, Alert } from "react-bootstrap"
 import { useNavigate } from "react-router"
 import { useAuth } from "../contexts/AuthContext"
-import { fetchWithCSRF, getErrorMessage, type APIError, type Ticket } from "../utils"
+import { fetchWithCSRF, getErrorMessage, type APIError, type Page, type Ticket } from "../utils"
 
 function Profile() {
 	const [purchases, setPurchases] = useState<Ticket[]>([])
+	const [nextCursor, setNextCursor] = useState<string | null>(null)
 	const [loading, setLoading] = useState(true)
 	const { user } = useAuth()
 	const navigate = useNavigate()
 
-	useEffect(() => {
-		fetchWithCSRF("http://localhost:8000/api/purchases/", {
+	const fetchPurchases = (cursor: string | null) =>
+		fetchWithCSRF(`http://localhost:8000/api/purchases/${cursor ? `?cursor=${cursor}` : ""}`, {
 			method: "GET",
 			credentials: "include",
+		}).then(async res => {
+			const responseData: APIError | Page<Ticket> = await res.json()
+			if ("errors" in responseData) throw new Error(getErrorMessage(responseData))
+			setPurchases(purchases => [...purchases, ...responseData.results])
+			setNextCursor(responseData.next)
 		})
-			.then(async res => {
-				const responseData: APIError | Ticket[] = await res.json()
-				if ("errors" in responseData) throw new Error(getErrorMessage(responseData))
-				setPurchases(responseData)
-			})
+
+	useEffect(() => {
+		fetchPurchases(null)
 			.catch(() => {
 				setPurchases([])
 			})
@@ -65,13 +69,14 @@ function Profile() {
 						<th>Tipo de Bilhete</th>
 						<th>Quantidade</th>
 						<th>Preço por Bilhete</th>
+						<th>Bilhetes</th>
 					</tr>
 				</thead>
 				<tbody>
 					{purchases.length > 0 ? (
 						purchases.map((purchase: Ticket) => (
 							<tr key={purchase.id}>
-								<td>{purchase.ticket_type.event.name}</td>
+								<td>{purchase.event.name}</td>
 								<td>
 									{new Date(purchase.purchase_date).toLocaleString("pt", {
 										dateStyle: "short",
@@ -81,15 +86,29 @@ function Profile() {
 								<td>{purchase.ticket_type.name}</td>
 								<td>{purchase.quantity}</td>
 								<td>{purchase.ticket_type.price} €</td>
+								<td>
+									<Button
+										variant="outline-primary"
+										size="sm"
+										href={`http://localhost:8000/api/purchase/${purchase.id}/pdf/`}
+									>
+										Descarregar
+									</Button>
+								</td>
 							</tr>
 						))
 					) : (
 						<tr>
-							<td colSpan={5}>Sem histórico disponível</td>
+							<td colSpan={6}>Sem histórico disponível</td>
 						</tr>
 					)}
 				</tbody>
 			</Table>
+			{nextCursor && (
+				<Button variant="outline-primary" onClick={() => fetchPurchases(nextCursor).catch(() => {})}>
+					Ver mais
+				</Button>
+			)}
 		</div>
 	)
 }
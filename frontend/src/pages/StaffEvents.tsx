@@ -3,11 +3,21 @@ import { Table, Button, Modal, Spinner, ListGroup, Toast } from "react-bootstrap
 import { useNavigate } from "react-router"
 import { useAuth } from "../contexts/AuthContext"
 import EventForm from "../components/EventForm"
-import { fetchWithCSRF, getErrorMessage, isStaff, type APIError, type EditableEvent, type Event } from "../utils"
+import {
+	fetchWithCSRF,
+	getErrorMessage,
+	isStaff,
+	type APIError,
+	type EditableEvent,
+	type Event,
+	type EventSales,
+	type Page,
+} from "../utils"
 
 function StaffEvents() {
 	const navigate = useNavigate()
 	const [events, setEvents] = useState<Event[]>([])
+	const [sales, setSales] = useState<Record<number, EventSales>>({})
 	const [showEditModal, setShowEditModal] = useState(false)
 	const [showCreateModal, setShowCreateModal] = useState(false)
 	const [selectedEvent, setSelectedEvent] = useState<EditableEvent | null>(null)
@@ -16,16 +26,42 @@ function StaffEvents() {
 	const { user } = useAuth()
 
 	const fetchEvents = async () => {
-		const response = await fetchWithCSRF("http://localhost:8000/api/events/", {
-				credentials: "include",
-			}),
-			responseData: APIError | Event[] = await response.json()
-		if ("errors" in responseData) throw new Error(getErrorMessage(responseData))
-		setEvents(responseData)
+		const allEvents: Event[] = []
+		let cursor: string | null = null
+		do {
+			const params = new URLSearchParams({ detail: "full", limit: "100" })
+			if (cursor) params.set("cursor", cursor)
+			const response = await fetchWithCSRF(`http://localhost:8000/api/events/?${params}`, {
+					credentials: "include",
+				}),
+				responseData: APIError | Page<Event> = await response.json()
+			if ("errors" in responseData) throw new Error(getErrorMessage(responseData))
+			allEvents.push(...responseData.results)
+			cursor = responseData.next
+		} while (cursor)
+		setEvents(allEvents)
+	}
+
+	const fetchSales = async () => {
+		const allSales: Record<number, EventSales> = {}
+		let cursor: string | null = null
+		do {
+			const params = new URLSearchParams({ limit: "100" })
+			if (cursor) params.set("cursor", cursor)
+			const response = await fetchWithCSRF(`http://localhost:8000/api/stats/?${params}`, {
+					credentials: "include",
+				}),
+				responseData: APIError | Page<EventSales> = await response.json()
+			if ("errors" in responseData) throw new Error(getErrorMessage(responseData))
+			for (const eventSales of responseData.results) allSales[eventSales.id] = eventSales
+			cursor = responseData.next
+		} while (cursor)
+		setSales(allSales)
 	}
 
 	useEffect(() => {
 		fetchEvents()
+		fetchSales().catch(() => {})
 	}, [])
 
 	// Don't render anything while checking Staff status
@@ -199,6 +235,7 @@ function StaffEvents() {
 						<th>Localização</th>
 						<th>Visível</th>
 						<th>Tipos de Bilhete</th>
+						<th>Vendas</th>
 						<th>Ações</th>
 					</tr>
 				</thead>
@@ -235,6 +272,19 @@ function StaffEvents() {
 									))}
 								</ListGroup>
 							</td>
+							<td>
+								{sales[event.id] && (
+									<>
+										<div>{sales[event.id].tickets_sold} bilhetes</div>
+										<div>€{sales[event.id].revenue}</div>
+										<div>
+											{sales[event.id].ratings.average !== null
+												? `${sales[event.id].ratings.average?.toFixed(1)} ★ (${sales[event.id].ratings.count})`
+												: "Sem avaliações"}
+										</div>
+									</>
+								)}
+							</td>
 							<td>
 								<Button variant="warning" size="sm" className="me-2" onClick={() => handleEdit(event)}>
 									Editar
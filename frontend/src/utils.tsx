@@ -37,6 +37,13 @@ export function getErrorMessage(error: APIError) {
 	return "An unknown error occurred"
 }
 
+// Variants are resized in the background, so they may not exist for a moment after upload
+export function fallbackToOriginal(original: string) {
+	return (e: React.SyntheticEvent<HTMLImageElement>) => {
+		if (e.currentTarget.src !== original) e.currentTarget.src = original
+	}
+}
+
 export function isStaff(user: User): boolean {
 	return user.groups.includes(UserRole.Staff)
 }
@@ -78,6 +85,7 @@ export interface Event {
 	id: number
 	name: string
 	image?: string
+	image_variants: ImageVariants | null
 	description: string
 	date: string
 	location: string
@@ -85,6 +93,49 @@ export interface Event {
 	longitude: number
 	is_visible: boolean
 	ticket_types: TicketType[]
+	rating_summary?: RatingSummary
+}
+
+export interface RatingSummary {
+	count: number
+	average: number | null
+	histogram: Record<1 | 2 | 3 | 4 | 5, number>
+}
+
+export interface EventSales {
+	id: number
+	name: string
+	date: string
+	tickets_sold: number
+	revenue: string
+	ratings: RatingSummary
+}
+
+export interface Review {
+	rating: number
+	rating_comment: string
+}
+
+export interface ImageVariants {
+	thumb: string
+	card: string
+	full: string
+}
+
+export interface EventSummary {
+	id: number
+	name: string
+	image?: string
+	image_variants: ImageVariants | null
+	date: string
+	location: string
+	min_price: string | null
+	remaining: number
+}
+
+export interface Page<T> {
+	results: T[]
+	next: string | null
 }
 
 export interface EditableEvent extends EventPostData {
@@ -92,13 +143,16 @@ export interface EditableEvent extends EventPostData {
 }
 
 export interface TicketType {
-	event: Event
+	event: Pick<Event, "id" | "name" | "date" | "location">
 	id: number
 	name: string
 	price: number
 	quantity_available: number
-	tickets: Ticket[]
+	remaining: number
+	// Only sent to staff
 	groups: UserRole[]
+	// Whether the logged in user's groups can buy it
+	can_purchase?: boolean
 }
 
 export interface EventPostData {
@@ -129,8 +183,8 @@ export interface TicketPostData {
 
 export interface Ticket {
 	id: number
-	ticket_type: TicketType
-	user: User
+	ticket_type: Pick<TicketType, "id" | "name" | "price">
+	event: Pick<Event, "id" | "name" | "date" | "location">
 	purchase_date: Date
 	quantity: number
 	rating: number